@@ -0,0 +1,10 @@
+// Tailwind CSS v3 configuration for static/css/tailwind.css. Rebuild it from
+// the repository root after changing classes in the page or in app.js:
+//   tailwindcss -c assets/tailwind.config.js -i assets/tailwind.input.css -o static/css/tailwind.css --minify
+module.exports = {
+  content: ['./wheres_the_well_app.py', './static/js/app.js'],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+}
@@ -0,0 +1,142 @@
+"""
+Check water quality analysis against the original per-pixel statistics.
+
+Classifies a reference set of photos with WaterQualityClassifier and with
+the statistics computed the way the first release did, in NumPy over every
+pixel, checks that every photo gets the same classification, and reports the
+latency of each.
+
+Usage:
+    python benchmarks/bench_classifier.py [photo_dir]
+
+Without photo_dir a synthetic 12-megapixel reference set is generated. It
+includes scenes with fine speckle and grain, whose turbidity any averaging
+of neighbouring pixels would flatten, which is why photos are analyzed at
+full resolution rather than from a downscaled or draft decode.
+"""
+import os
+import sys
+import time
+import base64
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from wheres_the_well_app import WaterQualityClassifier, ImageStats
+
+REFERENCE_SIZE = (4000, 3000)
+REPEATS = 3
+
+def smooth_noise(rng, size, cells, amplitude):
+    """Low-frequency texture like ripples, silt clouds and reflections"""
+    width, height = size
+    coarse = rng.normal(0, amplitude, (cells, cells * width // height)).astype(np.float32)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+
+def speckle_noise(rng, size, cell, amplitude):
+    """High-frequency texture like silt flecks or algae specks, cell pixels across"""
+    width, height = size
+    fine = rng.normal(0, amplitude, (height // cell, width // cell)).astype(np.float32)
+    return cv2.resize(fine, (width, height), interpolation=cv2.INTER_NEAREST)
+
+def synthetic_photo(rng, base_rgb, texture, speckle=None, grain=4):
+    """
+    A water-like scene: a base color with smooth texture, optional speckle
+    given as (cell, amplitude), a gradient and sensor grain
+    """
+    width, height = REFERENCE_SIZE
+    gradient = np.linspace(-15, 15, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), dtype=np.float32)
+    shared = smooth_noise(rng, REFERENCE_SIZE, 8, texture)
+    if speckle:
+        shared += speckle_noise(rng, REFERENCE_SIZE, *speckle)
+    for channel, value in enumerate(base_rgb):
+        img[:, :, channel] = value + shared + gradient
+    img += rng.normal(0, grain, img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def synthetic_reference_set():
+    rng = np.random.default_rng(42)
+    scenes = {
+        'clear_blue_lake': ((70, 120, 190), 8),
+        'bright_tap_water': ((150, 170, 210), 6),
+        'muddy_river': ((150, 115, 60), 12),
+        'silty_pond': ((130, 110, 70), 25),
+        'dark_stagnant_pool': ((30, 35, 30), 10),
+        'algae_bloom': ((60, 140, 70), 15),
+        'rusty_runoff': ((170, 90, 60), 10),
+        'choppy_grey_water': ((110, 115, 120), 45),
+        'speckled_blue_water': ((90, 120, 170), 4, (4, 45)),
+        'grainy_blue_water': ((80, 130, 190), 4, (1, 36)),
+        'silt_flecked_grey_water': ((110, 115, 125), 6, (2, 60)),
+    }
+    photos = {}
+    for name, (base_rgb, texture, *speckle) in scenes.items():
+        output = io.BytesIO()
+        photo = synthetic_photo(rng, base_rgb, texture, *speckle)
+        Image.fromarray(photo).save(output, 'JPEG', quality=90)
+        photos[name] = output.getvalue()
+    return photos
+
+def load_reference_set(photo_dir):
+    photos = {}
+    for filename in sorted(os.listdir(photo_dir)):
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+            with open(os.path.join(photo_dir, filename), 'rb') as f:
+                photos[filename] = f.read()
+    return photos
+
+def reference_stats(image_bytes):
+    """ImageStats computed the way the first release did"""
+    img_array = np.array(Image.open(io.BytesIO(image_bytes)).convert('RGB'))
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    red_channel = img_array[:, :, 0]
+    green_channel = img_array[:, :, 1]
+    blue_channel = img_array[:, :, 2]
+    brown_pixels = np.sum((red_channel > 100) & (green_channel > 80) & (blue_channel < 80))
+    return ImageStats(
+        brightness=np.mean(gray),
+        turbidity=np.std(gray),
+        red_mean=np.mean(red_channel),
+        green_mean=np.mean(green_channel),
+        blue_mean=np.mean(blue_channel),
+        brown_ratio=brown_pixels / (img_array.shape[0] * img_array.shape[1])
+    )
+
+def best_time(analyze):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = analyze()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    photos = load_reference_set(sys.argv[1]) if len(sys.argv) > 1 else synthetic_reference_set()
+    classifier = WaterQualityClassifier()
+
+    print(f"{'photo':<24} {'first release':<24} classifier")
+    mismatches = 0
+    reference_total = current_total = 0
+    for name, image_bytes in photos.items():
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode()
+        (ref_level, ref_conf), ref_time = best_time(
+            lambda: classifier.classify(reference_stats(base64.b64decode(data_url.split(',')[1]))))
+        (level, conf), current_time = best_time(lambda: classifier.analyze_water_image(data_url))
+        reference_total += ref_time
+        current_total += current_time
+        match = ref_level == level and abs(ref_conf - conf) < 1e-9
+        mismatches += not match
+        print(f"{name:<24} {ref_level:<12} {ref_time * 1000:7.1f} ms  "
+              f"{level:<12} {current_time * 1000:7.1f} ms  {'ok' if match else 'MISMATCH'}")
+
+    print(f"\nTotal: {reference_total * 1000:.0f} ms first release, {current_total * 1000:.0f} ms classifier "
+          f"({reference_total / current_total:.1f}x faster), {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
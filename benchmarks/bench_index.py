@@ -0,0 +1,62 @@
+"""
+Compare serving the page by rendering it per request with the cached page.
+
+Registers the old handler, which ran render_template_string(HTML_TEMPLATE)
+on every request, next to the current index route and reports the
+requests per second of each through the WSGI test client, for each
+Accept-Encoding a browser might send and for conditional requests.
+
+Usage:
+    python benchmarks/bench_index.py [seconds_per_case]
+"""
+import os
+import sys
+import time
+import tempfile
+
+# The app opens its database on the first request; keep it out of the working directory
+os.environ.setdefault('WELL_DATABASE', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from flask import render_template_string
+from wheres_the_well_app import app, HTML_TEMPLATE, asset_url
+
+DEFAULT_SECONDS = 2.0
+ENCODINGS = ['identity', 'gzip', 'gzip, deflate, br']
+
+def render_per_request():
+    return render_template_string(HTML_TEMPLATE, asset_url=asset_url, tile_url=app.config['TILE_URL'])
+
+def requests_per_second(client, path, headers, seconds):
+    # Check the response once, then count how many fit in the time budget
+    response = client.get(path, headers=headers)
+    status, size = response.status_code, len(response.data)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        client.get(path, headers=headers).close()
+        count += 1
+    return count / (time.perf_counter() - start), status, size
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SECONDS
+    app.add_url_rule('/bench/render-per-request', 'render_per_request', render_per_request)
+    client = app.test_client()
+    client.get('/')  # initialize the database and build the page
+
+    print(f"{'Accept-Encoding':<20} {'per request':>16} {'cached':>16} {'speedup':>8}  bytes")
+    for encoding in ENCODINGS:
+        headers = {'Accept-Encoding': encoding}
+        before, _, before_size = requests_per_second(client, '/bench/render-per-request', headers, seconds)
+        after, _, after_size = requests_per_second(client, '/', headers, seconds)
+        print(f"{encoding:<20} {before:>12.0f} r/s {after:>12.0f} r/s {after / before:>7.1f}x  "
+              f"{before_size} -> {after_size}")
+
+    headers = {'Accept-Encoding': ENCODINGS[-1]}
+    headers['If-None-Match'] = client.get('/', headers=headers).headers['ETag']
+    revalidated, status, _ = requests_per_second(client, '/', headers, seconds)
+    print(f"\nConditional request with the page's ETag: {revalidated:.0f} r/s (HTTP {status})")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Check that a database created by the first release upgrades through every migration.
+
+Builds a database with the original schema and a few rows in each table,
+including a source whose photo is stored inline, then applies the migration
+chain the way the first request does and checks that every migration was
+recorded, that the vote counters match the votes and that the read
+endpoints answer.
+
+Usage:
+    python benchmarks/check_upgrade.py
+"""
+import os
+import io
+import sys
+import base64
+import sqlite3
+import tempfile
+
+# Keep the database and photo store out of the working directory
+work_dir = tempfile.mkdtemp()
+os.environ['WELL_DATABASE'] = os.path.join(work_dir, 'upgrade.db')
+os.environ['WELL_PHOTO_DIR'] = os.path.join(work_dir, 'photos')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PIL import Image
+from wheres_the_well_app import app, MIGRATIONS, connect_db, schema_version
+
+# Schema of the first release, which created its tables without a user_version
+BASELINE_SCHEMA = '''
+    CREATE TABLE water_sources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        water_type TEXT,
+        cleanliness_level TEXT,
+        confidence_score REAL,
+        notes TEXT,
+        photo_data TEXT,
+        added_by TEXT DEFAULT 'Anonymous',
+        admin_override TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE votes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        water_source_id INTEGER,
+        username TEXT NOT NULL,
+        vote_type TEXT CHECK(vote_type IN ('upvote', 'downvote')),
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (water_source_id) REFERENCES water_sources (id),
+        UNIQUE(water_source_id, username)
+    );
+    CREATE TABLE comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        water_source_id INTEGER,
+        username TEXT NOT NULL,
+        comment TEXT NOT NULL,
+        is_admin BOOLEAN DEFAULT FALSE,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (water_source_id) REFERENCES water_sources (id)
+    );
+    CREATE TABLE alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        alert_type TEXT DEFAULT 'warning',
+        added_by TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+def photo_data_url():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (70, 110, 160)).save(buffer, 'JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+def create_baseline_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('''
+        INSERT INTO water_sources (name, latitude, longitude, water_type, cleanliness_level,
+                                   confidence_score, notes, photo_data, added_by)
+        VALUES (?, ?, ?, 'well', 'clean', 0.8, '', ?, 'tester')
+    ''', [('Village well', -1.28, 36.82, photo_data_url()), ('River intake', -1.30, 36.85, '')])
+    conn.executemany('INSERT INTO votes (water_source_id, username, vote_type) VALUES (?, ?, ?)',
+                     [(1, 'a', 'upvote'), (1, 'b', 'upvote'), (1, 'c', 'downvote'), (2, 'a', 'downvote')])
+    conn.execute("INSERT INTO comments (water_source_id, username, comment) VALUES (1, 'a', 'Tastes fine')")
+    conn.execute("INSERT INTO alerts (title, message, latitude, longitude, added_by) "
+                 "VALUES ('Flooding', 'Road closed', -1.29, 36.83, 'admin')")
+    conn.commit()
+    conn.close()
+
+def main():
+    create_baseline_db(app.config['DATABASE'])
+    failures = []
+
+    client = app.test_client()
+    for path in ['/get_water_sources', '/get_water_source_details/1', '/get_votes/1',
+                 '/get_comments/1', '/get_alerts', '/water_source/1/full', '/sync']:
+        status = client.get(path).status_code
+        print(f"GET {path}: {status}")
+        if status != 200:
+            failures.append(f"GET {path} returned {status}")
+
+    conn = connect_db()
+    version = schema_version(conn)
+    print(f"Schema version: {version}")
+    if version != MIGRATIONS[-1].version:
+        failures.append(f"schema version {version}, expected {MIGRATIONS[-1].version}")
+    counters = [tuple(row) for row in conn.execute('SELECT upvotes, downvotes FROM water_sources ORDER BY id')]
+    print(f"Vote counters: {counters}")
+    if counters != [(2, 1), (0, 1)]:
+        failures.append(f"vote counters {counters}, expected [(2, 1), (0, 1)]")
+    if conn.execute('SELECT COUNT(*) FROM photos').fetchone()[0] != 1:
+        failures.append('the inline photo was not moved into the photo store')
+    conn.close()
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
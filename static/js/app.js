@@ -0,0 +1,1347 @@
+// Global variables
+let map;
+let userLocationMarker;
+let waterSourceMarkers = new Map();  // water source id -> marker
+let alertMarkers = new Map();  // alert id -> marker
+let alertsById = new Map();
+let syncSeq = null;  // last change applied, from /sync
+let selectedLatLng = null;
+let currentPhotoData = null;
+let currentPhotoToken = null;
+let currentUsername = null;
+let userLocation = null;
+let isAdmin = false;
+let alertMode = false;
+
+// Initialize app when page loads
+document.addEventListener('DOMContentLoaded', function() {
+    checkLogin();
+});
+
+// Keep the app and the data last seen available offline
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js')
+        .catch(error => console.error('Error registering service worker:', error));
+    });
+}
+
+// Check if user is logged in
+function checkLogin() {
+    currentUsername = localStorage.getItem('wheres_the_well_username');
+    if (currentUsername) {
+        isAdmin = currentUsername.toLowerCase() === 'admin';
+        document.getElementById('currentUsername').textContent = currentUsername + (isAdmin ? ' (Admin)' : '');
+        document.getElementById('loginPage').style.display = 'none';
+        document.getElementById('mainContent').style.display = 'block';
+
+        // Show alerts section for all users
+        document.getElementById('alertsSection').style.display = 'block';
+
+        // Show admin-specific sections if admin
+        if (isAdmin) {
+            document.getElementById('adminAlertForm').style.display = 'block';
+            document.getElementById('adminBadge').style.display = 'inline-block';
+        }
+
+        initMap();
+    } else {
+        document.getElementById('loginPage').style.display = 'block';
+        document.getElementById('mainContent').style.display = 'none';
+    }
+}
+
+// Handle login
+document.getElementById('loginForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+    const username = document.getElementById('usernameInput').value.trim();
+    const password = document.getElementById('passwordInput').value; // Password is ignored but required for form
+
+    if (username && password) {
+        currentUsername = username;
+        isAdmin = username.toLowerCase() === 'admin';
+        localStorage.setItem('wheres_the_well_username', username);
+        document.getElementById('currentUsername').textContent = username + (isAdmin ? ' (Admin)' : '');
+        document.getElementById('loginPage').style.display = 'none';
+        document.getElementById('mainContent').style.display = 'block';
+
+        // Show alerts section for all users
+        document.getElementById('alertsSection').style.display = 'block';
+
+        // Show admin-specific sections if admin
+        if (isAdmin) {
+            document.getElementById('adminAlertForm').style.display = 'block';
+            document.getElementById('adminBadge').style.display = 'inline-block';
+        }
+
+        initMap();
+    } else {
+        alert('Please enter both username and password');
+    }
+});
+
+// Logout function
+function logout() {
+    // Clear user data
+    localStorage.removeItem('wheres_the_well_username');
+    currentUsername = null;
+    userLocation = null;
+    isAdmin = false;
+    alertMode = false;
+
+    // Clean up map and markers
+    if (map) {
+        // Remove all markers
+        if (userLocationMarker) {
+            map.removeLayer(userLocationMarker);
+            userLocationMarker = null;
+        }
+
+        if (window.tempMarker) {
+            map.removeLayer(window.tempMarker);
+            window.tempMarker = null;
+        }
+
+        waterSourceMarkers.forEach(marker => map.removeLayer(marker));
+        waterSourceMarkers.clear();
+
+        alertMarkers.forEach(marker => map.removeLayer(marker));
+        alertMarkers.clear();
+        alertsById.clear();
+
+        // Remove the map completely
+        map.remove();
+        map = null;
+    }
+
+    // Reset global variables
+    selectedLatLng = null;
+    currentPhotoData = null;
+
+    // Hide main content and admin sections
+    document.getElementById('mainContent').style.display = 'none';
+    document.getElementById('alertsSection').style.display = 'none';
+    document.getElementById('adminAlertForm').style.display = 'none';
+    document.getElementById('adminBadge').style.display = 'none';
+    document.getElementById('detailsPanel').classList.add('hidden');
+
+    // Reset containers
+    document.getElementById('nearbySourcesContainer').innerHTML = `
+        <div class="text-center py-8 text-gray-500">
+            <svg class="w-12 h-12 mx-auto mb-3 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M17.657 16.657L13.414 20.9a1.998 1.998 0 01-2.827 0l-4.244-4.243a8 8 0 1111.314 0z"></path>
+                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 11a3 3 0 11-6 0 3 3 0 016 0z"></path>
+            </svg>
+            <p>Click "Find Me" to see nearby water sources</p>
+        </div>
+    `;
+
+    document.getElementById('alertsContainer').innerHTML = `
+        <div class="text-center py-4 text-gray-500">
+            <p class="text-sm">Click "Find Me" to see nearby alerts</p>
+        </div>
+    `;
+
+    // Reset forms
+    document.getElementById('waterSourceForm').reset();
+    document.getElementById('photoPreview').classList.add('hidden');
+    document.getElementById('latitude').value = '';
+    document.getElementById('longitude').value = '';
+
+    // Reset alert form if admin
+    if (document.getElementById('alertForm')) {
+        document.getElementById('alertForm').reset();
+        document.getElementById('alertLatitude').value = '';
+        document.getElementById('alertLongitude').value = '';
+    }
+
+    // Show login page
+    document.getElementById('loginPage').style.display = 'block';
+    document.getElementById('usernameInput').value = '';
+    document.getElementById('passwordInput').value = '';
+}
+
+// Initialize map
+function initMap() {
+    // Default location (can be changed)
+    const defaultLat = 40.7128;
+    const defaultLng = -74.0060;
+
+    map = L.map('map').setView([defaultLat, defaultLng], 13);
+
+    // Add map tiles (OpenStreetMap unless WELL_TILE_URL points elsewhere)
+    L.tileLayer(document.body.dataset.tileUrl, {
+        attribution: '© OpenStreetMap contributors'
+    }).addTo(map);
+
+    // Add click event for placing water sources or alerts
+    map.on('click', function(e) {
+        if (isAdmin && alertMode) {
+            // Admin placing an alert
+            document.getElementById('alertLatitude').value = e.latlng.lat.toFixed(6);
+            document.getElementById('alertLongitude').value = e.latlng.lng.toFixed(6);
+
+            // Show temporary alert marker
+            if (window.tempAlertMarker) {
+                map.removeLayer(window.tempAlertMarker);
+            }
+            window.tempAlertMarker = L.marker([e.latlng.lat, e.latlng.lng], {
+                icon: L.divIcon({
+                    className: 'alert-marker',
+                    html: '<div style="background-color: #ef4444; color: white; width: 30px; height: 30px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 16px;">🚨</div>',
+                    iconSize: [30, 30],
+                    iconAnchor: [15, 15]
+                })
+            }).addTo(map).bindPopup("🚨 New alert location").openPopup();
+        } else {
+            // Regular water source placement
+            selectedLatLng = e.latlng;
+            document.getElementById('latitude').value = e.latlng.lat.toFixed(6);
+            document.getElementById('longitude').value = e.latlng.lng.toFixed(6);
+
+            // Show temporary marker
+            if (window.tempMarker) {
+                map.removeLayer(window.tempMarker);
+            }
+            window.tempMarker = L.marker([e.latlng.lat, e.latlng.lng])
+                .addTo(map)
+                .bindPopup("📍 New water source location")
+                .openPopup();
+        }
+    });
+
+    // Reload markers for the visible area whenever the map moves
+    map.on('moveend', refreshWaterSourceMarkers);
+
+    // Try to get user's current location
+    getCurrentLocation();
+
+    // Note the current change seq, then load existing water sources
+    syncSeq = null;
+    syncChanges().then(() => loadWaterSources());
+}
+
+// Get current location
+function getCurrentLocation() {
+    if (navigator.geolocation) {
+        navigator.geolocation.getCurrentPosition(
+            function(position) {
+                const lat = position.coords.latitude;
+                const lng = position.coords.longitude;
+
+                // Store user location
+                userLocation = { latitude: lat, longitude: lng };
+
+                // Update map view
+                map.setView([lat, lng], 15);
+
+                // Add/update user location marker
+                if (userLocationMarker) {
+                    map.removeLayer(userLocationMarker);
+                }
+
+                userLocationMarker = L.marker([lat, lng], {
+                    icon: L.divIcon({
+                        className: 'user-location',
+                        html: '<div style="background-color: #3b82f6; width: 15px; height: 15px; border-radius: 50%; border: 3px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2);"></div>',
+                        iconSize: [21, 21],
+                        iconAnchor: [10, 10]
+                    })
+                }).addTo(map).bindPopup("📍 Your current location");
+
+                // Update nearby sources list
+                updateNearbyWaterSources();
+
+                // Update alerts for all users
+                updateAlertsNearMe();
+            },
+            function(error) {
+                console.log("Geolocation error:", error);
+                // Use default location if geolocation fails
+                userLocation = null;
+            }
+        );
+    }
+}
+
+// Handle photo upload and analysis
+function handlePhotoUpload(event) {
+    const file = event.target.files[0];
+    if (file) {
+        const reader = new FileReader();
+        reader.onload = function(e) {
+            currentPhotoData = e.target.result;
+            currentPhotoToken = null;
+
+            // Show preview
+            const preview = document.getElementById('photoPreview');
+            const previewImage = document.getElementById('previewImage');
+            previewImage.src = currentPhotoData;
+            preview.classList.remove('hidden');
+
+            // Analyze water quality
+            analyzeWaterQuality(currentPhotoData);
+        };
+        reader.readAsDataURL(file);
+    }
+}
+
+// Analyze water quality
+function analyzeWaterQuality(photoData) {
+    fetch('/analyze_water', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ photo_data: photoData })
+    })
+    .then(response => response.json())
+    .then(waitForAnalysis)
+    .then(data => {
+        // The server keeps the photo, so saving the source only needs the token
+        if (photoData === currentPhotoData) {
+            currentPhotoToken = data.analysis_token;
+        }
+
+        const resultDiv = document.getElementById('analysisResult');
+        const cleanlinessLevel = data.cleanliness_level;
+        const confidence = (data.confidence_score * 100).toFixed(1);
+
+        let bgColor, textColor, emoji;
+        switch(cleanlinessLevel) {
+            case 'clean':
+                bgColor = 'bg-green-100';
+                textColor = 'text-green-800';
+                emoji = '✅';
+                break;
+            case 'muddy':
+                bgColor = 'bg-yellow-100';
+                textColor = 'text-yellow-800';
+                emoji = '⚠️';
+                break;
+            case 'contaminated':
+                bgColor = 'bg-red-100';
+                textColor = 'text-red-800';
+                emoji = '❌';
+                break;
+            default:
+                bgColor = 'bg-gray-100';
+                textColor = 'text-gray-800';
+                emoji = '❓';
+        }
+
+        resultDiv.className = `mt-2 p-2 rounded text-sm ${bgColor} ${textColor}`;
+        resultDiv.innerHTML = `${emoji} <strong>${cleanlinessLevel.charAt(0).toUpperCase() + cleanlinessLevel.slice(1)}</strong> (${confidence}% confidence)`;
+    })
+    .catch(error => {
+        console.error('Error analyzing water:', error);
+        const resultDiv = document.getElementById('analysisResult');
+        resultDiv.className = 'mt-2 p-2 rounded text-sm bg-red-100 text-red-800';
+        resultDiv.innerHTML = '❌ Analysis failed';
+    });
+}
+
+// Poll a background analysis job until it has a result
+function waitForAnalysis(job) {
+    if (job.status === 'done') {
+        return Promise.resolve(job);
+    }
+    if (job.status !== 'pending') {
+        return Promise.reject(new Error(job.error || 'Analysis failed'));
+    }
+    return new Promise(resolve => setTimeout(resolve, 500))
+        .then(() => fetch(`/analysis/${job.job_id}`))
+        .then(response => response.json())
+        .then(waitForAnalysis);
+}
+
+// Submit water source form
+document.getElementById('waterSourceForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    if (!selectedLatLng) {
+        alert('Please click on the map to select a location first!');
+        return;
+    }
+
+    const formData = {
+        name: document.getElementById('sourceName').value,
+        latitude: selectedLatLng.lat,
+        longitude: selectedLatLng.lng,
+        water_type: document.getElementById('waterType').value,
+        notes: document.getElementById('notes').value,
+        added_by: currentUsername
+    };
+    if (currentPhotoToken) {
+        formData.photo_token = currentPhotoToken;
+    } else {
+        formData.photo_data = currentPhotoData;
+    }
+
+    fetch('/add_water_source', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(formData)
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Reset form
+            document.getElementById('waterSourceForm').reset();
+            document.getElementById('photoPreview').classList.add('hidden');
+            document.getElementById('latitude').value = '';
+            document.getElementById('longitude').value = '';
+
+            // Remove temporary marker
+            if (window.tempMarker) {
+                map.removeLayer(window.tempMarker);
+            }
+
+            // Pull the new source, and again once the photo analysis is stored
+            syncChanges();
+            if (data.analysis_job_id) {
+                waitForAnalysis({ job_id: data.analysis_job_id, status: 'pending' })
+                .then(() => syncChanges())
+                .catch(error => console.error('Error analyzing water:', error));
+            }
+
+            selectedLatLng = null;
+            currentPhotoData = null;
+            currentPhotoToken = null;
+
+            alert('Water source added successfully!');
+        } else {
+            alert('Error adding water source: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Error adding water source');
+    });
+});
+
+// Load water sources from database
+function loadWaterSources() {
+    refreshWaterSourceMarkers();
+
+    // Update nearby sources list
+    updateNearbyWaterSources();
+
+    // Load alerts for all users
+    loadAlerts();
+}
+
+// Pull what changed since the last sync and apply it to the map, instead
+// of reloading everything. The first call only records the current seq.
+function syncChanges() {
+    const query = syncSeq === null ? '' : `?since=${syncSeq}`;
+    return fetch(`/sync${query}`)
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            throw new Error(data.error);
+        }
+        if (syncSeq !== null && map) {
+            applyChanges(data);
+        }
+        syncSeq = data.seq;
+        if (data.more) {
+            return syncChanges();
+        }
+    })
+    .catch(error => {
+        console.error('Error syncing changes:', error);
+    });
+}
+
+function applyChanges(changes) {
+    changes.water_sources.forEach(source => {
+        if (waterSourceMarkers.has(source.id)) {
+            map.removeLayer(waterSourceMarkers.get(source.id));
+        }
+        const marker = createWaterSourceMarker(source);
+        waterSourceMarkers.set(source.id, marker);
+        marker.addTo(map);
+    });
+    changes.deleted.water_sources.forEach(id => {
+        if (waterSourceMarkers.has(id)) {
+            map.removeLayer(waterSourceMarkers.get(id));
+            waterSourceMarkers.delete(id);
+        }
+    });
+
+    changes.alerts.forEach(alert => {
+        if (alertMarkers.has(alert.id)) {
+            map.removeLayer(alertMarkers.get(alert.id));
+        }
+        const marker = createAlertMarker(alert);
+        alertMarkers.set(alert.id, marker);
+        alertsById.set(alert.id, alert);
+        marker.addTo(map);
+    });
+    changes.deleted.alerts.forEach(id => {
+        if (alertMarkers.has(id)) {
+            map.removeLayer(alertMarkers.get(id));
+            alertMarkers.delete(id);
+        }
+        alertsById.delete(id);
+    });
+
+    if (changes.water_sources.length || changes.deleted.water_sources.length) {
+        updateNearbyWaterSources();
+    }
+    if (changes.alerts.length || changes.deleted.alerts.length) {
+        updateAlertsNearMe([...alertsById.values()]);
+    }
+}
+
+// Catch up as soon as the device is back online, and every minute while it is
+window.addEventListener('online', () => syncChanges());
+setInterval(() => {
+    if (map && navigator.onLine) {
+        syncChanges();
+    }
+}, 60000);
+
+// Bounding box of the current map view, padded so small pans stay covered
+function getViewportBbox() {
+    const bounds = map.getBounds().pad(0.5);
+    const wrapLng = lng => ((lng + 180) % 360 + 360) % 360 - 180;
+    let west = -180, east = 180;
+    if (bounds.getEast() - bounds.getWest() < 360) {
+        west = wrapLng(bounds.getWest());
+        east = wrapLng(bounds.getEast());
+    }
+    const south = Math.max(bounds.getSouth(), -90);
+    const north = Math.min(bounds.getNorth(), 90);
+    return [south, west, north, east].map(v => v.toFixed(6)).join(',');
+}
+
+// Replace the water source markers with the sources inside the viewport
+function refreshWaterSourceMarkers() {
+    fetch(`/get_water_sources?bbox=${getViewportBbox()}`)
+    .then(response => response.json())
+    .then(data => {
+        // Clear existing markers
+        waterSourceMarkers.forEach(marker => map.removeLayer(marker));
+        waterSourceMarkers.clear();
+
+        // Add markers for each water source
+        data.forEach(source => {
+            const marker = createWaterSourceMarker(source);
+            waterSourceMarkers.set(source.id, marker);
+            marker.addTo(map);
+        });
+    })
+    .catch(error => {
+        console.error('Error loading water sources:', error);
+    });
+}
+
+// Create marker for water source
+function createWaterSourceMarker(source) {
+    const displayQuality = source.admin_override || source.cleanliness_level;
+    let color, emoji;
+    switch(displayQuality) {
+        case 'clean':
+            color = '#10b981';
+            emoji = '💧';
+            break;
+        case 'muddy':
+            color = '#f59e0b';
+            emoji = '🟡';
+            break;
+        case 'contaminated':
+            color = '#ef4444';
+            emoji = '🔴';
+            break;
+        default:
+            color = '#6b7280';
+            emoji = '❓';
+    }
+
+    const marker = L.marker([source.latitude, source.longitude], {
+        icon: L.divIcon({
+            className: 'water-marker',
+            html: `<div style="background-color: ${color}; color: white; width: 30px; height: 30px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 16px;">${emoji}</div>`,
+            iconSize: [30, 30],
+            iconAnchor: [15, 15]
+        })
+    });
+
+    const confidence = source.confidence_score ? (source.confidence_score * 100).toFixed(1) : 'N/A';
+    const qualityDisplay = source.admin_override ? 
+        `${displayQuality} (Admin Override)` : 
+        `${displayQuality} (${confidence}% confidence)`;
+
+    // Simple popup with basic info
+    marker.bindPopup(`
+        <div class="p-2">
+            <h4 class="font-bold text-lg">${source.name}</h4>
+            <p><strong>Type:</strong> ${source.water_type}</p>
+            <p><strong>Quality:</strong> ${qualityDisplay}</p>
+            <p><strong>Added by:</strong> ${source.added_by}</p>
+            <button onclick="showWaterSourceDetails(${source.id})" class="mt-2 w-full bg-blue-500 text-white py-1 px-3 rounded text-sm hover:bg-blue-600 transition">
+                📋 View Full Details
+            </button>
+        </div>
+    `);
+
+    return marker;
+}
+
+// Show detailed water source information in the details panel
+function showWaterSourceDetails(sourceId) {
+    const detailsPanel = document.getElementById('detailsPanel');
+    const detailsContent = document.getElementById('detailsContent');
+
+    // Show loading state
+    detailsPanel.classList.remove('hidden');
+    detailsContent.innerHTML = '<div class="text-center py-8"><div class="inline-block animate-spin rounded-full h-8 w-8 border-b-2 border-blue-600"></div><p class="mt-2 text-gray-600">Loading details...</p></div>';
+
+    // Scroll to details panel
+    detailsPanel.scrollIntoView({ behavior: 'smooth' });
+
+    fetch(`/water_source/${sourceId}/full?username=${encodeURIComponent(currentUsername)}`)
+    .then(response => response.json())
+    .then(({ source, votes, comments, comments_cursor }) => {
+        const confidence = source.confidence_score ? (source.confidence_score * 100).toFixed(1) : 'N/A';
+        const upvotes = votes.upvotes;
+        const downvotes = votes.downvotes;
+        const userVote = votes.user_vote;
+        const displayQuality = source.admin_override || source.cleanliness_level;
+
+        detailsContent.innerHTML = `
+            <div class="space-y-6">
+                <!-- Basic Information -->
+                <div>
+                    <h4 class="text-2xl font-bold text-gray-800 mb-4">${source.name}</h4>
+                    <div class="grid grid-cols-1 md:grid-cols-2 gap-4">
+                        <div class="space-y-3">
+                            <div>
+                                <span class="font-medium text-gray-700">Type:</span>
+                                <span class="ml-2 px-2 py-1 bg-gray-100 rounded text-sm">${source.water_type}</span>
+                            </div>
+                            <div>
+                                <span class="font-medium text-gray-700">Quality:</span>
+                                <span class="ml-2 px-2 py-1 ${getQualityBadgeClass(displayQuality)} rounded text-sm">
+                                    ${displayQuality} 
+                                    ${source.admin_override ? '<span class="text-xs">(Admin Override)</span>' : `(${confidence}% confidence)`}
+                                </span>
+                            </div>
+                            <div>
+                                <span class="font-medium text-gray-700">Added by:</span>
+                                <span class="ml-2">${source.added_by}</span>
+                            </div>
+                            <div>
+                                <span class="font-medium text-gray-700">Date added:</span>
+                                <span class="ml-2">${new Date(source.timestamp).toLocaleDateString()}</span>
+                            </div>
+                        </div>
+                        <div class="space-y-3">
+                            <div>
+                                <span class="font-medium text-gray-700">Coordinates:</span>
+                                <div class="ml-2 text-sm font-mono bg-gray-100 px-2 py-1 rounded">
+                                    ${source.latitude.toFixed(6)}, ${source.longitude.toFixed(6)}
+                                </div>
+                            </div>
+                            ${source.notes ? `
+                                <div>
+                                    <span class="font-medium text-gray-700">Notes:</span>
+                                    <div class="ml-2 mt-1 p-3 bg-gray-50 rounded text-sm">${source.notes}</div>
+                                </div>
+                            ` : ''}
+                        </div>
+                    </div>
+                    ${source.photo_url ? `
+                        <a href="${source.photo_url}" target="_blank" rel="noopener">
+                            <img src="${source.photo_url}?size=preview"
+                                 srcset="${source.photo_url}?size=thumb 128w, ${source.photo_url}?size=preview 640w"
+                                 sizes="(max-width: 640px) 100vw, 640px"
+                                 alt="Photo of ${source.name}" loading="lazy" class="mt-4 w-full max-h-96 object-cover rounded-lg">
+                        </a>
+                    ` : ''}
+                </div>
+
+                ${isAdmin ? `
+                <!-- Admin Controls -->
+                <div class="border-t border-gray-200 pt-6">
+                    <div class="bg-blue-50 p-4 rounded-lg">
+                        <h5 class="text-lg font-semibold text-blue-800 mb-3 flex items-center">
+                            🛡️ Admin Controls
+                            <span class="ml-2 px-2 py-1 bg-blue-200 text-blue-800 text-xs rounded-full">ADMIN</span>
+                        </h5>
+                        <div class="flex space-x-2 mb-3">
+                            <button onclick="adminOverride(${sourceId}, 'clean')" class="px-3 py-2 bg-green-500 text-white rounded text-sm hover:bg-green-600 transition">
+                                Mark as Clean
+                            </button>
+                            <button onclick="adminOverride(${sourceId}, 'muddy')" class="px-3 py-2 bg-yellow-500 text-white rounded text-sm hover:bg-yellow-600 transition">
+                                Mark as Muddy
+                            </button>
+                            <button onclick="adminOverride(${sourceId}, 'contaminated')" class="px-3 py-2 bg-red-500 text-white rounded text-sm hover:bg-red-600 transition">
+                                Mark as Contaminated
+                            </button>
+                        </div>
+                        <p class="text-xs text-blue-700">Admin overrides will take precedence over automatic analysis</p>
+                    </div>
+                </div>
+                ` : ''}
+
+                <!-- Community Feedback Section -->
+                <div class="border-t border-gray-200 pt-6">
+                    <div class="flex items-center justify-between mb-4">
+                        <h5 class="text-lg font-semibold text-gray-800">Community Feedback</h5>
+                        <div class="flex items-center space-x-4">
+                            <span class="flex items-center text-green-600">
+                                <svg class="w-5 h-5 mr-1" fill="currentColor" viewBox="0 0 20 20">
+                                    <path d="M2 10.5a1.5 1.5 0 113 0v6a1.5 1.5 0 01-3 0v-6zM6 10.333v5.43a2 2 0 001.106 1.79l.05.025A4 4 0 008.943 18h5.416a2 2 0 001.962-1.608l1.2-6A2 2 0 0015.56 8H12V4a2 2 0 00-2-2 1 1 0 00-1 1v.667a4 4 0 01-.8 2.4L6.8 7.933a4 4 0 00-.8 2.4z"></path>
+                                </svg>
+                                ${upvotes}
+                            </span>
+                            <span class="flex items-center text-red-600">
+                                <svg class="w-5 h-5 mr-1" fill="currentColor" viewBox="0 0 20 20">
+                                    <path d="M18 9.5a1.5 1.5 0 11-3 0v-6a1.5 1.5 0 013 0v6zM14 9.667v-5.43a2 2 0 00-1.106-1.79l-.05-.025A4 4 0 0011.057 2H5.641a2 2 0 00-1.962 1.608l-1.2 6A2 2 0 004.44 12H8v4a2 2 0 002 2 1 1 0 001-1v-.667a4 4 0 01.8-2.4l1.4-1.866a4 4 0 00.8-2.4z"></path>
+                                </svg>
+                                ${downvotes}
+                            </span>
+                        </div>
+                    </div>
+
+                    <div class="flex space-x-3 mb-6">
+                        <button onclick="vote(${sourceId}, 'upvote')" class="flex-1 py-3 px-4 rounded-lg font-medium transition ${userVote === 'upvote' ? 'bg-green-500 text-white' : 'bg-gray-100 text-gray-700 hover:bg-green-100'}">
+                            👍 Accurate Information
+                        </button>
+                        <button onclick="vote(${sourceId}, 'downvote')" class="flex-1 py-3 px-4 rounded-lg font-medium transition ${userVote === 'downvote' ? 'bg-red-500 text-white' : 'bg-gray-100 text-gray-700 hover:bg-red-100'}">
+                            👎 Inaccurate Information
+                        </button>
+                    </div>
+                </div>
+
+                <!-- Comments Section -->
+                <div class="border-t border-gray-200 pt-6">
+                    <h5 class="text-lg font-semibold text-gray-800 mb-4">Comments & Additional Info</h5>
+
+                    <!-- Add Comment -->
+                    <div class="mb-6">
+                        <textarea id="commentText_${sourceId}" placeholder="Share additional information about this water source..." class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-blue-500 resize-none" rows="3"></textarea>
+                        <button onclick="addComment(${sourceId})" class="mt-3 px-6 py-2 bg-blue-500 text-white rounded-lg hover:bg-blue-600 transition font-medium">
+                            💬 Add Comment
+                        </button>
+                    </div>
+
+                    <!-- Comments List -->
+                    <div id="commentsList_${sourceId}" class="space-y-4">
+                        ${comments.length === 0 ? '<p class="text-gray-500 text-center py-4">No comments yet. Be the first to share additional information!</p>' : ''}
+                        ${comments.map(comment => renderComment(comment, sourceId)).join('')}
+                    </div>
+                    ${comments_cursor ? `
+                        <button id="moreComments_${sourceId}" onclick="loadMoreComments(${sourceId}, '${comments_cursor}')" class="mt-4 w-full py-2 px-4 bg-gray-100 text-gray-700 rounded-lg hover:bg-gray-200 transition font-medium">
+                            Load more comments
+                        </button>
+                    ` : ''}
+                </div>
+
+                <!-- Close Button -->
+                <div class="border-t border-gray-200 pt-6">
+                    <div class="flex space-x-3">
+                        <button onclick="hideWaterSourceDetails()" class="flex-1 py-3 px-4 bg-gray-100 text-gray-700 rounded-lg hover:bg-gray-200 transition font-medium">
+                            ✕ Close Details
+                        </button>
+                        ${isAdmin ? `<button onclick="deleteWaterSource(${sourceId})" class="py-3 px-4 bg-red-500 text-white rounded-lg hover:bg-red-600 transition font-medium">🗑️ Delete Source</button>` : ''}
+                    </div>
+                </div>
+            </div>
+        `;
+    })
+    .catch(error => {
+        console.error('Error loading water source details:', error);
+        detailsContent.innerHTML = '<div class="text-center py-8 text-red-600">Error loading details. Please try again.</div>';
+    });
+}
+
+function renderComment(comment, sourceId) {
+    return `
+        <div class="${comment.is_admin ? 'bg-blue-50 border-l-4 border-blue-500' : 'bg-gray-50'} p-4 rounded-lg">
+            <div class="flex items-center justify-between mb-2">
+                <div class="flex items-center">
+                    <span class="font-medium text-gray-800">${comment.username}</span>
+                    ${comment.is_admin ? '<span class="ml-2 px-2 py-1 bg-blue-200 text-blue-800 text-xs rounded-full">ADMIN</span>' : ''}
+                    ${comment.is_admin ? '<span class="ml-2 text-blue-600">📌</span>' : ''}
+                </div>
+                <div class="flex items-center space-x-2">
+                    <span class="text-gray-400 text-sm">${new Date(comment.timestamp).toLocaleDateString()}</span>
+                    ${isAdmin ? `<button onclick="deleteComment(${comment.id}, ${sourceId})" class="text-red-500 hover:text-red-700 text-xs">🗑️</button>` : ''}
+                </div>
+            </div>
+            <p class="text-gray-700 ${comment.is_admin ? 'font-medium' : ''}">${comment.comment}</p>
+        </div>
+    `;
+}
+
+// The details panel shows the first page of comments; each click appends the next page
+function loadMoreComments(sourceId, cursor) {
+    fetch(`/get_comments/${sourceId}?limit=50&after=${encodeURIComponent(cursor)}`)
+    .then(response => {
+        const nextCursor = response.headers.get('X-Next-Cursor');
+        return response.json().then(comments => ({ comments, nextCursor }));
+    })
+    .then(({ comments, nextCursor }) => {
+        document.getElementById(`commentsList_${sourceId}`).insertAdjacentHTML('beforeend',
+            comments.map(comment => renderComment(comment, sourceId)).join(''));
+        const button = document.getElementById(`moreComments_${sourceId}`);
+        if (nextCursor) {
+            button.onclick = () => loadMoreComments(sourceId, nextCursor);
+        } else {
+            button.remove();
+        }
+    })
+    .catch(error => {
+        console.error('Error loading comments:', error);
+    });
+}
+
+// Hide the details panel
+function hideWaterSourceDetails() {
+    document.getElementById('detailsPanel').classList.add('hidden');
+}
+
+// Get CSS class for quality badge
+function getQualityBadgeClass(quality) {
+    switch(quality) {
+        case 'clean':
+            return 'bg-green-100 text-green-800';
+        case 'muddy':
+            return 'bg-yellow-100 text-yellow-800';
+        case 'contaminated':
+            return 'bg-red-100 text-red-800';
+        default:
+            return 'bg-gray-100 text-gray-800';
+    }
+}
+
+// Vote on water source
+function vote(sourceId, voteType) {
+    fetch('/vote', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            water_source_id: sourceId,
+            username: currentUsername,
+            vote_type: voteType
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Refresh the details panel to show updated votes
+            showWaterSourceDetails(sourceId);
+        } else {
+            alert('Error voting: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error voting:', error);
+        alert('Error submitting vote');
+    });
+}
+
+// Add comment to water source
+function addComment(sourceId) {
+    const commentText = document.getElementById(`commentText_${sourceId}`).value.trim();
+    if (!commentText) {
+        alert('Please enter a comment');
+        return;
+    }
+
+    fetch('/add_comment', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            water_source_id: sourceId,
+            username: currentUsername,
+            comment: commentText,
+            is_admin: isAdmin
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Refresh the details panel to show new comment
+            showWaterSourceDetails(sourceId);
+        } else {
+            alert('Error adding comment: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error adding comment:', error);
+        alert('Error submitting comment');
+    });
+}
+
+// Admin override water source quality
+function adminOverride(sourceId, quality) {
+    if (!isAdmin) {
+        alert('Admin access required');
+        return;
+    }
+
+    fetch('/admin_override', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            water_source_id: sourceId,
+            quality: quality,
+            admin_username: currentUsername
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Refresh the details panel and pull the changed marker
+            showWaterSourceDetails(sourceId);
+            syncChanges();
+        } else {
+            alert('Error updating water source: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error updating water source:', error);
+        alert('Error updating water source');
+    });
+}
+
+// Load alerts for all users
+function loadAlerts() {
+    fetch('/get_alerts')
+    .then(response => response.json())
+    .then(data => {
+        // Clear existing alert markers
+        alertMarkers.forEach(marker => map.removeLayer(marker));
+        alertMarkers.clear();
+        alertsById.clear();
+
+        // Add markers for each alert
+        data.forEach(alert => {
+            const marker = createAlertMarker(alert);
+            alertMarkers.set(alert.id, marker);
+            alertsById.set(alert.id, alert);
+            marker.addTo(map);
+        });
+
+        // Update alerts list
+        updateAlertsNearMe(data);
+    })
+    .catch(error => {
+        console.error('Error loading alerts:', error);
+    });
+}
+
+// Create alert marker
+function createAlertMarker(alert) {
+    const marker = L.marker([alert.latitude, alert.longitude], {
+        icon: L.divIcon({
+            className: 'alert-marker',
+            html: '<div style="background-color: #ef4444; color: white; width: 30px; height: 30px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 16px;">🚨</div>',
+            iconSize: [30, 30],
+            iconAnchor: [15, 15]
+        })
+    });
+
+    marker.bindPopup(`
+        <div class="p-2">
+            <h4 class="font-bold text-lg text-red-600">⚠️ ${alert.title}</h4>
+            <p class="text-sm mt-2">${alert.message}</p>
+            <p class="text-xs text-gray-500 mt-2">Posted by ${alert.added_by}</p>
+            <p class="text-xs text-gray-500">${new Date(alert.timestamp).toLocaleDateString()}</p>
+        </div>
+    `);
+
+    return marker;
+}
+
+// Update alerts near me list
+function updateAlertsNearMe(alerts = null) {
+    const container = document.getElementById('alertsContainer');
+
+    if (!userLocation) {
+        container.innerHTML = `
+            <div class="text-center py-4 text-gray-500">
+                <p class="text-sm">Click "Find Me" to see nearby alerts</p>
+            </div>
+        `;
+        return;
+    }
+
+    if (!alerts) {
+        fetch('/get_alerts')
+        .then(response => response.json())
+        .then(data => updateAlertsNearMe(data))
+        .catch(error => console.error('Error fetching alerts:', error));
+        return;
+    }
+
+    // Calculate distances and sort by proximity
+    const alertsWithDistance = alerts.map(alert => ({
+        ...alert,
+        distance: calculateDistance(
+            userLocation.latitude, 
+            userLocation.longitude,
+            alert.latitude, 
+            alert.longitude
+        )
+    })).sort((a, b) => a.distance - b.distance);
+
+    if (alertsWithDistance.length === 0) {
+        container.innerHTML = `
+            <div class="text-center py-4 text-gray-500">
+                <p class="text-sm">No alerts in your area</p>
+            </div>
+        `;
+        return;
+    }
+
+    // Display nearest alerts
+    const nearestAlerts = alertsWithDistance.slice(0, 5);
+
+    container.innerHTML = nearestAlerts.map(alert => `
+        <div class="p-3 border border-red-200 bg-red-50 rounded-lg">
+            <div class="flex items-start justify-between">
+                <div class="flex-1">
+                    <h4 class="font-medium text-red-800 mb-1">🚨 ${alert.title}</h4>
+                    <p class="text-sm text-red-700 mb-2">${alert.message}</p>
+                    <div class="text-xs text-red-600">
+                        ${formatDistance(alert.distance)} away • ${new Date(alert.timestamp).toLocaleDateString()}
+                    </div>
+                </div>
+            </div>
+        </div>
+    `).join('');
+}
+
+// Handle alert form submission
+document.getElementById('alertForm').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    if (!isAdmin) {
+        alert('Admin access required');
+        return;
+    }
+
+    const title = document.getElementById('alertTitle').value.trim();
+    const message = document.getElementById('alertMessage').value.trim();
+    const latitude = document.getElementById('alertLatitude').value;
+    const longitude = document.getElementById('alertLongitude').value;
+
+    if (!title || !message) {
+        alert('Please fill in all fields');
+        return;
+    }
+
+    if (!latitude || !longitude) {
+        alert('Please click on the map to set alert location');
+        return;
+    }
+
+    fetch('/add_alert', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            title: title,
+            message: message,
+            latitude: parseFloat(latitude),
+            longitude: parseFloat(longitude),
+            added_by: currentUsername
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Reset form
+            document.getElementById('alertForm').reset();
+            document.getElementById('alertLatitude').value = '';
+            document.getElementById('alertLongitude').value = '';
+
+            // Remove temporary marker and disable alert mode
+            if (window.tempAlertMarker) {
+                map.removeLayer(window.tempAlertMarker);
+                window.tempAlertMarker = null;
+            }
+
+            // Turn off alert mode
+            alertMode = false;
+            const button = document.getElementById('alertModeToggle');
+            const instructions = document.getElementById('alertInstructions');
+            button.textContent = '📍 Click to Enable Alert Mode';
+            button.className = 'px-3 py-2 bg-red-600 text-white rounded text-sm hover:bg-red-700 transition';
+            instructions.textContent = 'Enable alert mode, then click on the map to set alert location';
+
+            // Pull the new alert
+            syncChanges();
+
+            alert('Alert added successfully!');
+        } else {
+            alert('Error adding alert: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error adding alert:', error);
+        alert('Error adding alert');
+    });
+});
+
+// Toggle alert mode for admin
+function toggleAlertMode() {
+    if (!isAdmin) return;
+
+    alertMode = !alertMode;
+    const button = document.getElementById('alertModeToggle');
+    const instructions = document.getElementById('alertInstructions');
+
+    if (alertMode) {
+        button.textContent = '🚨 Alert Mode: ON (Click to Disable)';
+        button.className = 'px-3 py-2 bg-green-600 text-white rounded text-sm hover:bg-green-700 transition';
+        instructions.textContent = 'Alert mode enabled - click on the map to place an alert';
+    } else {
+        button.textContent = '📍 Click to Enable Alert Mode';
+        button.className = 'px-3 py-2 bg-red-600 text-white rounded text-sm hover:bg-red-700 transition';
+        instructions.textContent = 'Enable alert mode, then click on the map to set alert location';
+
+        // Remove any temporary alert marker
+        if (window.tempAlertMarker) {
+            map.removeLayer(window.tempAlertMarker);
+            window.tempAlertMarker = null;
+        }
+    }
+}
+
+// Delete comment (admin only)
+function deleteComment(commentId, sourceId) {
+    if (!isAdmin) {
+        alert('Admin access required');
+        return;
+    }
+
+    if (!confirm('Are you sure you want to delete this comment?')) {
+        return;
+    }
+
+    fetch('/delete_comment', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            comment_id: commentId,
+            admin_username: currentUsername
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            showWaterSourceDetails(sourceId);
+        } else {
+            alert('Error deleting comment: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error deleting comment:', error);
+        alert('Error deleting comment');
+    });
+}
+
+// Delete water source (admin only)
+function deleteWaterSource(sourceId) {
+    if (!isAdmin) {
+        alert('Admin access required');
+        return;
+    }
+
+    if (!confirm('Are you sure you want to delete this water source? This will also delete all associated comments and votes.')) {
+        return;
+    }
+
+    fetch('/delete_water_source', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            water_source_id: sourceId,
+            admin_username: currentUsername
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            hideWaterSourceDetails();
+            syncChanges();
+            alert('Water source deleted successfully');
+        } else {
+            alert('Error deleting water source: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error deleting water source:', error);
+        alert('Error deleting water source');
+    });
+}
+
+// Calculate distance between two points using Haversine formula
+function calculateDistance(lat1, lon1, lat2, lon2) {
+    const R = 6371; // Radius of the Earth in kilometers
+    const dLat = (lat2 - lat1) * Math.PI / 180;
+    const dLon = (lon2 - lon1) * Math.PI / 180;
+    const a = 
+        Math.sin(dLat/2) * Math.sin(dLat/2) +
+        Math.cos(lat1 * Math.PI / 180) * Math.cos(lat2 * Math.PI / 180) * 
+        Math.sin(dLon/2) * Math.sin(dLon/2);
+    const c = 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1-a));
+    const distance = R * c; // Distance in kilometers
+    return distance;
+}
+
+// Format distance for display
+function formatDistance(distanceKm) {
+    if (distanceKm < 1) {
+        return Math.round(distanceKm * 1000) + 'm';
+    } else if (distanceKm < 10) {
+        return distanceKm.toFixed(1) + 'km';
+    } else {
+        return Math.round(distanceKm) + 'km';
+    }
+}
+
+// Update nearby water sources list
+function updateNearbyWaterSources(sources = null) {
+    const container = document.getElementById('nearbySourcesContainer');
+
+    if (!userLocation) {
+        container.innerHTML = `
+            <div class="text-center py-8 text-gray-500">
+                <svg class="w-12 h-12 mx-auto mb-3 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                    <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M17.657 16.657L13.414 20.9a1.998 1.998 0 01-2.827 0l-4.244-4.243a8 8 0 1111.314 0z"></path>
+                    <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 11a3 3 0 11-6 0 3 3 0 016 0z"></path>
+                </svg>
+                <p>Click "Find Me" to see nearby water sources</p>
+            </div>
+        `;
+        return;
+    }
+
+    // If sources not provided, fetch the closest ones to the user
+    if (!sources) {
+        fetch(`/nearest?lat=${userLocation.latitude}&lng=${userLocation.longitude}&k=10`)
+        .then(response => response.json())
+        .then(data => updateNearbyWaterSources(data))
+        .catch(error => console.error('Error fetching water sources:', error));
+        return;
+    }
+
+    // The server returns sources sorted by proximity with distances computed
+    const sourcesWithDistance = sources.map(source => ({
+        ...source,
+        distance: source.distance_km
+    }));
+
+    if (sourcesWithDistance.length === 0) {
+        container.innerHTML = `
+            <div class="text-center py-8 text-gray-500">
+                <svg class="w-12 h-12 mx-auto mb-3 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                    <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9.172 16.172a4 4 0 015.656 0M9 12h6m-6 4h6m2 5H7a2 2 0 01-2-2V5a2 2 0 012-2h5.586a1 1 0 01.707.293l5.414 5.414a1 1 0 01.293.707V19a2 2 0 01-2 2z"></path>
+                </svg>
+                <p>No water sources found</p>
+                <p class="text-sm mt-1">Start by adding some water sources to the map!</p>
+            </div>
+        `;
+        return;
+    }
+
+    // Display top 10 nearest sources
+    const nearestSources = sourcesWithDistance.slice(0, 10);
+
+    container.innerHTML = nearestSources.map(source => {
+        const displayQuality = source.admin_override || source.cleanliness_level;
+        const qualityColor = getQualityColor(displayQuality);
+        const qualityEmoji = getQualityEmoji(displayQuality);
+
+        return `
+            <div onclick="navigateToWaterSource(${source.id}, ${source.latitude}, ${source.longitude})" 
+                 class="p-3 border border-gray-200 rounded-lg hover:bg-gray-50 cursor-pointer transition">
+                <div class="flex items-center justify-between">
+                    <div class="flex-1">
+                        <div class="flex items-center mb-1">
+                            <span class="text-lg mr-2">${qualityEmoji}</span>
+                            <h4 class="font-medium text-gray-800 truncate">${source.name}</h4>
+                            ${source.admin_override ? '<span class="ml-2 px-1 py-0.5 bg-blue-200 text-blue-800 text-xs rounded">ADMIN</span>' : ''}
+                        </div>
+                        <div class="flex items-center text-sm text-gray-600">
+                            <span class="px-2 py-1 ${qualityColor} rounded text-xs mr-2">${displayQuality}</span>
+                            <span>${source.water_type}</span>
+                        </div>
+                        <div class="text-xs text-gray-500 mt-1">
+                            Added by ${source.added_by}
+                        </div>
+                    </div>
+                    <div class="text-right ml-3">
+                        <div class="text-sm font-medium text-blue-600">${formatDistance(source.distance)}</div>
+                        <div class="text-xs text-gray-500">away</div>
+                    </div>
+                </div>
+            </div>
+        `;
+    }).join('');
+}
+
+// Navigate to water source on map and show details
+function navigateToWaterSource(sourceId, latitude, longitude) {
+    // Center map on the water source
+    map.setView([latitude, longitude], 16);
+
+    // Find and open the marker popup
+    const marker = waterSourceMarkers.get(sourceId);
+
+    if (marker) {
+        marker.openPopup();
+    }
+
+    // Show details in the panel
+    showWaterSourceDetails(sourceId);
+}
+
+// Get quality color for badges
+function getQualityColor(quality) {
+    switch(quality) {
+        case 'clean':
+            return 'bg-green-100 text-green-800';
+        case 'muddy':
+            return 'bg-yellow-100 text-yellow-800';
+        case 'contaminated':
+            return 'bg-red-100 text-red-800';
+        default:
+            return 'bg-gray-100 text-gray-800';
+    }
+}
+
+// Get quality emoji
+function getQualityEmoji(quality) {
+    switch(quality) {
+        case 'clean':
+            return '💧';
+        case 'muddy':
+            return '🟡';
+        case 'contaminated':
+            return '🔴';
+        default:
+            return '❓';
+    }
+}
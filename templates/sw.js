@@ -0,0 +1,99 @@
+// Service worker: keeps the app shell, the data last seen and the map tiles
+// already viewed available offline. Rendered by get_service_worker().
+const VERSION = '{{ version }}';
+const SHELL_CACHE = `shell-${VERSION}`;
+const DATA_CACHE = 'data';
+const PHOTO_CACHE = 'photos';
+const TILE_CACHE = 'tiles';
+const MAX_PHOTOS = 500;
+const MAX_TILES = 2000;
+const SHELL_URLS = {{ shell_urls|tojson }};
+
+// Read endpoints whose last response is shown when the network is unavailable.
+// /sync is left out: a cached change list would be applied twice.
+const DATA_PATHS = [
+    '/get_water_sources',
+    '/get_alerts',
+    '/nearest',
+    '/water_source/',
+    '/get_water_source_details/',
+    '/get_votes/',
+    '/get_comments/'
+];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+        .then(cache => cache.addAll(SHELL_URLS))
+        .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // Drop the shells of earlier versions
+    event.waitUntil(
+        caches.keys()
+        .then(keys => Promise.all(keys
+            .filter(key => key.startsWith('shell-') && key !== SHELL_CACHE)
+            .map(key => caches.delete(key))))
+        .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(request.url);
+    if (url.origin !== location.origin) {
+        // Map tiles
+        if (request.destination === 'image') {
+            event.respondWith(cacheFirst(request, TILE_CACHE, MAX_TILES));
+        }
+        return;
+    }
+    // Fingerprinted assets and photos never change
+    if (url.pathname.startsWith('/static/')) {
+        event.respondWith(cacheFirst(request, SHELL_CACHE));
+    } else if (url.pathname.startsWith('/photo/')) {
+        event.respondWith(cacheFirst(request, PHOTO_CACHE, MAX_PHOTOS));
+    } else if (url.pathname === '/') {
+        event.respondWith(networkFirst(request, SHELL_CACHE));
+    } else if (DATA_PATHS.some(path => url.pathname.startsWith(path))) {
+        event.respondWith(networkFirst(request, DATA_CACHE));
+    }
+});
+
+function cacheFirst(request, cacheName, maxEntries) {
+    return caches.open(cacheName).then(cache =>
+        cache.match(request).then(cached => cached || fetch(request).then(response => {
+            // Cross-origin tiles come back opaque (status 0) and are still worth keeping;
+            // no-cache marks a stand-in, such as a thumbnail served for a missing photo
+            const standIn = (response.headers.get('Cache-Control') || '').includes('no-cache');
+            if ((response.ok || response.type === 'opaque') && !standIn) {
+                cache.put(request, response.clone()).then(() => maxEntries && trimCache(cache, maxEntries));
+            }
+            return response;
+        }))
+    );
+}
+
+function networkFirst(request, cacheName) {
+    return caches.open(cacheName).then(cache =>
+        fetch(request).then(response => {
+            if (response.ok) {
+                cache.put(request, response.clone());
+            }
+            return response;
+        })
+        .catch(() => cache.match(request).then(cached => cached || Response.error()))
+    );
+}
+
+function trimCache(cache, maxEntries) {
+    // Keys come back oldest first
+    return cache.keys().then(keys => Promise.all(
+        keys.slice(0, Math.max(0, keys.length - maxEntries)).map(key => cache.delete(key))
+    ));
+}
@@ -1,23 +1,512 @@
 import os
+import sys
+import argparse
 import sqlite3
 import base64
 import json
+import math
+import functools
+import hashlib
+import heapq
+import gzip
+import zlib
+import shutil
+import tempfile
+import threading
+import queue
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+from collections import namedtuple, OrderedDict
 from datetime import datetime
-from flask import Flask, render_template_string, request, jsonify, send_from_directory
+from flask import Flask, render_template, render_template_string, request, jsonify, send_from_directory, send_file, g, stream_with_context
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
+from werkzeug.security import safe_join
 import io
+import mimetypes
+
+# Optional: brotli compresses text better than gzip; without it only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static files are served by static_asset() below, with fingerprinted URLs
+app = Flask(__name__, static_folder=None)
+app.config['DATABASE'] = os.environ.get('WELL_DATABASE', 'water_sources.db')
+app.config['STATIC_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Map tiles; point this at a local tile server to run the map without internet access
+app.config['TILE_URL'] = os.environ.get('WELL_TILE_URL', 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png')
+
+# Uploaded photos are stored on disk, named by the SHA-256 of their bytes
+app.config['PHOTO_DIR'] = os.path.abspath(os.environ.get('WELL_PHOTO_DIR', 'photos'))
+
+# Connection settings: WAL lets readers run alongside a writer, NORMAL sync is
+# durable across application crashes in WAL mode, and the page cache and
+# memory map keep hot pages out of the read() path
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16384',  # 16 MB
+    'PRAGMA mmap_size = 268435456'  # 256 MB
+)
+DB_POOL_SIZE = 16
+
+# Oldest SQLite the queries run on: vote repairs use UPDATE ... RETURNING (3.35),
+# vote totals use aggregate FILTER clauses (3.30) and merges use upserts (3.24).
+# Python links whichever SQLite library the system provides.
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+
+def connect_db():
+    """Open a tuned connection to the application database"""
+    conn = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    conn.row_factory = sqlite3.Row  # This allows us to access columns by name
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """Keeps idle connections open so requests skip connect and cache warmup"""
+    def __init__(self, max_idle=DB_POOL_SIZE):
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return connect_db()
+    
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
 
-app = Flask(__name__)
+db_pool = ConnectionPool()
+
+def get_db():
+    """Connection for the current request, returned to the pool on teardown"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Version of the data read by conditional GETs, kept in the data_versions
+# table by triggers, so every write bumps it in its own transaction whichever
+# process makes it: other server workers, the maintenance commands or a merged
+# snapshot. Read endpoints build their ETag and Last-Modified from the versions
+# of the data they read, which costs one small query on a pooled connection.
+# Versions start at a random number, so a recreated database never repeats the
+# tags of the one it replaced. Each table has a version, except that updates to
+# the vote counters of water sources bump vote_totals instead of water_sources,
+# and updates to their version column bump neither: the lists never show them.
+# The database row never changes: it is a random id of the database, which tags
+# responses built from per-row versions, as those start at 1 in every database.
+VERSIONED_TABLES = ['water_sources', 'photos', 'votes', 'comments', 'alerts']
+DATA_VERSIONS_SQL = 'SELECT name, version, modified FROM data_versions'
+DATABASE_ID_SQL = "SELECT version FROM data_versions WHERE name = 'database'"
+UNIX_TIME_SQL = "(julianday('now') - 2440587.5) * 86400.0"
+
+def data_validators(conn, tables):
+    """(ETag, modification time) of a response built from tables"""
+    rows = {name: (version, modified) for name, version, modified in conn.execute(DATA_VERSIONS_SQL)}
+    etag = '-'.join(str(rows[table][0]) for table in tables)
+    modified = max(rows[table][1] for table in tables)
+    return etag, modified
+
+# Response compression. Text bodies of at least COMPRESS_MIN_SIZE bytes are
+# sent with brotli (when the optional brotli package is installed) or gzip,
+# whichever the client prefers. Payloads that are the same on every request
+# are compressed once, at the highest settings, when they are first built.
+COMPRESS_MIN_SIZE = 1024  # smaller bodies barely shrink
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml'
+}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+def content_codings():
+    """Supported codings, most preferred first"""
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+def negotiate_coding():
+    """The coding to send the current request's response in, or None for identity"""
+    best, best_quality = None, 0
+    for coding in content_codings():
+        quality = request.accept_encodings[coding]
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+def compress(body, coding, static=False):
+    if coding == 'br':
+        return brotli.compress(body, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    return gzip.compress(body, STATIC_GZIP_LEVEL if static else GZIP_LEVEL, mtime=0)
+
+def compress_stream(chunks, coding):
+    """Compress a streamed body, flushing after every chunk so clients can parse as it arrives"""
+    if coding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+class StaticPayload:
+    """A body that is the same on every request, with its ETag and a compressed copy per coding"""
+    def __init__(self, body, mimetype):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.encodings = {}
+        if len(self.body) >= COMPRESS_MIN_SIZE and mimetype in COMPRESSIBLE_MIMETYPES:
+            for coding in content_codings():
+                self.encodings[coding] = compress(self.body, coding, static=True)
+    
+    def response(self):
+        """The negotiated variant, or 304 if the client already has it"""
+        coding = negotiate_coding() if self.encodings else None
+        etag = f'{self.etag}-{coding}' if coding else self.etag
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(self.encodings.get(coding, self.body), mimetype=self.mimetype)
+            if coding:
+                response.content_encoding = coding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+def matching_etag(etag):
+    """The tag of the current request's If-None-Match that matches etag or a compressed copy of it"""
+    # Compressed copies carry the coding in their tag; see compress_response
+    for tag in [etag] + [f'{etag}-{coding}' for coding in content_codings()]:
+        if request.if_none_match.contains(tag):
+            return tag
+    return None
+
+@app.after_request
+def compress_response(response):
+    """Compress text responses the views left uncompressed"""
+    if (response.status_code != 200 or response.content_encoding or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = negotiate_coding()
+    if coding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), coding)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(body, coding))
+    response.content_encoding = coding
+    # Each coding is a different representation, so it needs its own strong tag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{coding}')
+    return response
+
+# Serialized bodies of the busiest list responses, keyed by URL, with a
+# compressed copy per coding made the first time a client asks for it. An
+# entry is stored with the ETag it was built under and only served while that
+# is still the current tag, so a hit is always current, whichever process made
+# the last write, and costs no query, no serialization and usually no compression.
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('WELL_RESPONSE_CACHE_MB', 64)) * 1024 * 1024
+RESPONSE_CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+CachedResponse = namedtuple('CachedResponse', ['etag', 'headers', 'body', 'encodings'])
+
+class ResponseCache:
+    """Bounded LRU cache of response bodies with hit, miss and invalidation counters"""
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, max_entry_bytes=RESPONSE_CACHE_MAX_ENTRY_BYTES,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.oversized = 0
+    
+    @staticmethod
+    def entry_size(entry):
+        return len(entry.body) + sum(len(data) for data in entry.encodings.values())
+    
+    def remove(self, key):
+        self.size -= self.entry_size(self.entries.pop(key))
+    
+    def trim(self):
+        while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+    
+    def get(self, key, etag):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.etag != etag:
+                # Built before a write to its data
+                self.remove(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, entry):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = entry
+            self.size += self.entry_size(entry)
+            self.trim()
+    
+    def fill(self, key, etag, response):
+        """
+        Read the body of response into a new entry and return it. Returns None,
+        leaving response to stream the rest, if the body outgrows max_entry_bytes
+        """
+        chunks = []
+        size = 0
+        body = response.iter_encoded()
+        for chunk in body:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.max_entry_bytes:
+                with self.lock:
+                    self.oversized += 1
+                response.response = chain(chunks, body)
+                return None
+        headers = [(name, value) for name, value in response.headers if name.lower() != 'content-length']
+        entry = CachedResponse(etag, headers, b''.join(chunks), {})
+        self.put(key, entry)
+        return entry
+    
+    def response(self, key, entry):
+        """Response for an entry, compressed in the negotiated coding"""
+        coding = negotiate_coding() if len(entry.body) >= COMPRESS_MIN_SIZE else None
+        body = entry.body
+        if coding:
+            body = entry.encodings.get(coding)
+            if body is None:
+                body = compress(entry.body, coding)
+                with self.lock:
+                    if self.entries.get(key) is entry and coding not in entry.encodings:
+                        entry.encodings[coding] = body
+                        self.size += len(body)
+                        self.trim()
+        response = app.response_class(body, headers=entry.headers)
+        if coding:
+            response.content_encoding = coding
+        return response
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'oversized': self.oversized
+            }
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect('water_sources.db')
-    cursor = conn.cursor()
+response_cache = ResponseCache()
+
+def conditional_get(*tables, cache=None):
+    """
+    Decorator for read routes whose body depends only on the URL and the given
+    versioned data (see data_validators): answers If-None-Match / If-Modified-Since
+    with 304 before the view runs, and tags successful responses with a strong
+    ETag and Last-Modified. With cache, bodies are kept in it and served from
+    there until a write changes one of the tables' versions.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Read before the view queries, so a write in between only makes the tag stale
+            etag, modified = data_validators(get_db(), tables)
+            # Last-Modified has one second resolution; within the second of the last
+            # write another write could follow with the same value, so it is left out
+            last_modified = int(modified) if int(modified) < int(time.time()) else None
+            if request.if_none_match:
+                matched = matching_etag(etag)
+                not_modified = matched is not None
+            else:
+                matched = etag
+                not_modified = (last_modified is not None and request.if_modified_since is not None and
+                                last_modified <= request.if_modified_since.timestamp())
+            if not_modified:
+                response = app.response_class(status=304)
+                etag = matched
+            else:
+                entry = cache.get(request.full_path, etag) if cache is not None else None
+                if entry is None:
+                    response = app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if cache is not None:
+                        entry = cache.fill(request.full_path, etag, response)
+                if entry is not None:
+                    response = cache.response(request.full_path, entry)
+                if response.content_encoding:
+                    etag = f'{etag}-{response.content_encoding}'
+            response.vary.add('Accept-Encoding')
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+# All writes go through a single writer thread. Each write is an operation(conn)
+# function; whatever has queued up while the previous batch was committing is
+# applied in one transaction, so a burst of small writes shares a single commit
+# and requests never fail with "database is locked". Operations must not commit.
+WRITE_BATCH_SIZE = 512
+WRITE_TIMEOUT_SECONDS = 30
+
+class DatabaseWriter:
+    def __init__(self, max_batch=WRITE_BATCH_SIZE):
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
     
+    def submit(self, operation):
+        """Run operation(conn) on the writer thread, commit it and return its result"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='database-writer', daemon=True)
+                self.thread.start()
+        future = Future()
+        self.queue.put((operation, future))
+        return future.result(WRITE_TIMEOUT_SECONDS)
+    
+    def run(self):
+        conn = connect_db()
+        conn.isolation_level = None  # transactions are managed explicitly
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit_batch(conn, batch)
+    
+    def commit_batch(self, conn, batch):
+        # Each operation runs in its own savepoint so a failing one is undone
+        # without affecting the rest of the batch
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for operation, future in batch:
+                conn.execute('SAVEPOINT operation')
+                try:
+                    result = operation(conn)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO operation')
+                    conn.execute('RELEASE operation')
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute('RELEASE operation')
+                    outcomes.append((future, result, None))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+db_writer = DatabaseWriter()
+
+# Database setup. The schema is built by numbered migrations; the number of the
+# last one applied is kept in PRAGMA user_version. Every step is idempotent, so
+# databases created before migrations were tracked (user_version 0) go through
+# all of them safely. Backfills over existing rows commit in batches so other
+# connections can write between them instead of waiting for the whole migration.
+MIGRATION_BATCH_SIZE = 1000
+PHOTO_MIGRATION_BATCH_SIZE = 50  # rows holding inline photos are megabytes each
+
+Migration = namedtuple('Migration', ['version', 'description', 'apply', 'estimate'])
+
+def table_exists(conn, table):
+    return conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (table,)).fetchone() is not None
+
+def table_columns(conn, table):
+    return [column[1] for column in conn.execute(f'PRAGMA table_info({table})')]
+
+def count_rows(conn, table, where='1'):
+    if not table_exists(conn, table):
+        return 0
+    return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}').fetchone()[0]
+
+def add_column(conn, table, column, definition):
+    if column not in table_columns(conn, table):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def rowid_ranges(conn, table, batch_size=MIGRATION_BATCH_SIZE):
+    """Split a table into consecutive (low, high) rowid ranges of at most batch_size rows"""
+    low = conn.execute(f'SELECT MIN(rowid) FROM {table}').fetchone()[0]
+    while low is not None:
+        row = conn.execute(f'SELECT rowid FROM {table} WHERE rowid >= ? ORDER BY rowid LIMIT 1 OFFSET ?',
+                           (low, batch_size - 1)).fetchone()
+        if row is None:
+            yield low, conn.execute(f'SELECT MAX(rowid) FROM {table}').fetchone()[0]
+            return
+        yield low, row[0]
+        low = conn.execute(f'SELECT MIN(rowid) FROM {table} WHERE rowid > ?', (row[0],)).fetchone()[0]
+
+def migrate_base_tables(conn):
     # Water sources table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS water_sources (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -27,23 +516,16 @@ def init_db():
             cleanliness_level TEXT,
             confidence_score REAL,
             notes TEXT,
-            photo_data TEXT,
             added_by TEXT DEFAULT 'Anonymous',
             admin_override TEXT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    # Check if added_by column exists, add it if not
-    cursor.execute("PRAGMA table_info(water_sources)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'added_by' not in columns:
-        cursor.execute('ALTER TABLE water_sources ADD COLUMN added_by TEXT DEFAULT "Anonymous"')
-    if 'admin_override' not in columns:
-        cursor.execute('ALTER TABLE water_sources ADD COLUMN admin_override TEXT')
+    add_column(conn, 'water_sources', 'added_by', "TEXT DEFAULT 'Anonymous'")
+    add_column(conn, 'water_sources', 'admin_override', 'TEXT')
     
     # Votes table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS votes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             water_source_id INTEGER,
@@ -56,7 +538,7 @@ def init_db():
     ''')
     
     # Comments table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS comments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             water_source_id INTEGER,
@@ -67,15 +549,10 @@ def init_db():
             FOREIGN KEY (water_source_id) REFERENCES water_sources (id)
         )
     ''')
-    
-    # Check if is_admin column exists in comments, add it if not
-    cursor.execute("PRAGMA table_info(comments)")
-    comment_columns = [column[1] for column in cursor.fetchall()]
-    if 'is_admin' not in comment_columns:
-        cursor.execute('ALTER TABLE comments ADD COLUMN is_admin BOOLEAN DEFAULT FALSE')
+    add_column(conn, 'comments', 'is_admin', 'BOOLEAN DEFAULT FALSE')
     
     # Alerts table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS alerts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
@@ -87,14 +564,964 @@ def init_db():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+
+def migrate_spatial_index(conn):
+    # Spatial index over water source coordinates, kept in sync by the write routes
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS water_sources_rtree USING rtree(
+            id,
+            min_lat, max_lat,
+            min_lng, max_lng
+        )
+    ''')
+    
+    # Index any sources added before the spatial index existed
+    for low, high in rowid_ranges(conn, 'water_sources'):
+        conn.execute('''
+            INSERT INTO water_sources_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT id, latitude, latitude, longitude, longitude FROM water_sources
+            WHERE id BETWEEN ? AND ? AND id NOT IN (SELECT id FROM water_sources_rtree)
+        ''', (low, high))
+        conn.commit()
+
+def estimate_spatial_index(conn):
+    if not table_exists(conn, 'water_sources_rtree'):
+        return count_rows(conn, 'water_sources')
+    return count_rows(conn, 'water_sources', 'id NOT IN (SELECT id FROM water_sources_rtree)')
+
+def migrate_inline_photos(conn, table, id_column):
+    """Move base64 photos stored in table.photo_data into the photo store"""
+    for low, high in rowid_ranges(conn, table, PHOTO_MIGRATION_BATCH_SIZE):
+        rows = conn.execute(f'''
+            SELECT {id_column}, photo_data FROM {table}
+            WHERE rowid BETWEEN ? AND ? AND photo_data IS NOT NULL AND photo_data != ''
+        ''', (low, high)).fetchall()
+        for source_id, photo_data in rows:
+            try:
+                photo_hash = store_photo(decode_data_url(photo_data))
+            except ValueError as e:
+                print(f"Skipping unreadable photo for water source {source_id}: {e}")
+                continue
+            conn.execute('INSERT OR IGNORE INTO photos (water_source_id, photo_hash) VALUES (?, ?)',
+                         (source_id, photo_hash))
+        conn.execute(f'''
+            UPDATE {table} SET photo_data = NULL
+            WHERE rowid BETWEEN ? AND ? AND photo_data IS NOT NULL
+        ''', (low, high))
+        conn.commit()
+
+def migrate_photo_store(conn):
+    # Photos table, linking sources to files in the photo store by content hash
+    if table_exists(conn, 'photos') and 'photo_data' in table_columns(conn, 'photos'):
+        # Older versions kept base64 data URLs in this table
+        conn.execute('ALTER TABLE photos RENAME TO photos_inline')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS photos (
+            water_source_id INTEGER PRIMARY KEY,
+            photo_hash TEXT NOT NULL,
+            FOREIGN KEY (water_source_id) REFERENCES water_sources (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_photos_hash ON photos (photo_hash)')
+    
+    # Move photos stored inline by older versions into the photo store
+    if table_exists(conn, 'photos_inline'):
+        migrate_inline_photos(conn, 'photos_inline', 'water_source_id')
+        conn.execute('DROP TABLE photos_inline')
+    if 'photo_data' in table_columns(conn, 'water_sources'):
+        migrate_inline_photos(conn, 'water_sources', 'id')
+
+def estimate_photo_store(conn):
+    rows = 0
+    for table in ('photos', 'photos_inline', 'water_sources'):
+        if table_exists(conn, table) and 'photo_data' in table_columns(conn, table):
+            rows += count_rows(conn, table, "photo_data IS NOT NULL AND photo_data != ''")
+    return rows
+
+def migrate_secondary_indexes(conn):
+    # Secondary indexes for the list queries. Votes are looked up through their
+    # UNIQUE (water_source_id, username) index and coordinates through the R*Tree.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_water_sources_timestamp ON water_sources (timestamp)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_comments_source
+        ON comments (water_source_id, is_admin, timestamp)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts (timestamp)')
+
+def estimate_secondary_indexes(conn):
+    # Building an index reads every row of its table
+    return sum(count_rows(conn, table) for table in ('water_sources', 'comments', 'alerts'))
+
+def migrate_vote_counters(conn):
+    # Per-source vote totals, kept up to date by record_vote
+    add_column(conn, 'water_sources', 'upvotes', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'water_sources', 'downvotes', 'INTEGER NOT NULL DEFAULT 0')
+    # Versions only exist from migration 6 and the change log from migration 7,
+    # which records every source, so the recount marks nothing as changed
+    repair_vote_counts(conn, mark_changed=False)
+
+def migrate_source_versions(conn):
+    # Bumped by every write that changes what the details panel shows
+    add_column(conn, 'water_sources', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+def migrate_change_log(conn):
+    # The latest change to each synced row, numbered by seq; see log_change
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            operation TEXT NOT NULL CHECK(operation IN ('upsert', 'delete')),
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(entity, entity_id)
+        )
+    ''')
     
-    conn.commit()
+    # Record the rows that already exist, so syncing from the start returns all of them
+    for entity, table in SYNC_ENTITIES.items():
+        for low, high in rowid_ranges(conn, table):
+            conn.execute(f'''
+                INSERT OR IGNORE INTO changes (entity, entity_id, operation)
+                SELECT ?, id, 'upsert' FROM {table} WHERE id BETWEEN ? AND ?
+            ''', (entity, low, high))
+            conn.commit()
+
+def add_data_version(conn, name):
+    conn.execute(f'''
+        INSERT OR IGNORE INTO data_versions (name, version, modified)
+        VALUES (?, abs(random() % 1000000000), {UNIX_TIME_SQL})
+    ''', (name,))
+
+def create_version_trigger(conn, name, table, event):
+    """Bump the version of name after every event ('INSERT', 'UPDATE OF column, ...') on table"""
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {name}_{event.split()[0].lower()}_version
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE data_versions SET version = version + 1, modified = {UNIX_TIME_SQL}
+            WHERE name = '{name}';
+        END
+    ''')
+
+def migrate_data_versions(conn):
+    # Table versions for conditional GETs; see data_validators
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            modified REAL NOT NULL
+        )
+    ''')
+    for table in VERSIONED_TABLES:
+        add_data_version(conn, table)
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            create_version_trigger(conn, table, table, operation)
+
+def migrate_vote_totals_version(conn):
+    # Every vote and comment updates its source's counters or version, which the
+    # lists never show: only updates to the listed columns bump water_sources,
+    # and the counters get a version of their own
+    listed_columns = ', '.join(column.strip() for column in WATER_SOURCE_COLUMNS.split(','))
+    conn.execute('DROP TRIGGER IF EXISTS water_sources_update_version')
+    create_version_trigger(conn, 'water_sources', 'water_sources', f'UPDATE OF {listed_columns}')
+    add_data_version(conn, 'vote_totals')
+    create_version_trigger(conn, 'vote_totals', 'water_sources', 'UPDATE OF upvotes, downvotes')
+
+def migrate_source_modified(conn):
+    # When a source's own fields were last edited, which decides conflicts when a
+    # snapshot is merged. Votes and comments leave it alone: they are merged row
+    # by row. Writes that set it themselves, like merges, keep their value.
+    listed_columns = ', '.join(column.strip() for column in WATER_SOURCE_COLUMNS.split(','))
+    add_column(conn, 'water_sources', 'modified', 'DATETIME')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS water_sources_insert_modified
+        AFTER INSERT ON water_sources WHEN NEW.modified IS NULL
+        BEGIN
+            UPDATE water_sources SET modified = NEW.timestamp WHERE id = NEW.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS water_sources_update_modified
+        AFTER UPDATE OF {listed_columns} ON water_sources WHEN NEW.modified IS OLD.modified
+        BEGIN
+            UPDATE water_sources SET modified = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        END
+    ''')
+    for low, high in rowid_ranges(conn, 'water_sources'):
+        conn.execute('''
+            UPDATE water_sources SET modified = timestamp
+            WHERE id BETWEEN ? AND ? AND modified IS NULL
+        ''', (low, high))
+        conn.commit()
+
+def migrate_database_id(conn):
+    # A random id that no write bumps; see DATABASE_ID_SQL
+    add_data_version(conn, 'database')
+
+MIGRATIONS = [
+    Migration(1, 'Create tables and add columns missing from older databases', migrate_base_tables,
+              lambda conn: 0),
+    Migration(2, 'Build the R*Tree spatial index over water sources', migrate_spatial_index,
+              estimate_spatial_index),
+    Migration(3, 'Move inline base64 photos into the photo store', migrate_photo_store,
+              estimate_photo_store),
+    Migration(4, 'Add secondary indexes for the list queries', migrate_secondary_indexes,
+              estimate_secondary_indexes),
+    Migration(5, 'Add vote counters to water sources', migrate_vote_counters,
+              lambda conn: count_rows(conn, 'water_sources')),
+    Migration(6, 'Add a change version to water sources', migrate_source_versions,
+              lambda conn: 0),
+    Migration(7, 'Add the change log used by /sync', migrate_change_log,
+              lambda conn: sum(count_rows(conn, table) for table in SYNC_ENTITIES.values())),
+    Migration(8, 'Track table versions for conditional requests', migrate_data_versions,
+              lambda conn: 0),
+    Migration(9, 'Version vote totals apart from the water source list', migrate_vote_totals_version,
+              lambda conn: 0),
+    Migration(10, 'Record when each water source was last edited', migrate_source_modified,
+              lambda conn: count_rows(conn, 'water_sources')),
+    Migration(11, 'Give the database a random id for conditional requests', migrate_database_id,
+              lambda conn: 0),
+]
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def pending_migrations(conn):
+    version = schema_version(conn)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+def migrate_db(conn):
+    """Apply every pending migration, recording each one as soon as it completes"""
+    for migration in pending_migrations(conn):
+        print(f"Applying migration {migration.version}: {migration.description}")
+        migration.apply(conn)
+        conn.execute(f'PRAGMA user_version = {migration.version}')
+        conn.commit()
+
+def estimate_migrations(conn):
+    """(migration, estimated rows touched) for every pending migration, without changing anything"""
+    return [(migration, migration.estimate(conn)) for migration in pending_migrations(conn)]
+
+db_init_lock = threading.Lock()
+db_initialized = False
+background_tasks_started = False
+
+def check_sqlite_version():
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = '.'.join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(f"SQLite {required} or newer is required, "
+                           f"but Python is linked against SQLite {sqlite3.sqlite_version}")
+
+def init_db():
+    global db_initialized
+    check_sqlite_version()
+    conn = connect_db()
+    migrate_db(conn)
+    check_query_plans(conn)
     conn.close()
+    db_initialized = True
+
+def start_background_tasks():
+    """Start the threads a serving process runs alongside requests, once per process"""
+    global background_tasks_started
+    with db_init_lock:
+        if background_tasks_started:
+            return
+        threading.Thread(target=run_photo_sweeper, name='photo-sweeper', daemon=True).start()
+        background_tasks_started = True
+
+@app.before_request
+def ensure_db_initialized():
+    # Servers that import the app (gunicorn, uwsgi, ...) never run __main__,
+    # so the first request brings the database up to date and starts the
+    # background tasks instead
+    if db_initialized and background_tasks_started:
+        return
+    with db_init_lock:
+        if not db_initialized:
+            init_db()
+    start_background_tasks()
+
+# Content-addressed photo store
+PHOTO_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'GIF': 'gif'
+}
+PHOTO_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+# Downscaled JPEG derivatives generated for every photo (longest side in pixels),
+# largest first so each one can be made from the previous
+PHOTO_SIZES = {
+    'preview': 640,
+    'thumb': 128
+}
+PHOTO_DERIVATIVE_QUALITY = 80
+
+def decode_data_url(data_url):
+    """Raw bytes of a base64 data URL (or bare base64 string)"""
+    payload = data_url.split(',', 1)[1] if ',' in data_url else data_url
+    return base64.b64decode(payload)
+
+def photo_filename(photo_hash):
+    """Name of the stored file for a photo hash, or None if it is not in the store"""
+    for extension in PHOTO_FORMATS.values():
+        filename = f'{photo_hash}.{extension}'
+        if os.path.exists(os.path.join(app.config['PHOTO_DIR'], filename)):
+            return filename
+    return None
+
+def derivative_filename(photo_hash, size):
+    return f'{photo_hash}_{size}.jpg'
+
+def write_photo_file(path, data):
+    # Files are named by content, so one that exists already (perhaps written
+    # by a concurrent upload of the same photo) is the file we would write
+    if os.path.exists(path):
+        return
+    # Write under a temporary name of our own so readers never see a partial file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def create_photo_derivatives(photo_hash, image_bytes):
+    """Write the downscaled JPEG versions of a photo listed in PHOTO_SIZES"""
+    photo_dir = app.config['PHOTO_DIR']
+    image = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder skip detail we are about to throw away
+    largest = max(PHOTO_SIZES.values())
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    else:
+        image = image.convert('RGB')
+    
+    for size, max_dim in PHOTO_SIZES.items():
+        image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=PHOTO_DERIVATIVE_QUALITY, optimize=True, progressive=True)
+        write_photo_file(os.path.join(photo_dir, derivative_filename(photo_hash, size)), output.getvalue())
+
+def photo_derivative(photo_hash, size):
+    """
+    Filename of a photo derivative, generating it for photos stored before
+    derivatives existed. Returns None if the photo is not in the store.
+    """
+    filename = derivative_filename(photo_hash, size)
+    if os.path.exists(os.path.join(app.config['PHOTO_DIR'], filename)):
+        return filename
+    original = photo_filename(photo_hash)
+    if not original:
+        return None
+    with open(os.path.join(app.config['PHOTO_DIR'], original), 'rb') as f:
+        create_photo_derivatives(photo_hash, f.read())
+    return filename
+
+def store_photo(image_bytes):
+    """
+    Save image bytes and their derivatives to the photo store and return their
+    content hash. Identical uploads map to the same files, written only once.
+    """
+    try:
+        image_format = Image.open(io.BytesIO(image_bytes)).format
+    except Exception:
+        raise ValueError('Photo is not a readable image')
+    if image_format not in PHOTO_FORMATS:
+        raise ValueError(f'Unsupported photo format: {image_format}')
+    
+    photo_hash = hashlib.sha256(image_bytes).hexdigest()
+    photo_dir = app.config['PHOTO_DIR']
+    path = os.path.join(photo_dir, f'{photo_hash}.{PHOTO_FORMATS[image_format]}')
+    try:
+        # Uploading it again renews its token; see sweep_unreferenced_photos
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(photo_dir, exist_ok=True)
+        create_photo_derivatives(photo_hash, image_bytes)
+        write_photo_file(path, image_bytes)
+    return photo_hash
+
+def remove_unreferenced_photo(cursor, photo_hash):
+    """Delete a photo file once no water source links to it any more"""
+    cursor.execute('SELECT 1 FROM photos WHERE photo_hash = ? LIMIT 1', (photo_hash,))
+    if cursor.fetchone():
+        return
+    filenames = [photo_filename(photo_hash)]
+    filenames += [derivative_filename(photo_hash, size) for size in PHOTO_SIZES]
+    for filename in filenames:
+        if filename and os.path.exists(os.path.join(app.config['PHOTO_DIR'], filename)):
+            os.remove(os.path.join(app.config['PHOTO_DIR'], filename))
+
+# Photos uploaded for analysis are stored straight away so add_water_source can
+# refer to them by token. Tokens are accepted for PHOTO_TOKEN_TTL_SECONDS after
+# the upload; photos no water source links to are swept from the store a little
+# after that, by a background thread in each server process or the sweep-photos
+# command.
+PHOTO_TOKEN_TTL_SECONDS = 10 * 60
+PHOTO_SWEEP_GRACE_SECONDS = 60  # lets an add_water_source using a token at the last moment finish
+PHOTO_SWEEP_INTERVAL_SECONDS = 10 * 60
+PHOTO_SWEEP_BATCH_SIZE = 500
+
+def photo_token_expired(photo_hash):
+    """Whether a photo is missing or was uploaded too long ago for its token to be accepted"""
+    filename = photo_filename(photo_hash)
+    if not filename:
+        return True
+    return os.path.getmtime(os.path.join(app.config['PHOTO_DIR'], filename)) < time.time() - PHOTO_TOKEN_TTL_SECONDS
+
+def sweep_unreferenced_photos(conn, min_age=PHOTO_TOKEN_TTL_SECONDS + PHOTO_SWEEP_GRACE_SECONDS):
+    """
+    Delete the files of every photo that no water source links to and that was
+    neither written nor uploaded again in the last min_age seconds. Returns the
+    number of photos removed.
+    """
+    photo_dir = app.config['PHOTO_DIR']
+    if not os.path.isdir(photo_dir):
+        return 0
+    # The original, derivatives and leftover temporary files of each photo
+    files = {}
+    newest = {}
+    with os.scandir(photo_dir) as entries:
+        for entry in entries:
+            photo_hash = entry.name[:64]
+            if is_photo_hash(photo_hash):
+                files.setdefault(photo_hash, []).append(entry.name)
+                newest[photo_hash] = max(newest.get(photo_hash, 0), entry.stat().st_mtime)
+    cutoff = time.time() - min_age
+    candidates = [photo_hash for photo_hash in files if newest[photo_hash] < cutoff]
+
+    removed = 0
+    for start in range(0, len(candidates), PHOTO_SWEEP_BATCH_SIZE):
+        batch = candidates[start:start + PHOTO_SWEEP_BATCH_SIZE]
+        referenced = {row[0] for row in conn.execute('''
+            SELECT photo_hash FROM photos WHERE photo_hash IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(batch),))}
+        for photo_hash in batch:
+            if photo_hash in referenced:
+                continue
+            for filename in files[photo_hash]:
+                try:
+                    os.remove(os.path.join(photo_dir, filename))
+                except FileNotFoundError:
+                    pass  # swept by another process
+            removed += 1
+    return removed
+
+def run_photo_sweeper():
+    while True:
+        time.sleep(PHOTO_SWEEP_INTERVAL_SECONDS)
+        conn = connect_db()
+        try:
+            removed = sweep_unreferenced_photos(conn)
+            if removed:
+                print(f"Removed {removed} unreferenced photos from the photo store")
+        except Exception as e:
+            print(f"Error sweeping the photo store: {e}")
+        finally:
+            conn.close()
+
+# Geographic helpers for the spatial queries
+EARTH_RADIUS_KM = 6371
+NEARBY_RADIUS_KM = 25
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometers"""
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(d_lon / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def parse_lat_lng(value):
+    """Parse a 'lat,lng' query parameter"""
+    try:
+        lat, lng = [float(part) for part in value.split(',')]
+    except ValueError:
+        raise ValueError('Expected "lat,lng"')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Coordinates out of range')
+    return lat, lng
+
+def parse_bbox(value):
+    """
+    Parse a 'min_lat,min_lng,max_lat,max_lng' query parameter.
+    min_lng may be greater than max_lng for boxes crossing the antimeridian.
+    """
+    try:
+        min_lat, min_lng, max_lat, max_lng = [float(part) for part in value.split(',')]
+    except ValueError:
+        raise ValueError('Expected "min_lat,min_lng,max_lat,max_lng"')
+    if not (-90 <= min_lat <= max_lat <= 90):
+        raise ValueError('Invalid latitude range')
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise ValueError('Longitude out of range')
+    return min_lat, min_lng, max_lat, max_lng
+
+def radius_bbox(lat, lng, radius_km):
+    """Smallest bounding box containing every point within radius_km of (lat, lng)"""
+    angular = radius_km / EARTH_RADIUS_KM
+    min_lat = lat - math.degrees(angular)
+    max_lat = lat + math.degrees(angular)
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        # The circle covers a pole, so every longitude is in range
+        return max(min_lat, -90), -180, min(max_lat, 90), 180
+    d_lng = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(lat))))
+    min_lng = lng - d_lng
+    max_lng = lng + d_lng
+    if min_lng < -180:
+        min_lng += 360
+    if max_lng > 180:
+        max_lng -= 360
+    return min_lat, min_lng, max_lat, max_lng
+
+def bbox_lng_ranges(min_lng, max_lng):
+    """Split a longitude range crossing the antimeridian into two plain ranges"""
+    if min_lng <= max_lng:
+        return [(min_lng, max_lng)]
+    return [(min_lng, 180), (-180, max_lng)]
+
+# Columns read by list and detail queries; photos are fetched separately
+WATER_SOURCE_COLUMNS = '''
+    id, name, latitude, longitude, water_type, cleanliness_level,
+    confidence_score, notes, added_by, admin_override, timestamp
+'''
+
+# Hot read queries, shared by the routes and the query plan check in init_db
+LIST_SOURCES_SQL = f'SELECT {WATER_SOURCE_COLUMNS} FROM water_sources ORDER BY timestamp DESC, id DESC'
+SOURCE_BY_ID_SQL = f'SELECT {WATER_SOURCE_COLUMNS} FROM water_sources WHERE id = ?'
+SOURCE_DETAILS_SQL = f'''
+    SELECT {WATER_SOURCE_COLUMNS}, upvotes, downvotes, version
+    FROM water_sources WHERE id = ?
+'''
+# The R*Tree stores 32-bit floats, so the exact coordinates are re-checked
+BBOX_FILTER_SQL = '''
+    id IN (
+        SELECT id FROM water_sources_rtree
+        WHERE max_lat >= ? AND min_lat <= ?
+          AND max_lng >= ? AND min_lng <= ?
+    )
+      AND latitude BETWEEN ? AND ?
+      AND longitude BETWEEN ? AND ?
+'''
+SOURCES_IN_BBOX_SQL = f'SELECT {WATER_SOURCE_COLUMNS} FROM water_sources WHERE {BBOX_FILTER_SQL}'
+PHOTO_BY_SOURCE_SQL = 'SELECT photo_hash FROM photos WHERE water_source_id = ?'
+VOTE_COUNTS_SQL = 'SELECT upvotes, downvotes FROM water_sources WHERE id = ?'
+USER_VOTE_SQL = 'SELECT vote_type FROM votes WHERE water_source_id = ? AND username = ?'
+COMMENTS_PAGE_SIZE = 50
+COMMENTS_BY_SOURCE_SQL = '''
+    SELECT id, water_source_id, username, comment, is_admin, timestamp
+    FROM comments WHERE water_source_id = ?
+    ORDER BY is_admin DESC, timestamp DESC, id DESC
+'''
+LIST_ALERTS_SQL = '''
+    SELECT id, title, message, latitude, longitude, alert_type, added_by, timestamp
+    FROM alerts ORDER BY timestamp DESC, id DESC
+'''
+
+CHANGES_SINCE_SQL = '''
+    SELECT seq, entity, entity_id, operation FROM changes
+    WHERE seq > ? ORDER BY seq LIMIT ?
+'''
+
+# Keyset pages: the rows that follow a cursor's sort key in list order
+SOURCES_AFTER_SQL = f'''
+    SELECT {WATER_SOURCE_COLUMNS} FROM water_sources
+    WHERE (timestamp, id) < (?, ?)
+    ORDER BY timestamp DESC, id DESC
+'''
+COMMENTS_AFTER_SQL = '''
+    SELECT id, water_source_id, username, comment, is_admin, timestamp
+    FROM comments WHERE water_source_id = ? AND (is_admin, timestamp, id) < (?, ?, ?)
+    ORDER BY is_admin DESC, timestamp DESC, id DESC
+'''
+ALERTS_AFTER_SQL = '''
+    SELECT id, title, message, latitude, longitude, alert_type, added_by, timestamp
+    FROM alerts WHERE (timestamp, id) < (?, ?)
+    ORDER BY timestamp DESC, id DESC
+'''
+
+# Queries that must be served from an index, with sample parameters
+HOT_QUERIES = [
+    ('list sources', LIST_SOURCES_SQL, ()),
+    ('source details', SOURCE_DETAILS_SQL, (1,)),
+    ('sources in bbox', SOURCES_IN_BBOX_SQL, (0, 1, 0, 1, 0, 1, 0, 1)),
+    ('photo of source', PHOTO_BY_SOURCE_SQL, (1,)),
+    ('photo references', 'SELECT 1 FROM photos WHERE photo_hash = ? LIMIT 1', ('',)),
+    ('vote counts of source', VOTE_COUNTS_SQL, (1,)),
+    ('vote of user', USER_VOTE_SQL, (1, '')),
+    ('comments of source', COMMENTS_BY_SOURCE_SQL, (1,)),
+    ('list alerts', LIST_ALERTS_SQL, ()),
+    ('sources page', SOURCES_AFTER_SQL + ' LIMIT ?', ('', 1, 1)),
+    ('comments page', COMMENTS_AFTER_SQL + ' LIMIT ?', (1, 0, '', 1, 1)),
+    ('alerts page', ALERTS_AFTER_SQL + ' LIMIT ?', ('', 1, 1)),
+    ('changes since', CHANGES_SINCE_SQL, (0, 1)),
+    ('delete comments of source', 'DELETE FROM comments WHERE water_source_id = ?', (1,)),
+    ('delete votes of source', 'DELETE FROM votes WHERE water_source_id = ?', (1,))
+]
+
+def check_query_plans(conn):
+    """
+    Run EXPLAIN QUERY PLAN on every hot query and warn about full table scans
+    and sorts that are not served by an index. Returns the warnings.
+    """
+    warnings = []
+    for name, sql, params in HOT_QUERIES:
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+            detail = row[3]
+            full_scan = (detail.startswith('SCAN ') and 'USING' not in detail and
+                         'VIRTUAL TABLE' not in detail)
+            if full_scan or 'TEMP B-TREE' in detail:
+                warnings.append(f"{name}: {detail}")
+    for warning in warnings:
+        print(f"Warning: unindexed query plan for {warning}")
+    return warnings
+
+def query_sources_in_bbox(cursor, min_lat, min_lng, max_lat, max_lng, limit=None, after=None):
+    """
+    Water source rows inside a bounding box, newest first, using the R*Tree index.
+    With limit, only the first limit rows after the (timestamp, id) key after.
+    """
+    sql = SOURCES_IN_BBOX_SQL
+    page_params = []
+    if after is not None:
+        sql += ' AND (timestamp, id) < (?, ?)'
+        page_params += after
+    if limit is not None:
+        sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        page_params.append(limit)
+    
+    rows = []
+    for lng_lo, lng_hi in bbox_lng_ranges(min_lng, max_lng):
+        cursor.execute(sql, [min_lat, max_lat, lng_lo, lng_hi, min_lat, max_lat, lng_lo, lng_hi] + page_params)
+        rows.extend(cursor.fetchall())
+    rows.sort(key=lambda row: (row['timestamp'] or '', row['id']), reverse=True)
+    return rows[:limit] if limit is not None else rows
+
+def iter_sources_in_bbox(conn, min_lat, min_lng, max_lat, max_lng):
+    """Streaming query_sources_in_bbox: rows are yielded newest first as they are read"""
+    streams = []
+    for lng_lo, lng_hi in bbox_lng_ranges(min_lng, max_lng):
+        cursor = conn.execute(SOURCES_IN_BBOX_SQL + ' ORDER BY timestamp DESC, id DESC',
+                              (min_lat, max_lat, lng_lo, lng_hi, min_lat, max_lat, lng_lo, lng_hi))
+        streams.append(iter_rows(cursor))
+    # Boxes across the antimeridian are two ranges, each already in order
+    return heapq.merge(*streams, key=lambda row: (row['timestamp'] or '', row['id']), reverse=True)
+
+# Cursor pagination. List endpoints given ?limit= (and ?after= for later pages)
+# return one page of the usual JSON array; the cursor for the next page is sent
+# in the X-Next-Cursor header. A cursor is the sort key of the last row served,
+# so each page is an index range scan however deep into the list it is.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, key_length):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != key_length:
+        raise ValueError('Invalid cursor')
+    return key
+
+def parse_page_args(key_length):
+    """(limit, after key) from the query string, or (None, None) if the request is not paginated"""
+    if 'limit' not in request.args and 'after' not in request.args:
+        return None, None
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    after = decode_cursor(request.args['after'], key_length) if request.args.get('after') else None
+    return limit, after
+
+def page_response(items, limit, cursor_key, ndjson=False):
+    """JSON array of the first limit items, pointing X-Next-Cursor past them if more were fetched"""
+    page = items[:limit]
+    response = stream_json_response(page, ndjson) if ndjson else jsonify(page)
+    if len(items) > limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(cursor_key(items[limit - 1]))
+    return response
+
+# Streaming. Unpaginated lists are serialized while rows are read from the
+# cursor, so neither the rows nor the JSON text are ever held in full.
+STREAM_FETCH_SIZE = 500
+
+def iter_batches(cursor, size=STREAM_FETCH_SIZE):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+def iter_rows(cursor, size=STREAM_FETCH_SIZE):
+    for rows in iter_batches(cursor, size):
+        yield from rows
+
+def parse_stream_format():
+    """True if ?format=ndjson asks for newline-delimited JSON instead of an array"""
+    stream_format = request.args.get('format', 'json')
+    if stream_format not in ('json', 'ndjson'):
+        raise ValueError('format must be json or ndjson')
+    return stream_format == 'ndjson'
+
+def stream_json_response(items, ndjson=False):
+    """Response that serializes items as they are produced, as a JSON array or NDJSON"""
+    def generate():
+        parts = [] if ndjson else ['[']
+        for index, item in enumerate(items):
+            if ndjson:
+                parts.append(app.json.dumps(item, separators=(',', ':')) + '\n')
+            else:
+                parts.append((',' if index else '') + app.json.dumps(item, separators=(',', ':')))
+            if len(parts) >= STREAM_FETCH_SIZE:
+                yield ''.join(parts)
+                parts = []
+        if not ndjson:
+            parts.append(']')
+        yield ''.join(parts)
+    
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype)
+
+def timestamp_cursor_key(item):
+    # Sources and alerts are listed by (timestamp, id)
+    return item['timestamp'], item['id']
+
+def comment_cursor_key(comment):
+    return int(comment['is_admin']), comment['timestamp'], comment['id']
+
+def query_comments_page(cursor, source_id, limit, after=None):
+    """Up to limit + 1 comments of a source, the extra one telling whether more follow"""
+    if after is None:
+        cursor.execute(COMMENTS_BY_SOURCE_SQL + ' LIMIT ?', (source_id, limit + 1))
+    else:
+        cursor.execute(COMMENTS_AFTER_SQL + ' LIMIT ?', (source_id, *after, limit + 1))
+    return [comment_to_dict(row) for row in cursor.fetchall()]
+
+# Nearest-neighbour search: grow a radius around the point until it holds k sources
+NEAREST_START_RADIUS_KM = 1
+NEAREST_DEFAULT_K = 10
+NEAREST_MAX_K = 100
+
+def nearest_sources(cursor, lat, lng, k):
+    """
+    The k water sources closest to (lat, lng) as (distance_km, row) pairs.
+    Once a circle of radius r contains k sources, no source outside it can be
+    closer, so the R*Tree only has to be searched over an expanding bounding box.
+    """
+    max_radius_km = math.pi * EARTH_RADIUS_KM
+    radius_km = NEAREST_START_RADIUS_KM
+    while True:
+        candidates = []
+        for row in query_sources_in_bbox(cursor, *radius_bbox(lat, lng, radius_km)):
+            distance_km = haversine_km(lat, lng, row['latitude'], row['longitude'])
+            if distance_km <= radius_km:
+                candidates.append((distance_km, row))
+        if len(candidates) >= k or radius_km >= max_radius_km:
+            candidates.sort(key=lambda candidate: candidate[0])
+            return candidates[:k]
+        # Grow faster while the area is empty, otherwise scale by the observed density
+        if candidates:
+            radius_km *= max(2, math.sqrt(k / len(candidates)))
+        else:
+            radius_km *= 4
+        radius_km = min(radius_km, max_radius_km)
+
+def water_source_to_dict(row):
+    """JSON representation of a water_sources row"""
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'latitude': row['latitude'],
+        'longitude': row['longitude'],
+        'water_type': row['water_type'],
+        'cleanliness_level': row['cleanliness_level'],
+        'confidence_score': row['confidence_score'],
+        'notes': row['notes'],
+        'added_by': row['added_by'] if row['added_by'] else 'Anonymous',
+        'admin_override': row['admin_override'],
+        'timestamp': row['timestamp']
+    }
+
+def comment_to_dict(row):
+    """JSON representation of a comments row"""
+    return {
+        'id': row['id'],
+        'water_source_id': row['water_source_id'],
+        'username': row['username'],
+        'comment': row['comment'],
+        'is_admin': bool(row['is_admin']),
+        'timestamp': row['timestamp']
+    }
+
+def alert_to_dict(row):
+    """JSON representation of an alerts row"""
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'message': row['message'],
+        'latitude': row['latitude'],
+        'longitude': row['longitude'],
+        'alert_type': row['alert_type'],
+        'added_by': row['added_by'],
+        'timestamp': row['timestamp']
+    }
+
+# Change log for /sync. Every writer operation that adds, changes or deletes a
+# water source or alert records it here. An entity keeps only its latest change,
+# renumbered with a new seq each time, so the log grows with the number of rows
+# rather than the number of writes. Deleted rows stay behind as tombstones.
+SYNC_ENTITIES = {
+    'water_source': 'water_sources',
+    'alert': 'alerts'
+}
+
+def log_change(conn, entity, entity_id, operation='upsert'):
+    conn.execute('''
+        INSERT OR REPLACE INTO changes (entity, entity_id, operation)
+        VALUES (?, ?, ?)
+    ''', (entity, entity_id, operation))
+
+def bump_source_version(conn, water_source_id):
+    """Mark a water source as changed, for writes to its votes or comments"""
+    conn.execute('UPDATE water_sources SET version = version + 1 WHERE id = ?', (water_source_id,))
+    log_change(conn, 'water_source', water_source_id)
+
+def delete_water_source_rows(conn, water_source_id):
+    """
+    Writer operation: delete a water source with its comments, votes and photo
+    link. Returns (found, photo hash); the caller removes the file once nothing
+    else references it.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM water_sources WHERE id = ?', (water_source_id,))
+    if cursor.fetchone() is None:
+        return False, None
+    
+    # Delete associated comments first
+    cursor.execute('DELETE FROM comments WHERE water_source_id = ?', (water_source_id,))
+    
+    # Delete associated votes
+    cursor.execute('DELETE FROM votes WHERE water_source_id = ?', (water_source_id,))
+    
+    # Delete the photo link; the file goes once nothing else references it
+    cursor.execute('SELECT photo_hash FROM photos WHERE water_source_id = ?', (water_source_id,))
+    photo_row = cursor.fetchone()
+    cursor.execute('DELETE FROM photos WHERE water_source_id = ?', (water_source_id,))
+    
+    # Delete the water source and its spatial index entry
+    cursor.execute('DELETE FROM water_sources_rtree WHERE id = ?', (water_source_id,))
+    cursor.execute('DELETE FROM water_sources WHERE id = ?', (water_source_id,))
+    log_change(conn, 'water_source', water_source_id, 'delete')
+    return True, photo_row[0] if photo_row else None
+
+# Vote counters. water_sources.upvotes/downvotes are updated in the same
+# transaction as the votes table, so reading them never means counting votes.
+VOTE_COUNTER_COLUMNS = {
+    'upvote': 'upvotes',
+    'downvote': 'downvotes'
+}
+
+def record_vote(conn, water_source_id, username, vote_type):
+    """Writer operation: insert or switch a user's vote and adjust the counters"""
+    row = conn.execute(USER_VOTE_SQL, (water_source_id, username)).fetchone()
+    previous = row[0] if row else None
+    
+    # Replace existing vote or insert new one
+    conn.execute('''
+        INSERT OR REPLACE INTO votes (water_source_id, username, vote_type)
+        VALUES (?, ?, ?)
+    ''', (water_source_id, username, vote_type))
+    if previous == vote_type:
+        return
+    if previous in VOTE_COUNTER_COLUMNS:
+        column = VOTE_COUNTER_COLUMNS[previous]
+        conn.execute(f'UPDATE water_sources SET {column} = {column} - 1 WHERE id = ?', (water_source_id,))
+    column = VOTE_COUNTER_COLUMNS[vote_type]
+    conn.execute(f'''
+        UPDATE water_sources SET {column} = {column} + 1, version = version + 1
+        WHERE id = ?
+    ''', (water_source_id,))
+    log_change(conn, 'water_source', water_source_id)
+
+VOTE_TOTALS_SQL = '''
+    SELECT COUNT(*) FILTER (WHERE vote_type = 'upvote'),
+           COUNT(*) FILTER (WHERE vote_type = 'downvote')
+    FROM votes WHERE water_source_id = water_sources.id
+'''
+
+def repair_vote_counts(conn, batch_size=MIGRATION_BATCH_SIZE, mark_changed=True):
+    """
+    Recount the votes of every source, fixing counters that disagree. With
+    mark_changed, each fixed source also gets a new version and a change log
+    entry. Returns the number fixed.
+    """
+    version_update = ', version = version + 1' if mark_changed else ''
+    repaired = 0
+    for low, high in rowid_ranges(conn, 'water_sources', batch_size):
+        fixed_ids = [row[0] for row in conn.execute(f'''
+            UPDATE water_sources SET (upvotes, downvotes) = ({VOTE_TOTALS_SQL}){version_update}
+            WHERE id BETWEEN ? AND ? AND (upvotes, downvotes) != ({VOTE_TOTALS_SQL})
+            RETURNING id
+        ''', (low, high)).fetchall()]
+        if mark_changed:
+            for source_id in fixed_ids:
+                log_change(conn, 'water_source', source_id)
+        repaired += len(fixed_ids)
+        conn.commit()
+    return repaired
+
+# Global statistics of a photo that the classifier works from
+ImageStats = namedtuple('ImageStats', [
+    'brightness',   # mean gray level
+    'turbidity',    # standard deviation of the gray level
+    'red_mean',
+    'green_mean',
+    'blue_mean',
+    'brown_ratio'   # fraction of pixels with red > 100, green > 80, blue < 80
+])
+
+def compute_image_stats(img_array):
+    """
+    Compute ImageStats for an RGB uint8 array. Each statistic comes from a
+    single OpenCV pass over uint8 data, so the only full-size temporaries are
+    the gray image and the brown mask, both one byte per pixel.
+    """
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    brightness, turbidity = cv2.meanStdDev(gray)
+    red_mean, green_mean, blue_mean = cv2.mean(img_array)[:3]
+    brown_mask = cv2.inRange(img_array, (101, 81, 0), (255, 255, 79))
+    total_pixels = img_array.shape[0] * img_array.shape[1]
+    return ImageStats(
+        brightness=float(brightness[0, 0]),
+        turbidity=float(turbidity[0, 0]),
+        red_mean=red_mean,
+        green_mean=green_mean,
+        blue_mean=blue_mean,
+        brown_ratio=cv2.countNonZero(brown_mask) / total_pixels
+    )
 
 # Simple water quality classifier using OpenCV heuristics
 class WaterQualityClassifier:
-    def __init__(self):
-        pass
+    def load_image_array(self, image_bytes):
+        """Decode an image into a full-resolution RGB array"""
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
     
     def analyze_water_image(self, image_data):
         """
@@ -104,62 +1531,784 @@ class WaterQualityClassifier:
         try:
             # Decode base64 image
             image_bytes = base64.b64decode(image_data.split(',')[1])
-            image = Image.open(io.BytesIO(image_bytes))
-            img_array = np.array(image)
-            
-            # Convert to different color spaces for analysis
-            hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-            
-            # Calculate various metrics
-            brightness = np.mean(gray)
-            contrast = np.std(gray)
-            
-            # Analyze color distribution
-            blue_channel = img_array[:, :, 2]
-            green_channel = img_array[:, :, 1]
-            red_channel = img_array[:, :, 0]
-            
-            blue_mean = np.mean(blue_channel)
-            green_mean = np.mean(green_channel)
-            red_mean = np.mean(red_channel)
-            
-            # Calculate turbidity indicator (standard deviation of brightness)
-            turbidity = np.std(gray)
-            
-            # Color analysis for contamination
-            brown_pixels = np.sum((red_channel > 100) & (green_channel > 80) & (blue_channel < 80))
-            total_pixels = img_array.shape[0] * img_array.shape[1]
-            brown_ratio = brown_pixels / total_pixels
-            
-            # Classification logic
-            confidence = 0.7  # Base confidence
-            
-            # Clean water indicators
-            if (blue_mean > green_mean and blue_mean > red_mean and 
-                turbidity < 30 and brown_ratio < 0.1 and brightness > 100):
-                return "clean", min(0.95, confidence + 0.2)
-            
-            # Muddy water indicators
-            elif (brown_ratio > 0.15 or turbidity > 50 or 
-                  (red_mean > blue_mean and green_mean > blue_mean)):
-                return "muddy", min(0.9, confidence + 0.1)
-            
-            # Contaminated water indicators
-            elif (turbidity > 40 or brightness < 50 or 
-                  abs(red_mean - green_mean) > 50):
-                return "contaminated", min(0.85, confidence + 0.05)
-            
-            # Default to muddy if uncertain
-            else:
-                return "muddy", confidence - 0.2
-                
         except Exception as e:
             print(f"Error analyzing image: {e}")
             return "unknown", 0.3
+        return self.analyze_image_bytes(image_bytes)
+    
+    def analyze_image_bytes(self, image_bytes):
+        """
+        Analyze already decoded image bytes
+        Returns: (cleanliness_level, confidence_score)
+        """
+        try:
+            img_array = self.load_image_array(image_bytes)
+            return self.classify(compute_image_stats(img_array))
+        except Exception as e:
+            print(f"Error analyzing image: {e}")
+            return "unknown", 0.3
+    
+    def classify(self, stats):
+        """
+        Classify water quality from an ImageStats
+        Returns: (cleanliness_level, confidence_score)
+        """
+        confidence = 0.7  # Base confidence
+        
+        # Clean water indicators
+        if (stats.blue_mean > stats.green_mean and stats.blue_mean > stats.red_mean and 
+            stats.turbidity < 30 and stats.brown_ratio < 0.1 and stats.brightness > 100):
+            return "clean", min(0.95, confidence + 0.2)
+        
+        # Muddy water indicators
+        elif (stats.brown_ratio > 0.15 or stats.turbidity > 50 or 
+              (stats.red_mean > stats.blue_mean and stats.green_mean > stats.blue_mean)):
+            return "muddy", min(0.9, confidence + 0.1)
+        
+        # Contaminated water indicators
+        elif (stats.turbidity > 40 or stats.brightness < 50 or 
+              abs(stats.red_mean - stats.green_mean) > 50):
+            return "contaminated", min(0.85, confidence + 0.05)
+        
+        # Default to muddy if uncertain
+        else:
+            return "muddy", confidence - 0.2
 
 classifier = WaterQualityClassifier()
 
+# Photos are usually analyzed twice (when picked, then when the source is saved),
+# so classifier results are cached by photo content hash
+ANALYSIS_CACHE_SIZE = 1024
+
+class AnalysisCache:
+    """Bounded LRU cache of classifier results with hit/miss counters"""
+    def __init__(self, max_entries=ANALYSIS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, photo_hash):
+        with self.lock:
+            result = self.entries.get(photo_hash)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(photo_hash)
+            self.hits += 1
+            return result
+    
+    def __contains__(self, photo_hash):
+        with self.lock:
+            return photo_hash in self.entries
+    
+    def put(self, photo_hash, result):
+        with self.lock:
+            self.entries[photo_hash] = result
+            self.entries.move_to_end(photo_hash)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+analysis_cache = AnalysisCache()
+
+# Photo analysis runs in a pool of worker processes so uploads never block request threads
+ANALYSIS_WORKERS = int(os.environ.get('WELL_ANALYSIS_WORKERS', 2))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get('WELL_ANALYSIS_QUEUE_SIZE', 32))
+BATCH_ANALYSIS_WORKERS = int(os.environ.get('WELL_BATCH_ANALYSIS_WORKERS', 1))
+ANALYSIS_JOB_TTL_SECONDS = PHOTO_TOKEN_TTL_SECONDS  # a job's analysis_token expires with it
+
+PHOTO_MISSING_ERROR = 'Photo is no longer in the photo store'
+
+def analyze_file_in_worker(path):
+    """
+    Process pool entry point: classify a photo from the store. Returns None if
+    the photo was deleted after it was queued.
+    """
+    try:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+    except FileNotFoundError:
+        return None
+    return WaterQualityClassifier().analyze_image_bytes(image_bytes)
+
+class AnalysisQueueFull(Exception):
+    pass
+
+class AnalysisQueue:
+    """
+    Bounded queue of photo analysis jobs backed by a process pool.
+    Jobs for a photo that is already being analyzed share the running job.
+    Batches of stored photos run one at a time on a pool of their own, so
+    they never hold up the photos people are waiting on.
+    """
+    def __init__(self, workers=ANALYSIS_WORKERS, max_pending=ANALYSIS_QUEUE_SIZE,
+                 batch_workers=BATCH_ANALYSIS_WORKERS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.batch_workers = batch_workers
+        self.executor = None
+        self.batch_executor = None
+        self.jobs = {}
+        self.running = {}  # photo hash -> job id
+        self.batch_job = None
+        self.lock = threading.Lock()
+    
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+    
+    def get_batch_executor(self):
+        if self.batch_executor is None:
+            self.batch_executor = ProcessPoolExecutor(self.batch_workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+        return self.batch_executor
+    
+    def submit_to_pool(self, *args):
+        """
+        executor.submit(*args), replacing the pool first if a worker that died
+        (out of memory, a crash in native code) left it unusable. Caller holds the lock.
+        """
+        try:
+            return self.get_executor().submit(*args)
+        except BrokenProcessPool:
+            self.discard_executor(self.executor)
+            return self.get_executor().submit(*args)
+    
+    def discard_executor(self, executor):
+        # Caller holds the lock
+        if self.executor is executor:
+            self.executor = None
+        if self.batch_executor is executor:
+            self.batch_executor = None
+        executor.shutdown(wait=False)
+    
+    def can_accept(self, photo_hash):
+        """Whether submitting this photo now would succeed"""
+        with self.lock:
+            return (photo_hash in self.running or len(self.running) < self.max_pending or
+                    photo_hash in analysis_cache)
+    
+    def submit(self, photo_hash, on_done=None, force=False):
+        """
+        Queue analysis of a stored photo and return the job id. on_done, if
+        given, is called with (cleanliness_level, confidence_score) once the
+        result is known. Raises AnalysisQueueFull when too many jobs are pending,
+        unless force is set (for callers that already checked can_accept).
+        A photo that has left the store, such as one whose only water source was
+        just deleted, gets a failed job.
+        """
+        callbacks = [on_done] if on_done else []
+        cached = analysis_cache.get(photo_hash)
+        filename = photo_filename(photo_hash)
+        with self.lock:
+            self.prune_jobs()
+            if cached is None and photo_hash in self.running:
+                job = self.jobs[self.running[photo_hash]]
+                job['callbacks'].extend(callbacks)
+                return job['job_id']
+            
+            job = self.new_job(photo_hash, callbacks)
+            if cached is None and filename:
+                if len(self.running) >= self.max_pending and not force:
+                    raise AnalysisQueueFull()
+                path = os.path.join(app.config['PHOTO_DIR'], filename)
+                future = self.submit_to_pool(analyze_file_in_worker, path)
+                self.running[photo_hash] = job['job_id']
+            self.jobs[job['job_id']] = job
+        
+        if cached is not None:
+            self.complete(job, cached, None)
+        elif filename:
+            future.add_done_callback(lambda future: self.finish(job, future))
+        else:
+            self.complete(job, None, PHOTO_MISSING_ERROR)
+        return job['job_id']
+    
+    @staticmethod
+    def new_job(analysis_token, callbacks=None):
+        return {
+            'job_id': uuid.uuid4().hex,
+            'analysis_token': analysis_token,
+            'status': 'pending',
+            'result': None,
+            'error': None,
+            'totals': None,
+            'callbacks': callbacks or [],
+            'finished_at': None
+        }
+    
+    def failed_job(self, photo_hash, error):
+        """Record a job for photo_hash that failed with error and return its id"""
+        job = self.new_job(photo_hash)
+        with self.lock:
+            self.prune_jobs()
+            self.jobs[job['job_id']] = job
+        self.complete(job, None, error)
+        return job['job_id']
+    
+    def submit_batch(self, source_ids):
+        """
+        Start re-analyzing the photos of source_ids in the background and return
+        the job id; the job reports the running totals of reclassify_sources.
+        Raises AnalysisQueueFull while another batch is running.
+        """
+        with self.lock:
+            self.prune_jobs()
+            if self.batch_job is not None:
+                raise AnalysisQueueFull()
+            job = self.new_job(None)
+            self.jobs[job['job_id']] = job
+            self.batch_job = job
+        threading.Thread(target=self.run_batch, args=(job, source_ids), name='batch-analysis',
+                         daemon=True).start()
+        return job['job_id']
+    
+    def run_batch(self, job, source_ids):
+        def report(totals):
+            with self.lock:
+                job['totals'] = dict(totals)
+        
+        conn = connect_db()
+        with self.lock:
+            executor = self.get_batch_executor()
+        try:
+            report(reclassify_sources(conn, executor, source_ids, progress=report))
+            error = None
+        except BrokenProcessPool as e:
+            # The next batch gets a new pool
+            with self.lock:
+                self.discard_executor(executor)
+            error = str(e)
+        except Exception as e:
+            error = str(e)
+        finally:
+            conn.close()
+        with self.lock:
+            self.batch_job = None
+            job['error'] = error
+            job['status'] = 'failed' if error else 'done'
+            job['finished_at'] = time.time()
+    
+    def finish(self, job, future):
+        try:
+            result, error = future.result(), None
+            if result is None:
+                error = PHOTO_MISSING_ERROR
+            else:
+                analysis_cache.put(job['analysis_token'], result)
+        except Exception as e:
+            result, error = None, str(e)
+        with self.lock:
+            self.running.pop(job['analysis_token'], None)
+        self.complete(job, result, error)
+    
+    def complete(self, job, result, error):
+        # Run callbacks first so a client that sees 'done' also sees their effects
+        with self.lock:
+            callbacks, job['callbacks'] = job['callbacks'], []
+        if result:
+            for callback in callbacks:
+                try:
+                    callback(*result)
+                except Exception as e:
+                    print(f"Error saving analysis result: {e}")
+        with self.lock:
+            job['result'] = result
+            job['error'] = error
+            job['status'] = 'failed' if error else 'done'
+            job['finished_at'] = time.time()
+    
+    def prune_jobs(self):
+        # Forget finished jobs nobody has polled for a while (caller holds the lock)
+        cutoff = time.time() - ANALYSIS_JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self.jobs[job_id]
+    
+    def job_status(self, job_id):
+        """JSON representation of a job, or None if it is unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = {
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'analysis_token': job['analysis_token']
+            }
+            if job['result']:
+                status['cleanliness_level'], status['confidence_score'] = job['result']
+            if job['totals']:
+                status['totals'] = job['totals']
+            if job['error']:
+                status['error'] = job['error']
+            return status
+
+analysis_queue = AnalysisQueue()
+
+# Re-scoring stored photos after the classifier changes
+RECLASSIFY_CHUNK_SIZE = 256
+BATCH_ANALYSIS_MAX_SOURCES = 1000
+
+def reclassify_sources(conn, executor, source_ids=None, chunk_size=RECLASSIFY_CHUNK_SIZE, progress=None):
+    """
+    Re-run the classifier over stored photos and write the results back.
+    Photos are read from conn in chunks of chunk_size and analyzed in parallel
+    on executor while the previous chunk's results are written by db_writer
+    in a single transaction.
+    source_ids limits the run to those sources; progress, if given, is called
+    with the running totals after every chunk. Returns the final totals.
+    """
+    query = '''
+        SELECT p.water_source_id, p.photo_hash, ws.cleanliness_level, ws.confidence_score
+        FROM photos p JOIN water_sources ws ON ws.id = p.water_source_id
+        WHERE p.water_source_id > ?
+    '''
+    params = []
+    if source_ids is not None:
+        query += ' AND p.water_source_id IN (SELECT value FROM json_each(?))'
+        params.append(json.dumps(source_ids))
+    query += ' ORDER BY p.water_source_id LIMIT ?'
+    
+    totals = {'processed': 0, 'changed': 0, 'missing': 0, 'seconds': 0.0, 'photos_per_second': 0.0}
+    start = time.perf_counter()
+    
+    def write_chunk(chunk):
+        rows, results = chunk
+        updates = []
+        missing = 0
+        for (source_id, _, old_level, old_confidence), result in zip(rows, results):
+            if result is None:
+                # Deleted since the chunk was read
+                missing += 1
+            elif result != (old_level, old_confidence):
+                updates.append((result[0], result[1], source_id))
+        def update(conn):
+            conn.executemany('''
+                UPDATE water_sources SET cleanliness_level = ?, confidence_score = ?, version = version + 1
+                WHERE id = ?
+            ''', updates)
+            for _, _, source_id in updates:
+                log_change(conn, 'water_source', source_id)
+        db_writer.submit(update)
+        totals['processed'] += len(rows) - missing
+        totals['missing'] += missing
+        totals['changed'] += len(updates)
+        totals['seconds'] = time.perf_counter() - start
+        totals['photos_per_second'] = totals['processed'] / totals['seconds'] if totals['seconds'] else 0.0
+        if progress:
+            progress(totals)
+    
+    last_id = 0
+    pending = None
+    while True:
+        rows = conn.execute(query, [last_id] + params + [chunk_size]).fetchall()
+        chunk = None
+        if rows:
+            last_id = rows[-1][0]
+            paths = {row[0]: photo_filename(row[1]) for row in rows}
+            totals['missing'] += sum(1 for filename in paths.values() if not filename)
+            rows = [row for row in rows if paths[row[0]]]
+            # Executor.map submits the whole chunk now and yields results in order
+            results = executor.map(analyze_file_in_worker,
+                                   [os.path.join(app.config['PHOTO_DIR'], paths[row[0]]) for row in rows])
+            chunk = (rows, results)
+        if pending:
+            write_chunk(pending)
+        if chunk is None:
+            break
+        pending = chunk
+    return totals
+
+def save_analysis_result(source_id):
+    """Callback for analysis_queue that stores the result on a water source"""
+    def save(cleanliness_level, confidence_score):
+        def update(conn):
+            conn.execute('''
+                UPDATE water_sources SET cleanliness_level = ?, confidence_score = ?, version = version + 1
+                WHERE id = ?
+            ''', (cleanliness_level, confidence_score, source_id))
+            log_change(conn, 'water_source', source_id)
+        db_writer.submit(update)
+    return save
+
+def is_photo_hash(value):
+    return (isinstance(value, str) and len(value) == 64 and
+            all(c in '0123456789abcdef' for c in value))
+
+# Offline region snapshots. A snapshot is a small standalone SQLite database,
+# gzipped, holding the water sources of a bounding box with their votes,
+# thumbnails and most recent comments, plus the alerts in the box, the ids of
+# deleted sources and the change seq it was taken at. Field devices import it
+# with merge_region_snapshot; passing that seq back as since to the next export
+# gives a bundle of only what changed in between.
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_COMMENTS_PER_SOURCE = 20
+# Fields of a water source taken from a snapshot when its copy was edited last
+SNAPSHOT_SOURCE_FIELDS = [
+    'id', 'name', 'latitude', 'longitude', 'water_type', 'cleanliness_level',
+    'confidence_score', 'notes', 'added_by', 'admin_override', 'timestamp', 'modified'
+]
+# For offline readers of the snapshot; merging recounts them from the votes
+SNAPSHOT_TOTAL_FIELDS = ['upvotes', 'downvotes']
+SNAPSHOT_SCHEMA = '''
+    CREATE TABLE snapshot_info (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE water_sources (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        water_type TEXT,
+        cleanliness_level TEXT,
+        confidence_score REAL,
+        notes TEXT,
+        added_by TEXT,
+        admin_override TEXT,
+        timestamp DATETIME,
+        modified DATETIME,
+        upvotes INTEGER NOT NULL,
+        downvotes INTEGER NOT NULL,
+        photo_hash TEXT
+    );
+    CREATE TABLE votes (
+        water_source_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        vote_type TEXT NOT NULL,
+        timestamp DATETIME,
+        PRIMARY KEY (water_source_id, username)
+    );
+    CREATE TABLE comments (
+        id INTEGER PRIMARY KEY,
+        water_source_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        comment TEXT NOT NULL,
+        is_admin BOOLEAN,
+        timestamp DATETIME
+    );
+    CREATE TABLE alerts (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        alert_type TEXT,
+        added_by TEXT NOT NULL,
+        timestamp DATETIME
+    );
+    CREATE TABLE thumbnails (photo_hash TEXT PRIMARY KEY, data BLOB NOT NULL);
+    CREATE TABLE deleted_water_sources (id INTEGER PRIMARY KEY);
+'''
+SNAPSHOT_SOURCES_SQL = f'''
+    SELECT {', '.join(SNAPSHOT_SOURCE_FIELDS + SNAPSHOT_TOTAL_FIELDS)},
+           (SELECT photo_hash FROM photos WHERE water_source_id = water_sources.id) AS photo_hash
+    FROM water_sources WHERE {BBOX_FILTER_SQL}
+'''
+SNAPSHOT_ALERTS_SQL = '''
+    SELECT id, title, message, latitude, longitude, alert_type, added_by, timestamp
+    FROM alerts WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+'''
+SNAPSHOT_VOTES_SQL = '''
+    SELECT water_source_id, username, vote_type, timestamp FROM votes WHERE water_source_id = ?
+'''
+CHANGED_SINCE_SQL = ' AND id IN (SELECT entity_id FROM changes WHERE entity = ? AND seq > ?)'
+
+def build_region_snapshot(conn, bbox, output, since=None):
+    """
+    Write a gzipped snapshot of a bounding box to the binary file object output,
+    limited to rows changed after seq since if given. Returns what it holds.
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox
+    totals = {'water_sources': 0, 'votes': 0, 'comments': 0, 'alerts': 0, 'thumbnails': 0, 'deleted': 0}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_path = os.path.join(temp_dir, 'snapshot.sqlite')
+        snapshot = sqlite3.connect(snapshot_path)
+        snapshot.executescript(SNAPSHOT_SCHEMA)
+        
+        # One read transaction, so the snapshot matches the seq it records
+        conn.execute('BEGIN')
+        try:
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+            source_fields = ', '.join(SNAPSHOT_SOURCE_FIELDS + SNAPSHOT_TOTAL_FIELDS + ['photo_hash'])
+            source_values = ', '.join('?' * (len(SNAPSHOT_SOURCE_FIELDS) + len(SNAPSHOT_TOTAL_FIELDS) + 1))
+            for lng_lo, lng_hi in bbox_lng_ranges(min_lng, max_lng):
+                sql = SNAPSHOT_SOURCES_SQL
+                params = [min_lat, max_lat, lng_lo, lng_hi, min_lat, max_lat, lng_lo, lng_hi]
+                if since is not None:
+                    sql += CHANGED_SINCE_SQL
+                    params += ['water_source', since]
+                for rows in iter_batches(conn.execute(sql, params)):
+                    snapshot.executemany(f'INSERT INTO water_sources ({source_fields}) VALUES ({source_values})',
+                                         [tuple(row) for row in rows])
+                    totals['water_sources'] += len(rows)
+                    for row in rows:
+                        # Every vote, so merging can recount the totals
+                        votes = snapshot.executemany('INSERT INTO votes VALUES (?, ?, ?, ?)',
+                                                     conn.execute(SNAPSHOT_VOTES_SQL, (row['id'],)))
+                        totals['votes'] += votes.rowcount
+                        comments = query_comments_page(conn.cursor(), row['id'], SNAPSHOT_COMMENTS_PER_SOURCE)
+                        snapshot.executemany('''
+                            INSERT INTO comments (id, water_source_id, username, comment, is_admin, timestamp)
+                            VALUES (:id, :water_source_id, :username, :comment, :is_admin, :timestamp)
+                        ''', comments[:SNAPSHOT_COMMENTS_PER_SOURCE])
+                        totals['comments'] += len(comments[:SNAPSHOT_COMMENTS_PER_SOURCE])
+                        
+                        # Thumbnails only; the originals stay on the server
+                        thumbnail = row['photo_hash'] and photo_derivative(row['photo_hash'], 'thumb')
+                        if thumbnail:
+                            with open(os.path.join(app.config['PHOTO_DIR'], thumbnail), 'rb') as f:
+                                inserted = snapshot.execute(
+                                    'INSERT OR IGNORE INTO thumbnails (photo_hash, data) VALUES (?, ?)',
+                                    (row['photo_hash'], f.read())).rowcount
+                            totals['thumbnails'] += inserted
+                
+                sql = SNAPSHOT_ALERTS_SQL
+                params = [min_lat, max_lat, lng_lo, lng_hi]
+                if since is not None:
+                    sql += CHANGED_SINCE_SQL
+                    params += ['alert', since]
+                for rows in iter_batches(conn.execute(sql, params)):
+                    snapshot.executemany('INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                         [tuple(row) for row in rows])
+                    totals['alerts'] += len(rows)
+            
+            # Deletions carry no coordinates, so every one after since is included
+            deleted = conn.execute('''
+                SELECT entity_id FROM changes
+                WHERE entity = 'water_source' AND operation = 'delete' AND seq > ?
+            ''', (since or 0,))
+            for rows in iter_batches(deleted):
+                snapshot.executemany('INSERT INTO deleted_water_sources (id) VALUES (?)', [tuple(row) for row in rows])
+                totals['deleted'] += len(rows)
+        finally:
+            conn.rollback()
+        
+        snapshot.executemany('INSERT INTO snapshot_info (key, value) VALUES (?, ?)', [
+            ('format', str(SNAPSHOT_FORMAT)),
+            ('seq', str(seq)),
+            ('since', '' if since is None else str(since)),
+            ('bbox', ','.join(str(value) for value in bbox)),
+            ('created', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+        ])
+        snapshot.commit()
+        snapshot.execute('VACUUM')
+        snapshot.close()
+        
+        with open(snapshot_path, 'rb') as f, gzip.GzipFile(fileobj=output, mode='wb') as compressed:
+            shutil.copyfileobj(f, compressed)
+    totals['seq'] = seq
+    return totals
+
+def merge_region_snapshot(path):
+    """
+    Merge a snapshot file (gzipped or not) into the database. Water sources are
+    matched by id and the copy edited last wins; each user's vote on a source
+    likewise, after which the source's totals are recounted; comments are added
+    to sources present here, under a new id if theirs is taken by a different
+    comment; alerts are added when their id is new; sources deleted upstream
+    are deleted here.
+    Returns what changed, and the snapshot's seq to export from next time.
+    """
+    totals = {'added': 0, 'updated': 0, 'unchanged': 0, 'votes': 0, 'comments': 0, 'comments_renumbered': 0,
+              'comments_skipped': 0, 'alerts': 0, 'deleted': 0}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(path, 'rb') as f:
+            gzipped = f.read(2) == b'\x1f\x8b'
+        if gzipped:
+            snapshot_path = os.path.join(temp_dir, 'snapshot.sqlite')
+            with gzip.open(path, 'rb') as compressed, open(snapshot_path, 'wb') as f:
+                shutil.copyfileobj(compressed, f)
+        else:
+            snapshot_path = os.path.abspath(path)
+        
+        snapshot = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+        snapshot.row_factory = sqlite3.Row
+        try:
+            info = dict(snapshot.execute('SELECT key, value FROM snapshot_info').fetchall())
+        except sqlite3.DatabaseError:
+            raise ValueError(f'{path} is not a region snapshot')
+        if info.get('format') != str(SNAPSHOT_FORMAT):
+            raise ValueError(f"Unsupported snapshot format {info.get('format')}")
+        
+        os.makedirs(app.config['PHOTO_DIR'], exist_ok=True)
+        for rows in iter_batches(snapshot.execute('SELECT photo_hash, data FROM thumbnails')):
+            for photo_hash, data in rows:
+                thumbnail_path = os.path.join(app.config['PHOTO_DIR'], derivative_filename(photo_hash, 'thumb'))
+                if is_photo_hash(photo_hash) and not os.path.exists(thumbnail_path):
+                    write_photo_file(thumbnail_path, data)
+        
+        source_fields = ', '.join(SNAPSHOT_SOURCE_FIELDS)
+        source_values = ', '.join('?' * len(SNAPSHOT_SOURCE_FIELDS))
+        source_updates = ', '.join(f'{field} = excluded.{field}' for field in SNAPSHOT_SOURCE_FIELDS[1:])
+        def merge_sources(conn, rows):
+            for row in rows:
+                local = conn.execute('SELECT modified FROM water_sources WHERE id = ?', (row['id'],)).fetchone()
+                if local and (row['modified'] is None or local[0] >= row['modified']):
+                    totals['unchanged'] += 1
+                    continue
+                # Ids are never reused, so a tombstone means an older snapshot is being merged
+                if not local and conn.execute('''
+                    SELECT 1 FROM changes WHERE entity = 'water_source' AND entity_id = ? AND operation = 'delete'
+                ''', (row['id'],)).fetchone():
+                    totals['unchanged'] += 1
+                    continue
+                # The vote totals and version stay local
+                conn.execute(f'''
+                    INSERT INTO water_sources ({source_fields}) VALUES ({source_values})
+                    ON CONFLICT (id) DO UPDATE SET {source_updates}, version = version + 1
+                ''', [row[field] for field in SNAPSHOT_SOURCE_FIELDS])
+                conn.execute('''
+                    INSERT OR REPLACE INTO water_sources_rtree (id, min_lat, max_lat, min_lng, max_lng)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (row['id'], row['latitude'], row['latitude'], row['longitude'], row['longitude']))
+                if is_photo_hash(row['photo_hash']):
+                    conn.execute('INSERT OR REPLACE INTO photos (water_source_id, photo_hash) VALUES (?, ?)',
+                                 (row['id'], row['photo_hash']))
+                log_change(conn, 'water_source', row['id'])
+                totals['updated' if local else 'added'] += 1
+        
+        def merge_votes(conn, rows):
+            changed_ids = set()
+            for row in rows:
+                # A user's latest vote wins; record_vote stamps the vote with its time
+                changed = conn.execute('''
+                    INSERT INTO votes (water_source_id, username, vote_type, timestamp)
+                    SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM water_sources WHERE id = ?)
+                    ON CONFLICT (water_source_id, username) DO UPDATE
+                    SET vote_type = excluded.vote_type, timestamp = excluded.timestamp
+                    WHERE excluded.timestamp > votes.timestamp AND excluded.vote_type != votes.vote_type
+                ''', tuple(row) + (row['water_source_id'],)).rowcount
+                if changed:
+                    changed_ids.add(row['water_source_id'])
+            for source_id in changed_ids:
+                conn.execute(f'''
+                    UPDATE water_sources SET (upvotes, downvotes) = ({VOTE_TOTALS_SQL}), version = version + 1
+                    WHERE id = ?
+                ''', (source_id,))
+                log_change(conn, 'water_source', source_id)
+            totals['votes'] += len(changed_ids)
+        
+        def merge_comments(conn, rows):
+            changed_ids = set()
+            for row in rows:
+                source_id = row['water_source_id']
+                # Sources skipped above, such as ones deleted here, take no comments
+                if not conn.execute('SELECT 1 FROM water_sources WHERE id = ?', (source_id,)).fetchone():
+                    totals['comments_skipped'] += 1
+                    continue
+                fields = (source_id, row['username'], row['comment'], row['timestamp'])
+                local = conn.execute('''
+                    SELECT water_source_id, username, comment, timestamp FROM comments WHERE id = ?
+                ''', (row['id'],)).fetchone()
+                if local is None:
+                    conn.execute('''
+                        INSERT INTO comments (id, water_source_id, username, comment, is_admin, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', tuple(row))
+                elif tuple(local) == fields:
+                    continue
+                else:
+                    # A different comment has this id here: keep both, giving the
+                    # merged one a new id, unless an earlier merge already did
+                    if conn.execute('''
+                        SELECT 1 FROM comments
+                        WHERE water_source_id = ? AND username = ? AND comment = ? AND timestamp IS ?
+                    ''', fields).fetchone():
+                        continue
+                    conn.execute('''
+                        INSERT INTO comments (water_source_id, username, comment, is_admin, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (source_id, row['username'], row['comment'], row['is_admin'], row['timestamp']))
+                    totals['comments_renumbered'] += 1
+                totals['comments'] += 1
+                changed_ids.add(source_id)
+            for source_id in changed_ids:
+                bump_source_version(conn, source_id)
+        
+        def merge_alerts(conn, rows):
+            for row in rows:
+                inserted = conn.execute('''
+                    INSERT OR IGNORE INTO alerts (id, title, message, latitude, longitude, alert_type, added_by, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', tuple(row)).rowcount
+                if inserted:
+                    log_change(conn, 'alert', row['id'])
+                    totals['alerts'] += 1
+        
+        removed_photos = []
+        def merge_deletions(conn, rows):
+            for row in rows:
+                found, photo_hash = delete_water_source_rows(conn, row['id'])
+                if found:
+                    totals['deleted'] += 1
+                if photo_hash:
+                    removed_photos.append(photo_hash)
+        
+        # Each batch is one writer operation, so merging never holds the write lock for long
+        merges = [
+            ('SELECT * FROM water_sources', merge_sources),
+            ('SELECT water_source_id, username, vote_type, timestamp FROM votes', merge_votes),
+            ('SELECT id, water_source_id, username, comment, is_admin, timestamp FROM comments', merge_comments),
+            ('SELECT id, title, message, latitude, longitude, alert_type, added_by, timestamp FROM alerts', merge_alerts),
+            ('SELECT id FROM deleted_water_sources', merge_deletions)
+        ]
+        for sql, merge in merges:
+            for rows in iter_batches(snapshot.execute(sql)):
+                db_writer.submit(lambda conn: merge(conn, rows))
+        snapshot.close()
+    
+    if removed_photos:
+        conn = connect_db()
+        for photo_hash in removed_photos:
+            remove_unreferenced_photo(conn.cursor(), photo_hash)
+        conn.close()
+    totals['seq'] = int(info['seq'])
+    return totals
+
+# Static assets: the page's CSS and JavaScript, vendored Leaflet and a Tailwind
+# build purged down to the classes the page uses (see assets/tailwind.config.js).
+# Files are read and compressed once. The page links them with ?v=<fingerprint>,
+# which changes with their content, so browsers may cache those URLs for good.
+STATIC_CACHE_SECONDS = 365 * 24 * 60 * 60
+FINGERPRINT_LENGTH = 12
+SHELL_ASSETS = [
+    'css/tailwind.css',
+    'css/app.css',
+    'vendor/leaflet/leaflet.css',
+    'vendor/leaflet/leaflet.js',
+    'js/app.js'
+]
+
+static_assets = {}
+static_assets_lock = threading.Lock()
+
+def get_static_asset(filename):
+    """StaticPayload of a file under the static directory, or None if there is no such file"""
+    with static_assets_lock:
+        if filename in static_assets:
+            return static_assets[filename]
+    path = safe_join(app.config['STATIC_DIR'], filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        body = f.read()
+    asset = StaticPayload(body, mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    with static_assets_lock:
+        return static_assets.setdefault(filename, asset)
+
+def asset_url(filename):
+    return f'/static/{filename}?v={get_static_asset(filename).etag[:FINGERPRINT_LENGTH]}'
+
 # HTML Template with Tailwind CSS and Interactive Map
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -168,63 +2317,12 @@ HTML_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Where's the Well? - Water Source Locator</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-    <style>
-        .water-marker-clean { background-color: #10b981; }
-        .water-marker-muddy { background-color: #f59e0b; }
-        .water-marker-contaminated { background-color: #ef4444; }
-        .user-location { background-color: #3b82f6; }
-        
-        .wave-background {
-            background: linear-gradient(-45deg, #1e3a8a, #3b82f6, #60a5fa, #93c5fd);
-            background-size: 400% 400%;
-            animation: gradientWave 12s ease infinite;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        .wave-background::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: 
-                radial-gradient(circle at 20% 80%, rgba(255,255,255,0.1) 0%, transparent 50%),
-                radial-gradient(circle at 80% 20%, rgba(255,255,255,0.1) 0%, transparent 50%),
-                radial-gradient(circle at 40% 40%, rgba(255,255,255,0.05) 0%, transparent 50%);
-            animation: waveFloat 8s ease-in-out infinite;
-        }
-        
-        @keyframes gradientWave {
-            0% {
-                background-position: 0% 50%;
-            }
-            50% {
-                background-position: 100% 50%;
-            }
-            100% {
-                background-position: 0% 50%;
-            }
-        }
-        
-        @keyframes waveFloat {
-            0%, 100% {
-                transform: translate(0, 0) scale(1);
-            }
-            33% {
-                transform: translate(20px, -20px) scale(1.1);
-            }
-            66% {
-                transform: translate(-20px, 20px) scale(0.9);
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/tailwind.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('vendor/leaflet/leaflet.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/app.css') }}">
+    <script src="{{ asset_url('vendor/leaflet/leaflet.js') }}"></script>
 </head>
-<body class="bg-gray-100 min-h-screen">
+<body class="bg-gray-100 min-h-screen" data-tile-url="{{ tile_url }}">
     <!-- Login Page -->
     <div id="loginPage" class="fixed inset-0 wave-background flex items-center justify-center z-50">
         <div class="w-full h-full flex items-center justify-center p-4">
@@ -453,1195 +2551,56 @@ HTML_TEMPLATE = '''
         </div>
     </div>
 
-    <script>
-        // Global variables
-        let map;
-        let userLocationMarker;
-        let waterSourceMarkers = [];
-        let alertMarkers = [];
-        let selectedLatLng = null;
-        let currentPhotoData = null;
-        let currentUsername = null;
-        let userLocation = null;
-        let isAdmin = false;
-        let alertMode = false;
-
-        // Initialize app when page loads
-        document.addEventListener('DOMContentLoaded', function() {
-            checkLogin();
-        });
-
-        // Check if user is logged in
-        function checkLogin() {
-            currentUsername = localStorage.getItem('wheres_the_well_username');
-            if (currentUsername) {
-                isAdmin = currentUsername.toLowerCase() === 'admin';
-                document.getElementById('currentUsername').textContent = currentUsername + (isAdmin ? ' (Admin)' : '');
-                document.getElementById('loginPage').style.display = 'none';
-                document.getElementById('mainContent').style.display = 'block';
-                
-                // Show alerts section for all users
-                document.getElementById('alertsSection').style.display = 'block';
-                
-                // Show admin-specific sections if admin
-                if (isAdmin) {
-                    document.getElementById('adminAlertForm').style.display = 'block';
-                    document.getElementById('adminBadge').style.display = 'inline-block';
-                }
-                
-                initMap();
-            } else {
-                document.getElementById('loginPage').style.display = 'block';
-                document.getElementById('mainContent').style.display = 'none';
-            }
-        }
-
-        // Handle login
-        document.getElementById('loginForm').addEventListener('submit', function(e) {
-            e.preventDefault();
-            const username = document.getElementById('usernameInput').value.trim();
-            const password = document.getElementById('passwordInput').value; // Password is ignored but required for form
-            
-            if (username && password) {
-                currentUsername = username;
-                isAdmin = username.toLowerCase() === 'admin';
-                localStorage.setItem('wheres_the_well_username', username);
-                document.getElementById('currentUsername').textContent = username + (isAdmin ? ' (Admin)' : '');
-                document.getElementById('loginPage').style.display = 'none';
-                document.getElementById('mainContent').style.display = 'block';
-                
-                // Show alerts section for all users
-                document.getElementById('alertsSection').style.display = 'block';
-                
-                // Show admin-specific sections if admin
-                if (isAdmin) {
-                    document.getElementById('adminAlertForm').style.display = 'block';
-                    document.getElementById('adminBadge').style.display = 'inline-block';
-                }
-                
-                initMap();
-            } else {
-                alert('Please enter both username and password');
-            }
-        });
-
-        // Logout function
-        function logout() {
-            // Clear user data
-            localStorage.removeItem('wheres_the_well_username');
-            currentUsername = null;
-            userLocation = null;
-            isAdmin = false;
-            alertMode = false;
-            
-            // Clean up map and markers
-            if (map) {
-                // Remove all markers
-                if (userLocationMarker) {
-                    map.removeLayer(userLocationMarker);
-                    userLocationMarker = null;
-                }
-                
-                if (window.tempMarker) {
-                    map.removeLayer(window.tempMarker);
-                    window.tempMarker = null;
-                }
-                
-                waterSourceMarkers.forEach(marker => map.removeLayer(marker));
-                waterSourceMarkers = [];
-                
-                alertMarkers.forEach(marker => map.removeLayer(marker));
-                alertMarkers = [];
-                
-                // Remove the map completely
-                map.remove();
-                map = null;
-            }
-            
-            // Reset global variables
-            selectedLatLng = null;
-            currentPhotoData = null;
-            
-            // Hide main content and admin sections
-            document.getElementById('mainContent').style.display = 'none';
-            document.getElementById('alertsSection').style.display = 'none';
-            document.getElementById('adminAlertForm').style.display = 'none';
-            document.getElementById('adminBadge').style.display = 'none';
-            document.getElementById('detailsPanel').classList.add('hidden');
-            
-            // Reset containers
-            document.getElementById('nearbySourcesContainer').innerHTML = `
-                <div class="text-center py-8 text-gray-500">
-                    <svg class="w-12 h-12 mx-auto mb-3 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                        <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M17.657 16.657L13.414 20.9a1.998 1.998 0 01-2.827 0l-4.244-4.243a8 8 0 1111.314 0z"></path>
-                        <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 11a3 3 0 11-6 0 3 3 0 016 0z"></path>
-                    </svg>
-                    <p>Click "Find Me" to see nearby water sources</p>
-                </div>
-            `;
-            
-            document.getElementById('alertsContainer').innerHTML = `
-                <div class="text-center py-4 text-gray-500">
-                    <p class="text-sm">Click "Find Me" to see nearby alerts</p>
-                </div>
-            `;
-            
-            // Reset forms
-            document.getElementById('waterSourceForm').reset();
-            document.getElementById('photoPreview').classList.add('hidden');
-            document.getElementById('latitude').value = '';
-            document.getElementById('longitude').value = '';
-            
-            // Reset alert form if admin
-            if (document.getElementById('alertForm')) {
-                document.getElementById('alertForm').reset();
-                document.getElementById('alertLatitude').value = '';
-                document.getElementById('alertLongitude').value = '';
-            }
-            
-            // Show login page
-            document.getElementById('loginPage').style.display = 'block';
-            document.getElementById('usernameInput').value = '';
-            document.getElementById('passwordInput').value = '';
-        }
+    <script src="{{ asset_url('js/app.js') }}"></script>
+</body>
+</html>
+'''
 
-        // Initialize map
-        function initMap() {
-            // Default location (can be changed)
-            const defaultLat = 40.7128;
-            const defaultLng = -74.0060;
-            
-            map = L.map('map').setView([defaultLat, defaultLng], 13);
-            
-            // Add OpenStreetMap tiles
-            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-                attribution: '© OpenStreetMap contributors'
-            }).addTo(map);
-
-            // Add click event for placing water sources or alerts
-            map.on('click', function(e) {
-                if (isAdmin && alertMode) {
-                    // Admin placing an alert
-                    document.getElementById('alertLatitude').value = e.latlng.lat.toFixed(6);
-                    document.getElementById('alertLongitude').value = e.latlng.lng.toFixed(6);
-                    
-                    // Show temporary alert marker
-                    if (window.tempAlertMarker) {
-                        map.removeLayer(window.tempAlertMarker);
-                    }
-                    window.tempAlertMarker = L.marker([e.latlng.lat, e.latlng.lng], {
-                        icon: L.divIcon({
-                            className: 'alert-marker',
-                            html: '<div style="background-color: #ef4444; color: white; width: 30px; height: 30px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 16px;">🚨</div>',
-                            iconSize: [30, 30],
-                            iconAnchor: [15, 15]
-                        })
-                    }).addTo(map).bindPopup("🚨 New alert location").openPopup();
-                } else {
-                    // Regular water source placement
-                    selectedLatLng = e.latlng;
-                    document.getElementById('latitude').value = e.latlng.lat.toFixed(6);
-                    document.getElementById('longitude').value = e.latlng.lng.toFixed(6);
-                    
-                    // Show temporary marker
-                    if (window.tempMarker) {
-                        map.removeLayer(window.tempMarker);
-                    }
-                    window.tempMarker = L.marker([e.latlng.lat, e.latlng.lng])
-                        .addTo(map)
-                        .bindPopup("📍 New water source location")
-                        .openPopup();
-                }
-            });
-
-            // Try to get user's current location
-            getCurrentLocation();
-            
-            // Load existing water sources
-            loadWaterSources();
-        }
+index_page = None
+service_worker = None
+
+def get_index_page():
+    """The page is the same for every request, so it is rendered and compressed once"""
+    global index_page
+    if index_page is None:
+        index_page = StaticPayload(render_template_string(HTML_TEMPLATE, asset_url=asset_url,
+                                                          tile_url=app.config['TILE_URL']), 'text/html')
+    return index_page
+
+def get_service_worker():
+    """
+    The service worker, named after the page's ETag: the page links every asset
+    by fingerprint, so any change to them installs a new worker and app shell
+    """
+    global service_worker
+    if service_worker is None:
+        shell = ['/'] + [asset_url(filename) for filename in SHELL_ASSETS]
+        service_worker = StaticPayload(render_template('sw.js', version=get_index_page().etag[:FINGERPRINT_LENGTH],
+                                                       shell_urls=shell), 'text/javascript')
+    return service_worker
 
-        // Get current location
-        function getCurrentLocation() {
-            if (navigator.geolocation) {
-                navigator.geolocation.getCurrentPosition(
-                    function(position) {
-                        const lat = position.coords.latitude;
-                        const lng = position.coords.longitude;
-                        
-                        // Store user location
-                        userLocation = { latitude: lat, longitude: lng };
-                        
-                        // Update map view
-                        map.setView([lat, lng], 15);
-                        
-                        // Add/update user location marker
-                        if (userLocationMarker) {
-                            map.removeLayer(userLocationMarker);
-                        }
-                        
-                        userLocationMarker = L.marker([lat, lng], {
-                            icon: L.divIcon({
-                                className: 'user-location',
-                                html: '<div style="background-color: #3b82f6; width: 15px; height: 15px; border-radius: 50%; border: 3px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2);"></div>',
-                                iconSize: [21, 21],
-                                iconAnchor: [10, 10]
-                            })
-                        }).addTo(map).bindPopup("📍 Your current location");
-                        
-                        // Update nearby sources list
-                        updateNearbyWaterSources();
-                        
-                        // Update alerts for all users
-                        updateAlertsNearMe();
-                    },
-                    function(error) {
-                        console.log("Geolocation error:", error);
-                        // Use default location if geolocation fails
-                        userLocation = null;
-                    }
-                );
-            }
-        }
-
-        // Handle photo upload and analysis
-        function handlePhotoUpload(event) {
-            const file = event.target.files[0];
-            if (file) {
-                const reader = new FileReader();
-                reader.onload = function(e) {
-                    currentPhotoData = e.target.result;
-                    
-                    // Show preview
-                    const preview = document.getElementById('photoPreview');
-                    const previewImage = document.getElementById('previewImage');
-                    previewImage.src = currentPhotoData;
-                    preview.classList.remove('hidden');
-                    
-                    // Analyze water quality
-                    analyzeWaterQuality(currentPhotoData);
-                };
-                reader.readAsDataURL(file);
-            }
-        }
-
-        // Analyze water quality
-        function analyzeWaterQuality(photoData) {
-            fetch('/analyze_water', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ photo_data: photoData })
-            })
-            .then(response => response.json())
-            .then(data => {
-                const resultDiv = document.getElementById('analysisResult');
-                const cleanlinessLevel = data.cleanliness_level;
-                const confidence = (data.confidence_score * 100).toFixed(1);
-                
-                let bgColor, textColor, emoji;
-                switch(cleanlinessLevel) {
-                    case 'clean':
-                        bgColor = 'bg-green-100';
-                        textColor = 'text-green-800';
-                        emoji = '✅';
-                        break;
-                    case 'muddy':
-                        bgColor = 'bg-yellow-100';
-                        textColor = 'text-yellow-800';
-                        emoji = '⚠️';
-                        break;
-                    case 'contaminated':
-                        bgColor = 'bg-red-100';
-                        textColor = 'text-red-800';
-                        emoji = '❌';
-                        break;
-                    default:
-                        bgColor = 'bg-gray-100';
-                        textColor = 'text-gray-800';
-                        emoji = '❓';
-                }
-                
-                resultDiv.className = `mt-2 p-2 rounded text-sm ${bgColor} ${textColor}`;
-                resultDiv.innerHTML = `${emoji} <strong>${cleanlinessLevel.charAt(0).toUpperCase() + cleanlinessLevel.slice(1)}</strong> (${confidence}% confidence)`;
-            })
-            .catch(error => {
-                console.error('Error analyzing water:', error);
-                const resultDiv = document.getElementById('analysisResult');
-                resultDiv.className = 'mt-2 p-2 rounded text-sm bg-red-100 text-red-800';
-                resultDiv.innerHTML = '❌ Analysis failed';
-            });
-        }
-
-        // Submit water source form
-        document.getElementById('waterSourceForm').addEventListener('submit', function(e) {
-            e.preventDefault();
-            
-            if (!selectedLatLng) {
-                alert('Please click on the map to select a location first!');
-                return;
-            }
-            
-            const formData = {
-                name: document.getElementById('sourceName').value,
-                latitude: selectedLatLng.lat,
-                longitude: selectedLatLng.lng,
-                water_type: document.getElementById('waterType').value,
-                notes: document.getElementById('notes').value,
-                photo_data: currentPhotoData,
-                added_by: currentUsername
-            };
-            
-            fetch('/add_water_source', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(formData)
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Reset form
-                    document.getElementById('waterSourceForm').reset();
-                    document.getElementById('photoPreview').classList.add('hidden');
-                    document.getElementById('latitude').value = '';
-                    document.getElementById('longitude').value = '';
-                    
-                    // Remove temporary marker
-                    if (window.tempMarker) {
-                        map.removeLayer(window.tempMarker);
-                    }
-                    
-                    // Reload water sources
-                    loadWaterSources();
-                    
-                    selectedLatLng = null;
-                    currentPhotoData = null;
-                    
-                    alert('Water source added successfully!');
-                } else {
-                    alert('Error adding water source: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Error adding water source');
-            });
-        });
-
-        // Load water sources from database
-        function loadWaterSources() {
-            fetch('/get_water_sources')
-            .then(response => response.json())
-            .then(data => {
-                // Clear existing markers
-                waterSourceMarkers.forEach(marker => map.removeLayer(marker));
-                waterSourceMarkers = [];
-                
-                // Add markers for each water source
-                data.forEach(source => {
-                    const marker = createWaterSourceMarker(source);
-                    waterSourceMarkers.push(marker);
-                    marker.addTo(map);
-                });
-                
-                // Update nearby sources list
-                updateNearbyWaterSources(data);
-            })
-            .catch(error => {
-                console.error('Error loading water sources:', error);
-            });
-            
-            // Load alerts for all users
-            loadAlerts();
-        }
-
-        // Create marker for water source
-        function createWaterSourceMarker(source) {
-            const displayQuality = source.admin_override || source.cleanliness_level;
-            let color, emoji;
-            switch(displayQuality) {
-                case 'clean':
-                    color = '#10b981';
-                    emoji = '💧';
-                    break;
-                case 'muddy':
-                    color = '#f59e0b';
-                    emoji = '🟡';
-                    break;
-                case 'contaminated':
-                    color = '#ef4444';
-                    emoji = '🔴';
-                    break;
-                default:
-                    color = '#6b7280';
-                    emoji = '❓';
-            }
-            
-            const marker = L.marker([source.latitude, source.longitude], {
-                icon: L.divIcon({
-                    className: 'water-marker',
-                    html: `<div style="background-color: ${color}; color: white; width: 30px; height: 30px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 16px;">${emoji}</div>`,
-                    iconSize: [30, 30],
-                    iconAnchor: [15, 15]
-                })
-            });
-            
-            const confidence = source.confidence_score ? (source.confidence_score * 100).toFixed(1) : 'N/A';
-            const qualityDisplay = source.admin_override ? 
-                `${displayQuality} (Admin Override)` : 
-                `${displayQuality} (${confidence}% confidence)`;
-            
-            // Simple popup with basic info
-            marker.bindPopup(`
-                <div class="p-2">
-                    <h4 class="font-bold text-lg">${source.name}</h4>
-                    <p><strong>Type:</strong> ${source.water_type}</p>
-                    <p><strong>Quality:</strong> ${qualityDisplay}</p>
-                    <p><strong>Added by:</strong> ${source.added_by}</p>
-                    <button onclick="showWaterSourceDetails(${source.id})" class="mt-2 w-full bg-blue-500 text-white py-1 px-3 rounded text-sm hover:bg-blue-600 transition">
-                        📋 View Full Details
-                    </button>
-                </div>
-            `);
-            
-            return marker;
-        }
-
-        // Show detailed water source information in the details panel
-        function showWaterSourceDetails(sourceId) {
-            const detailsPanel = document.getElementById('detailsPanel');
-            const detailsContent = document.getElementById('detailsContent');
-            
-            // Show loading state
-            detailsPanel.classList.remove('hidden');
-            detailsContent.innerHTML = '<div class="text-center py-8"><div class="inline-block animate-spin rounded-full h-8 w-8 border-b-2 border-blue-600"></div><p class="mt-2 text-gray-600">Loading details...</p></div>';
-            
-            // Scroll to details panel
-            detailsPanel.scrollIntoView({ behavior: 'smooth' });
-            
-            Promise.all([
-                fetch(`/get_water_source_details/${sourceId}`).then(r => r.json()),
-                fetch(`/get_votes/${sourceId}`).then(r => r.json()),
-                fetch(`/get_comments/${sourceId}`).then(r => r.json())
-            ])
-            .then(([source, votes, comments]) => {
-                const confidence = source.confidence_score ? (source.confidence_score * 100).toFixed(1) : 'N/A';
-                const upvotes = votes.filter(v => v.vote_type === 'upvote').length;
-                const downvotes = votes.filter(v => v.vote_type === 'downvote').length;
-                const userVote = votes.find(v => v.username === currentUsername);
-                const displayQuality = source.admin_override || source.cleanliness_level;
-                
-                detailsContent.innerHTML = `
-                    <div class="space-y-6">
-                        <!-- Basic Information -->
-                        <div>
-                            <h4 class="text-2xl font-bold text-gray-800 mb-4">${source.name}</h4>
-                            <div class="grid grid-cols-1 md:grid-cols-2 gap-4">
-                                <div class="space-y-3">
-                                    <div>
-                                        <span class="font-medium text-gray-700">Type:</span>
-                                        <span class="ml-2 px-2 py-1 bg-gray-100 rounded text-sm">${source.water_type}</span>
-                                    </div>
-                                    <div>
-                                        <span class="font-medium text-gray-700">Quality:</span>
-                                        <span class="ml-2 px-2 py-1 ${getQualityBadgeClass(displayQuality)} rounded text-sm">
-                                            ${displayQuality} 
-                                            ${source.admin_override ? '<span class="text-xs">(Admin Override)</span>' : `(${confidence}% confidence)`}
-                                        </span>
-                                    </div>
-                                    <div>
-                                        <span class="font-medium text-gray-700">Added by:</span>
-                                        <span class="ml-2">${source.added_by}</span>
-                                    </div>
-                                    <div>
-                                        <span class="font-medium text-gray-700">Date added:</span>
-                                        <span class="ml-2">${new Date(source.timestamp).toLocaleDateString()}</span>
-                                    </div>
-                                </div>
-                                <div class="space-y-3">
-                                    <div>
-                                        <span class="font-medium text-gray-700">Coordinates:</span>
-                                        <div class="ml-2 text-sm font-mono bg-gray-100 px-2 py-1 rounded">
-                                            ${source.latitude.toFixed(6)}, ${source.longitude.toFixed(6)}
-                                        </div>
-                                    </div>
-                                    ${source.notes ? `
-                                        <div>
-                                            <span class="font-medium text-gray-700">Notes:</span>
-                                            <div class="ml-2 mt-1 p-3 bg-gray-50 rounded text-sm">${source.notes}</div>
-                                        </div>
-                                    ` : ''}
-                                </div>
-                            </div>
-                        </div>
-
-                        ${isAdmin ? `
-                        <!-- Admin Controls -->
-                        <div class="border-t border-gray-200 pt-6">
-                            <div class="bg-blue-50 p-4 rounded-lg">
-                                <h5 class="text-lg font-semibold text-blue-800 mb-3 flex items-center">
-                                    🛡️ Admin Controls
-                                    <span class="ml-2 px-2 py-1 bg-blue-200 text-blue-800 text-xs rounded-full">ADMIN</span>
-                                </h5>
-                                <div class="flex space-x-2 mb-3">
-                                    <button onclick="adminOverride(${sourceId}, 'clean')" class="px-3 py-2 bg-green-500 text-white rounded text-sm hover:bg-green-600 transition">
-                                        Mark as Clean
-                                    </button>
-                                    <button onclick="adminOverride(${sourceId}, 'muddy')" class="px-3 py-2 bg-yellow-500 text-white rounded text-sm hover:bg-yellow-600 transition">
-                                        Mark as Muddy
-                                    </button>
-                                    <button onclick="adminOverride(${sourceId}, 'contaminated')" class="px-3 py-2 bg-red-500 text-white rounded text-sm hover:bg-red-600 transition">
-                                        Mark as Contaminated
-                                    </button>
-                                </div>
-                                <p class="text-xs text-blue-700">Admin overrides will take precedence over automatic analysis</p>
-                            </div>
-                        </div>
-                        ` : ''}
-
-                        <!-- Community Feedback Section -->
-                        <div class="border-t border-gray-200 pt-6">
-                            <div class="flex items-center justify-between mb-4">
-                                <h5 class="text-lg font-semibold text-gray-800">Community Feedback</h5>
-                                <div class="flex items-center space-x-4">
-                                    <span class="flex items-center text-green-600">
-                                        <svg class="w-5 h-5 mr-1" fill="currentColor" viewBox="0 0 20 20">
-                                            <path d="M2 10.5a1.5 1.5 0 113 0v6a1.5 1.5 0 01-3 0v-6zM6 10.333v5.43a2 2 0 001.106 1.79l.05.025A4 4 0 008.943 18h5.416a2 2 0 001.962-1.608l1.2-6A2 2 0 0015.56 8H12V4a2 2 0 00-2-2 1 1 0 00-1 1v.667a4 4 0 01-.8 2.4L6.8 7.933a4 4 0 00-.8 2.4z"></path>
-                                        </svg>
-                                        ${upvotes}
-                                    </span>
-                                    <span class="flex items-center text-red-600">
-                                        <svg class="w-5 h-5 mr-1" fill="currentColor" viewBox="0 0 20 20">
-                                            <path d="M18 9.5a1.5 1.5 0 11-3 0v-6a1.5 1.5 0 013 0v6zM14 9.667v-5.43a2 2 0 00-1.106-1.79l-.05-.025A4 4 0 0011.057 2H5.641a2 2 0 00-1.962 1.608l-1.2 6A2 2 0 004.44 12H8v4a2 2 0 002 2 1 1 0 001-1v-.667a4 4 0 01.8-2.4l1.4-1.866a4 4 0 00.8-2.4z"></path>
-                                        </svg>
-                                        ${downvotes}
-                                    </span>
-                                </div>
-                            </div>
-                            
-                            <div class="flex space-x-3 mb-6">
-                                <button onclick="vote(${sourceId}, 'upvote')" class="flex-1 py-3 px-4 rounded-lg font-medium transition ${userVote?.vote_type === 'upvote' ? 'bg-green-500 text-white' : 'bg-gray-100 text-gray-700 hover:bg-green-100'}">
-                                    👍 Accurate Information
-                                </button>
-                                <button onclick="vote(${sourceId}, 'downvote')" class="flex-1 py-3 px-4 rounded-lg font-medium transition ${userVote?.vote_type === 'downvote' ? 'bg-red-500 text-white' : 'bg-gray-100 text-gray-700 hover:bg-red-100'}">
-                                    👎 Inaccurate Information
-                                </button>
-                            </div>
-                        </div>
-
-                        <!-- Comments Section -->
-                        <div class="border-t border-gray-200 pt-6">
-                            <h5 class="text-lg font-semibold text-gray-800 mb-4">Comments & Additional Info</h5>
-                            
-                            <!-- Add Comment -->
-                            <div class="mb-6">
-                                <textarea id="commentText_${sourceId}" placeholder="Share additional information about this water source..." class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-blue-500 resize-none" rows="3"></textarea>
-                                <button onclick="addComment(${sourceId})" class="mt-3 px-6 py-2 bg-blue-500 text-white rounded-lg hover:bg-blue-600 transition font-medium">
-                                    💬 Add Comment
-                                </button>
-                            </div>
-                            
-                            <!-- Comments List -->
-                            <div class="space-y-4">
-                                ${comments.length === 0 ? '<p class="text-gray-500 text-center py-4">No comments yet. Be the first to share additional information!</p>' : ''}
-                                ${comments.map(comment => `
-                                    <div class="${comment.is_admin ? 'bg-blue-50 border-l-4 border-blue-500' : 'bg-gray-50'} p-4 rounded-lg">
-                                        <div class="flex items-center justify-between mb-2">
-                                            <div class="flex items-center">
-                                                <span class="font-medium text-gray-800">${comment.username}</span>
-                                                ${comment.is_admin ? '<span class="ml-2 px-2 py-1 bg-blue-200 text-blue-800 text-xs rounded-full">ADMIN</span>' : ''}
-                                                ${comment.is_admin ? '<span class="ml-2 text-blue-600">📌</span>' : ''}
-                                            </div>
-                                            <div class="flex items-center space-x-2">
-                                                <span class="text-gray-400 text-sm">${new Date(comment.timestamp).toLocaleDateString()}</span>
-                                                ${isAdmin ? `<button onclick="deleteComment(${comment.id}, ${sourceId})" class="text-red-500 hover:text-red-700 text-xs">🗑️</button>` : ''}
-                                            </div>
-                                        </div>
-                                        <p class="text-gray-700 ${comment.is_admin ? 'font-medium' : ''}">${comment.comment}</p>
-                                    </div>
-                                `).join('')}
-                            </div>
-                        </div>
-
-                        <!-- Close Button -->
-                        <div class="border-t border-gray-200 pt-6">
-                            <div class="flex space-x-3">
-                                <button onclick="hideWaterSourceDetails()" class="flex-1 py-3 px-4 bg-gray-100 text-gray-700 rounded-lg hover:bg-gray-200 transition font-medium">
-                                    ✕ Close Details
-                                </button>
-                                ${isAdmin ? `<button onclick="deleteWaterSource(${sourceId})" class="py-3 px-4 bg-red-500 text-white rounded-lg hover:bg-red-600 transition font-medium">🗑️ Delete Source</button>` : ''}
-                            </div>
-                        </div>
-                    </div>
-                `;
-            })
-            .catch(error => {
-                console.error('Error loading water source details:', error);
-                detailsContent.innerHTML = '<div class="text-center py-8 text-red-600">Error loading details. Please try again.</div>';
-            });
-        }
-
-        // Hide the details panel
-        function hideWaterSourceDetails() {
-            document.getElementById('detailsPanel').classList.add('hidden');
-        }
-
-        // Get CSS class for quality badge
-        function getQualityBadgeClass(quality) {
-            switch(quality) {
-                case 'clean':
-                    return 'bg-green-100 text-green-800';
-                case 'muddy':
-                    return 'bg-yellow-100 text-yellow-800';
-                case 'contaminated':
-                    return 'bg-red-100 text-red-800';
-                default:
-                    return 'bg-gray-100 text-gray-800';
-            }
-        }
-
-        // Vote on water source
-        function vote(sourceId, voteType) {
-            fetch('/vote', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    water_source_id: sourceId,
-                    username: currentUsername,
-                    vote_type: voteType
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Refresh the details panel to show updated votes
-                    showWaterSourceDetails(sourceId);
-                } else {
-                    alert('Error voting: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error voting:', error);
-                alert('Error submitting vote');
-            });
-        }
-
-        // Add comment to water source
-        function addComment(sourceId) {
-            const commentText = document.getElementById(`commentText_${sourceId}`).value.trim();
-            if (!commentText) {
-                alert('Please enter a comment');
-                return;
-            }
-            
-            fetch('/add_comment', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    water_source_id: sourceId,
-                    username: currentUsername,
-                    comment: commentText,
-                    is_admin: isAdmin
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Refresh the details panel to show new comment
-                    showWaterSourceDetails(sourceId);
-                } else {
-                    alert('Error adding comment: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error adding comment:', error);
-                alert('Error submitting comment');
-            });
-        }
-
-        // Admin override water source quality
-        function adminOverride(sourceId, quality) {
-            if (!isAdmin) {
-                alert('Admin access required');
-                return;
-            }
-            
-            fetch('/admin_override', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    water_source_id: sourceId,
-                    quality: quality,
-                    admin_username: currentUsername
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Refresh the details panel and reload markers
-                    showWaterSourceDetails(sourceId);
-                    loadWaterSources();
-                } else {
-                    alert('Error updating water source: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error updating water source:', error);
-                alert('Error updating water source');
-            });
-        }
-
-        // Load alerts for all users
-        function loadAlerts() {
-            fetch('/get_alerts')
-            .then(response => response.json())
-            .then(data => {
-                // Clear existing alert markers
-                alertMarkers.forEach(marker => map.removeLayer(marker));
-                alertMarkers = [];
-                
-                // Add markers for each alert
-                data.forEach(alert => {
-                    const marker = createAlertMarker(alert);
-                    alertMarkers.push(marker);
-                    marker.addTo(map);
-                });
-                
-                // Update alerts list
-                updateAlertsNearMe(data);
-            })
-            .catch(error => {
-                console.error('Error loading alerts:', error);
-            });
-        }
-
-        // Create alert marker
-        function createAlertMarker(alert) {
-            const marker = L.marker([alert.latitude, alert.longitude], {
-                icon: L.divIcon({
-                    className: 'alert-marker',
-                    html: '<div style="background-color: #ef4444; color: white; width: 30px; height: 30px; border-radius: 50%; display: flex; align-items: center; justify-content: center; border: 2px solid white; box-shadow: 0 2px 4px rgba(0,0,0,0.2); font-size: 16px;">🚨</div>',
-                    iconSize: [30, 30],
-                    iconAnchor: [15, 15]
-                })
-            });
-            
-            marker.bindPopup(`
-                <div class="p-2">
-                    <h4 class="font-bold text-lg text-red-600">⚠️ ${alert.title}</h4>
-                    <p class="text-sm mt-2">${alert.message}</p>
-                    <p class="text-xs text-gray-500 mt-2">Posted by ${alert.added_by}</p>
-                    <p class="text-xs text-gray-500">${new Date(alert.timestamp).toLocaleDateString()}</p>
-                </div>
-            `);
-            
-            return marker;
-        }
-
-        // Update alerts near me list
-        function updateAlertsNearMe(alerts = null) {
-            const container = document.getElementById('alertsContainer');
-            
-            if (!userLocation) {
-                container.innerHTML = `
-                    <div class="text-center py-4 text-gray-500">
-                        <p class="text-sm">Click "Find Me" to see nearby alerts</p>
-                    </div>
-                `;
-                return;
-            }
-            
-            if (!alerts) {
-                fetch('/get_alerts')
-                .then(response => response.json())
-                .then(data => updateAlertsNearMe(data))
-                .catch(error => console.error('Error fetching alerts:', error));
-                return;
-            }
-            
-            // Calculate distances and sort by proximity
-            const alertsWithDistance = alerts.map(alert => ({
-                ...alert,
-                distance: calculateDistance(
-                    userLocation.latitude, 
-                    userLocation.longitude,
-                    alert.latitude, 
-                    alert.longitude
-                )
-            })).sort((a, b) => a.distance - b.distance);
-            
-            if (alertsWithDistance.length === 0) {
-                container.innerHTML = `
-                    <div class="text-center py-4 text-gray-500">
-                        <p class="text-sm">No alerts in your area</p>
-                    </div>
-                `;
-                return;
-            }
-            
-            // Display nearest alerts
-            const nearestAlerts = alertsWithDistance.slice(0, 5);
-            
-            container.innerHTML = nearestAlerts.map(alert => `
-                <div class="p-3 border border-red-200 bg-red-50 rounded-lg">
-                    <div class="flex items-start justify-between">
-                        <div class="flex-1">
-                            <h4 class="font-medium text-red-800 mb-1">🚨 ${alert.title}</h4>
-                            <p class="text-sm text-red-700 mb-2">${alert.message}</p>
-                            <div class="text-xs text-red-600">
-                                ${formatDistance(alert.distance)} away • ${new Date(alert.timestamp).toLocaleDateString()}
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            `).join('');
-        }
-
-        // Handle alert form submission
-        document.getElementById('alertForm').addEventListener('submit', function(e) {
-            e.preventDefault();
-            
-            if (!isAdmin) {
-                alert('Admin access required');
-                return;
-            }
-            
-            const title = document.getElementById('alertTitle').value.trim();
-            const message = document.getElementById('alertMessage').value.trim();
-            const latitude = document.getElementById('alertLatitude').value;
-            const longitude = document.getElementById('alertLongitude').value;
-            
-            if (!title || !message) {
-                alert('Please fill in all fields');
-                return;
-            }
-            
-            if (!latitude || !longitude) {
-                alert('Please click on the map to set alert location');
-                return;
-            }
-            
-            fetch('/add_alert', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    title: title,
-                    message: message,
-                    latitude: parseFloat(latitude),
-                    longitude: parseFloat(longitude),
-                    added_by: currentUsername
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Reset form
-                    document.getElementById('alertForm').reset();
-                    document.getElementById('alertLatitude').value = '';
-                    document.getElementById('alertLongitude').value = '';
-                    
-                    // Remove temporary marker and disable alert mode
-                    if (window.tempAlertMarker) {
-                        map.removeLayer(window.tempAlertMarker);
-                        window.tempAlertMarker = null;
-                    }
-                    
-                    // Turn off alert mode
-                    alertMode = false;
-                    const button = document.getElementById('alertModeToggle');
-                    const instructions = document.getElementById('alertInstructions');
-                    button.textContent = '📍 Click to Enable Alert Mode';
-                    button.className = 'px-3 py-2 bg-red-600 text-white rounded text-sm hover:bg-red-700 transition';
-                    instructions.textContent = 'Enable alert mode, then click on the map to set alert location';
-                    
-                    // Reload alerts
-                    loadAlerts();
-                    
-                    alert('Alert added successfully!');
-                } else {
-                    alert('Error adding alert: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error adding alert:', error);
-                alert('Error adding alert');
-            });
-        });
-
-        // Toggle alert mode for admin
-        function toggleAlertMode() {
-            if (!isAdmin) return;
-            
-            alertMode = !alertMode;
-            const button = document.getElementById('alertModeToggle');
-            const instructions = document.getElementById('alertInstructions');
-            
-            if (alertMode) {
-                button.textContent = '🚨 Alert Mode: ON (Click to Disable)';
-                button.className = 'px-3 py-2 bg-green-600 text-white rounded text-sm hover:bg-green-700 transition';
-                instructions.textContent = 'Alert mode enabled - click on the map to place an alert';
-            } else {
-                button.textContent = '📍 Click to Enable Alert Mode';
-                button.className = 'px-3 py-2 bg-red-600 text-white rounded text-sm hover:bg-red-700 transition';
-                instructions.textContent = 'Enable alert mode, then click on the map to set alert location';
-                
-                // Remove any temporary alert marker
-                if (window.tempAlertMarker) {
-                    map.removeLayer(window.tempAlertMarker);
-                    window.tempAlertMarker = null;
-                }
-            }
-        }
-
-        // Delete comment (admin only)
-        function deleteComment(commentId, sourceId) {
-            if (!isAdmin) {
-                alert('Admin access required');
-                return;
-            }
-            
-            if (!confirm('Are you sure you want to delete this comment?')) {
-                return;
-            }
-            
-            fetch('/delete_comment', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    comment_id: commentId,
-                    admin_username: currentUsername
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    showWaterSourceDetails(sourceId);
-                } else {
-                    alert('Error deleting comment: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error deleting comment:', error);
-                alert('Error deleting comment');
-            });
-        }
-
-        // Delete water source (admin only)
-        function deleteWaterSource(sourceId) {
-            if (!isAdmin) {
-                alert('Admin access required');
-                return;
-            }
-            
-            if (!confirm('Are you sure you want to delete this water source? This will also delete all associated comments and votes.')) {
-                return;
-            }
-            
-            fetch('/delete_water_source', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    water_source_id: sourceId,
-                    admin_username: currentUsername
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    hideWaterSourceDetails();
-                    loadWaterSources();
-                    alert('Water source deleted successfully');
-                } else {
-                    alert('Error deleting water source: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error deleting water source:', error);
-                alert('Error deleting water source');
-            });
-        }
-
-        // Calculate distance between two points using Haversine formula
-        function calculateDistance(lat1, lon1, lat2, lon2) {
-            const R = 6371; // Radius of the Earth in kilometers
-            const dLat = (lat2 - lat1) * Math.PI / 180;
-            const dLon = (lon2 - lon1) * Math.PI / 180;
-            const a = 
-                Math.sin(dLat/2) * Math.sin(dLat/2) +
-                Math.cos(lat1 * Math.PI / 180) * Math.cos(lat2 * Math.PI / 180) * 
-                Math.sin(dLon/2) * Math.sin(dLon/2);
-            const c = 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1-a));
-            const distance = R * c; // Distance in kilometers
-            return distance;
-        }
-
-        // Format distance for display
-        function formatDistance(distanceKm) {
-            if (distanceKm < 1) {
-                return Math.round(distanceKm * 1000) + 'm';
-            } else if (distanceKm < 10) {
-                return distanceKm.toFixed(1) + 'km';
-            } else {
-                return Math.round(distanceKm) + 'km';
-            }
-        }
-
-        // Update nearby water sources list
-        function updateNearbyWaterSources(sources = null) {
-            const container = document.getElementById('nearbySourcesContainer');
-            
-            if (!userLocation) {
-                container.innerHTML = `
-                    <div class="text-center py-8 text-gray-500">
-                        <svg class="w-12 h-12 mx-auto mb-3 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M17.657 16.657L13.414 20.9a1.998 1.998 0 01-2.827 0l-4.244-4.243a8 8 0 1111.314 0z"></path>
-                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 11a3 3 0 11-6 0 3 3 0 016 0z"></path>
-                        </svg>
-                        <p>Click "Find Me" to see nearby water sources</p>
-                    </div>
-                `;
-                return;
-            }
-            
-            // If sources not provided, fetch them
-            if (!sources) {
-                fetch('/get_water_sources')
-                .then(response => response.json())
-                .then(data => updateNearbyWaterSources(data))
-                .catch(error => console.error('Error fetching water sources:', error));
-                return;
-            }
-            
-            // Calculate distances and sort by proximity
-            const sourcesWithDistance = sources.map(source => ({
-                ...source,
-                distance: calculateDistance(
-                    userLocation.latitude, 
-                    userLocation.longitude,
-                    source.latitude, 
-                    source.longitude
-                )
-            })).sort((a, b) => a.distance - b.distance);
-            
-            if (sourcesWithDistance.length === 0) {
-                container.innerHTML = `
-                    <div class="text-center py-8 text-gray-500">
-                        <svg class="w-12 h-12 mx-auto mb-3 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-                            <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9.172 16.172a4 4 0 015.656 0M9 12h6m-6 4h6m2 5H7a2 2 0 01-2-2V5a2 2 0 012-2h5.586a1 1 0 01.707.293l5.414 5.414a1 1 0 01.293.707V19a2 2 0 01-2 2z"></path>
-                        </svg>
-                        <p>No water sources found</p>
-                        <p class="text-sm mt-1">Start by adding some water sources to the map!</p>
-                    </div>
-                `;
-                return;
-            }
-            
-            // Display top 10 nearest sources
-            const nearestSources = sourcesWithDistance.slice(0, 10);
-            
-            container.innerHTML = nearestSources.map(source => {
-                const displayQuality = source.admin_override || source.cleanliness_level;
-                const qualityColor = getQualityColor(displayQuality);
-                const qualityEmoji = getQualityEmoji(displayQuality);
-                
-                return `
-                    <div onclick="navigateToWaterSource(${source.id}, ${source.latitude}, ${source.longitude})" 
-                         class="p-3 border border-gray-200 rounded-lg hover:bg-gray-50 cursor-pointer transition">
-                        <div class="flex items-center justify-between">
-                            <div class="flex-1">
-                                <div class="flex items-center mb-1">
-                                    <span class="text-lg mr-2">${qualityEmoji}</span>
-                                    <h4 class="font-medium text-gray-800 truncate">${source.name}</h4>
-                                    ${source.admin_override ? '<span class="ml-2 px-1 py-0.5 bg-blue-200 text-blue-800 text-xs rounded">ADMIN</span>' : ''}
-                                </div>
-                                <div class="flex items-center text-sm text-gray-600">
-                                    <span class="px-2 py-1 ${qualityColor} rounded text-xs mr-2">${displayQuality}</span>
-                                    <span>${source.water_type}</span>
-                                </div>
-                                <div class="text-xs text-gray-500 mt-1">
-                                    Added by ${source.added_by}
-                                </div>
-                            </div>
-                            <div class="text-right ml-3">
-                                <div class="text-sm font-medium text-blue-600">${formatDistance(source.distance)}</div>
-                                <div class="text-xs text-gray-500">away</div>
-                            </div>
-                        </div>
-                    </div>
-                `;
-            }).join('');
-        }
-
-        // Navigate to water source on map and show details
-        function navigateToWaterSource(sourceId, latitude, longitude) {
-            // Center map on the water source
-            map.setView([latitude, longitude], 16);
-            
-            // Find and open the marker popup
-            const marker = waterSourceMarkers.find(m => {
-                const markerLatLng = m.getLatLng();
-                return Math.abs(markerLatLng.lat - latitude) < 0.0001 && 
-                       Math.abs(markerLatLng.lng - longitude) < 0.0001;
-            });
-            
-            if (marker) {
-                marker.openPopup();
-            }
-            
-            // Show details in the panel
-            showWaterSourceDetails(sourceId);
-        }
-
-        // Get quality color for badges
-        function getQualityColor(quality) {
-            switch(quality) {
-                case 'clean':
-                    return 'bg-green-100 text-green-800';
-                case 'muddy':
-                    return 'bg-yellow-100 text-yellow-800';
-                case 'contaminated':
-                    return 'bg-red-100 text-red-800';
-                default:
-                    return 'bg-gray-100 text-gray-800';
-            }
-        }
-
-        // Get quality emoji
-        function getQualityEmoji(quality) {
-            switch(quality) {
-                case 'clean':
-                    return '💧';
-                case 'muddy':
-                    return '🟡';
-                case 'contaminated':
-                    return '🔴';
-                default:
-                    return '❓';
-            }
-        }
-    </script>
-</body>
-</html>
-'''
-
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+@app.route('/')
+def index():
+    return get_index_page().response()
+
+@app.route('/sw.js')
+def service_worker_script():
+    # Served from the root so the worker's scope covers the whole app
+    return get_service_worker().response()
+
+@app.route('/static/<path:filename>')
+def static_asset(filename):
+    asset = get_static_asset(filename)
+    if asset is None:
+        return jsonify({'error': 'File not found'}), 404
+    response = asset.response()
+    # A fingerprinted URL always has the same content
+    if request.args.get('v') == asset.etag[:FINGERPRINT_LENGTH]:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_CACHE_SECONDS
+        response.cache_control.immutable = True
+    return response
 
 @app.route('/analyze_water', methods=['POST'])
 def analyze_water():
@@ -1652,153 +2611,491 @@ def analyze_water():
         if not photo_data:
             return jsonify({'error': 'No photo data provided'}), 400
         
-        cleanliness_level, confidence_score = classifier.analyze_water_image(photo_data)
+        # Store the photo now so add_water_source can refer to it by token
+        try:
+            photo_hash = store_photo(decode_data_url(photo_data))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        return jsonify({
-            'cleanliness_level': cleanliness_level,
-            'confidence_score': confidence_score
-        })
+        # Analysis runs in the background; poll /analysis/<job_id> for the result
+        try:
+            job_id = analysis_queue.submit(photo_hash)
+        except AnalysisQueueFull:
+            return analysis_queue_full_response()
+        
+        job = analysis_queue.job_status(job_id)
+        return jsonify(job), 200 if job['status'] == 'done' else 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analysis/<job_id>')
+def get_analysis(job_id):
+    job = analysis_queue.job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Analysis job not found'}), 404
+    return jsonify(job)
+
+def analysis_queue_full_response():
+    response = jsonify({'success': False, 'error': 'Too many photos are being analyzed, please try again shortly'})
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
+@app.route('/analyze_water/batch', methods=['POST'])
+def analyze_water_batch():
+    try:
+        data = request.get_json()
+        admin_username = data['admin_username']
+        source_ids = data['water_source_ids']
+        
+        # Verify admin access
+        if admin_username.lower() != 'admin':
+            return jsonify({'success': False, 'error': 'Admin access required'}), 403
+        
+        if (not isinstance(source_ids, list) or
+                not all(isinstance(source_id, int) for source_id in source_ids)):
+            return jsonify({'success': False, 'error': 'water_source_ids must be a list of ids'}), 400
+        if len(source_ids) > BATCH_ANALYSIS_MAX_SOURCES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {BATCH_ANALYSIS_MAX_SOURCES} sources per batch, use the reclassify command for more'
+            }), 400
+        
+        # The batch runs in the background; poll /analysis/<job_id> for its totals
+        try:
+            job_id = analysis_queue.submit_batch(source_ids)
+        except AnalysisQueueFull:
+            return analysis_queue_full_response()
+        
+        return jsonify(analysis_queue.job_status(job_id)), 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/add_water_source', methods=['POST'])
 def add_water_source():
     try:
         data = request.get_json()
         
-        # Analyze photo if provided
-        cleanliness_level = None
-        confidence_score = None
-        if data.get('photo_data'):
-            cleanliness_level, confidence_score = classifier.analyze_water_image(data['photo_data'])
+        # Store photo if provided, either inline or as the analysis_token
+        # returned by /analyze_water for an already uploaded photo
+        photo_hash = None
+        if data.get('photo_token'):
+            photo_hash = data['photo_token']
+            if not is_photo_hash(photo_hash) or photo_token_expired(photo_hash):
+                return jsonify({'success': False, 'error': 'Unknown or expired photo token, please re-send the photo'}), 400
+        elif data.get('photo_data'):
+            try:
+                photo_hash = store_photo(decode_data_url(data['photo_data']))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        if photo_hash and not analysis_queue.can_accept(photo_hash):
+            return analysis_queue_full_response()
         
-        # Save to database
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO water_sources 
-            (name, latitude, longitude, water_type, cleanliness_level, confidence_score, notes, photo_data, added_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data['name'],
-            data['latitude'],
-            data['longitude'],
-            data['water_type'],
-            cleanliness_level,
-            confidence_score,
-            data.get('notes', ''),
-            data.get('photo_data', ''),
-            data.get('added_by', 'Anonymous')
-        ))
-        conn.commit()
-        conn.close()
+        # Save to database; the analysis result is filled in when its job completes
+        def insert(conn):
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO water_sources 
+                (name, latitude, longitude, water_type, notes, added_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                data['name'],
+                data['latitude'],
+                data['longitude'],
+                data['water_type'],
+                data.get('notes', ''),
+                data.get('added_by', 'Anonymous')
+            ))
+            source_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO water_sources_rtree (id, min_lat, max_lat, min_lng, max_lng)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                source_id,
+                data['latitude'],
+                data['latitude'],
+                data['longitude'],
+                data['longitude']
+            ))
+            if photo_hash:
+                cursor.execute('INSERT INTO photos (water_source_id, photo_hash) VALUES (?, ?)',
+                               (source_id, photo_hash))
+            log_change(conn, 'water_source', source_id)
+            return source_id
+        source_id = db_writer.submit(insert)
         
-        return jsonify({'success': True})
+        # The source is saved by now, so a failure to queue its analysis is
+        # reported on the job rather than as an error that invites a retry
+        job_id = None
+        if photo_hash:
+            try:
+                job_id = analysis_queue.submit(photo_hash, save_analysis_result(source_id), force=True)
+            except Exception as e:
+                print(f"Error queueing analysis of water source {source_id}: {e}")
+                job_id = analysis_queue.failed_job(photo_hash, str(e))
+        
+        return jsonify({'success': True, 'id': source_id, 'analysis_job_id': job_id})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/get_water_sources')
+@conditional_get('water_sources', cache=response_cache)
 def get_water_sources():
     try:
-        conn = sqlite3.connect('water_sources.db')
-        conn.row_factory = sqlite3.Row  # This allows us to access columns by name
+        # Optional spatial filters: ?bbox=min_lat,min_lng,max_lat,max_lng or ?near=lat,lng&radius_km=
+        # Pages of near results follow distance order, the others (timestamp, id)
+        near = None
+        bbox = None
+        try:
+            if request.args.get('near'):
+                near = parse_lat_lng(request.args['near'])
+                radius_km = float(request.args.get('radius_km', NEARBY_RADIUS_KM))
+                if radius_km <= 0:
+                    raise ValueError('radius_km must be positive')
+                bbox = radius_bbox(near[0], near[1], radius_km)
+            elif request.args.get('bbox'):
+                bbox = parse_bbox(request.args['bbox'])
+            limit, after = parse_page_args(2)
+            ndjson = parse_stream_format()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM water_sources ORDER BY timestamp DESC')
+        if near:
+            rows = query_sources_in_bbox(cursor, *bbox)
+        elif limit is None:
+            if bbox:
+                rows = iter_sources_in_bbox(conn, *bbox)
+            else:
+                cursor.execute(LIST_SOURCES_SQL)
+                rows = iter_rows(cursor)
+            return stream_json_response((water_source_to_dict(row) for row in rows), ndjson)
+        elif bbox:
+            rows = query_sources_in_bbox(cursor, *bbox, limit=limit and limit + 1, after=after)
+        else:
+            if after is None:
+                cursor.execute(LIST_SOURCES_SQL + ' LIMIT ?', (limit + 1,))
+            else:
+                cursor.execute(SOURCES_AFTER_SQL + ' LIMIT ?', (*after, limit + 1))
+            rows = cursor.fetchall()
         
         sources = []
-        for row in cursor.fetchall():
-            sources.append({
-                'id': row['id'],
-                'name': row['name'],
-                'latitude': row['latitude'],
-                'longitude': row['longitude'],
-                'water_type': row['water_type'],
-                'cleanliness_level': row['cleanliness_level'],
-                'confidence_score': row['confidence_score'],
-                'notes': row['notes'],
-                'added_by': row['added_by'] if row['added_by'] else 'Anonymous',
-                'admin_override': row['admin_override'] if 'admin_override' in row.keys() else None,
-                'timestamp': row['timestamp']
-            })
+        for row in rows:
+            if near:
+                distance_km = haversine_km(near[0], near[1], row['latitude'], row['longitude'])
+                if distance_km > radius_km:
+                    continue
+                if after is not None and (distance_km, row['id']) <= tuple(after):
+                    continue
+            sources.append(water_source_to_dict(row))
+            if near:
+                sources[-1]['distance_km'] = distance_km
+        
+        if not near:
+            return page_response(sources, limit, timestamp_cursor_key, ndjson)
+        sources.sort(key=lambda source: (source['distance_km'], source['id']))
+        if limit is not None:
+            return page_response(sources[:limit + 1], limit,
+                                 lambda source: (source['distance_km'], source['id']), ndjson)
+        return stream_json_response(sources, ndjson) if ndjson else jsonify(sources)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/nearest')
+@conditional_get('water_sources')
+def nearest():
+    try:
+        try:
+            lat = float(request.args['lat'])
+            lng = float(request.args['lng'])
+            k = int(request.args.get('k', NEAREST_DEFAULT_K))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'lat, lng and an integer k are required'}), 400
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return jsonify({'error': 'Coordinates out of range'}), 400
+        if not (1 <= k <= NEAREST_MAX_K):
+            return jsonify({'error': f'k must be between 1 and {NEAREST_MAX_K}'}), 400
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        sources = []
+        for distance_km, row in nearest_sources(cursor, lat, lng, k):
+            source = water_source_to_dict(row)
+            source['distance_km'] = distance_km
+            sources.append(source)
         
-        conn.close()
         return jsonify(sources)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_water_source_details/<int:source_id>')
+@conditional_get('water_sources', 'photos')
 def get_water_source_details(source_id):
     try:
-        conn = sqlite3.connect('water_sources.db')
-        conn.row_factory = sqlite3.Row  # This allows us to access columns by name
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM water_sources WHERE id = ?', (source_id,))
+        cursor.execute(SOURCE_BY_ID_SQL, (source_id,))
         
         row = cursor.fetchone()
         if row:
-            source = {
-                'id': row['id'],
-                'name': row['name'],
-                'latitude': row['latitude'],
-                'longitude': row['longitude'],
-                'water_type': row['water_type'],
-                'cleanliness_level': row['cleanliness_level'],
-                'confidence_score': row['confidence_score'],
-                'notes': row['notes'],
-                'added_by': row['added_by'] if row['added_by'] else 'Anonymous',
-                'admin_override': row['admin_override'] if 'admin_override' in row.keys() else None,
-                'timestamp': row['timestamp']
-            }
-            conn.close()
+            source = water_source_to_dict(row)
+            cursor.execute(PHOTO_BY_SOURCE_SQL, (source_id,))
+            photo_row = cursor.fetchone()
+            source['photo_url'] = f"/photo/{photo_row['photo_hash']}" if photo_row else None
             return jsonify(source)
         else:
-            conn.close()
             return jsonify({'error': 'Water source not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/water_source/<int:source_id>/full')
+def get_water_source_full(source_id):
+    """
+    Everything the details panel shows: the source, its vote totals, the vote of
+    ?username= and the first page of comments, read in a single transaction.
+    The ETag changes whenever the source's version does, and differs between
+    databases.
+    """
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        username = request.args.get('username', '')
+        cursor.execute('BEGIN')
+        try:
+            cursor.execute(SOURCE_DETAILS_SQL, (source_id,))
+            row = cursor.fetchone()
+            if not row:
+                return jsonify({'error': 'Water source not found'}), 404
+            
+            # The caller's vote is part of the response, so their name is part of the tag
+            user_tag = hashlib.sha256(username.encode()).hexdigest()[:16] if username else 'anonymous'
+            cursor.execute(DATABASE_ID_SQL)
+            database_id = cursor.fetchone()[0]
+            etag = f"{database_id}-{source_id}-{row['version']}-{user_tag}"
+            matched = matching_etag(etag)
+            if matched:
+                response = app.response_class(status=304)
+                etag = matched
+            else:
+                source = water_source_to_dict(row)
+                cursor.execute(PHOTO_BY_SOURCE_SQL, (source_id,))
+                photo_row = cursor.fetchone()
+                source['photo_url'] = f"/photo/{photo_row['photo_hash']}" if photo_row else None
+                
+                user_vote = None
+                if username:
+                    cursor.execute(USER_VOTE_SQL, (source_id, username))
+                    vote_row = cursor.fetchone()
+                    user_vote = vote_row['vote_type'] if vote_row else None
+                
+                comments = query_comments_page(cursor, source_id, COMMENTS_PAGE_SIZE)
+                more_comments = len(comments) > COMMENTS_PAGE_SIZE
+                
+                response = jsonify({
+                    'source': source,
+                    'votes': {
+                        'upvotes': row['upvotes'],
+                        'downvotes': row['downvotes'],
+                        'user_vote': user_vote
+                    },
+                    'comments': comments[:COMMENTS_PAGE_SIZE],
+                    'comments_cursor': (encode_cursor(comment_cursor_key(comments[COMMENTS_PAGE_SIZE - 1]))
+                                        if more_comments else None)
+                })
+        finally:
+            conn.rollback()
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+SYNC_PAGE_SIZE = 1000
+
+@app.route('/sync')
+def sync():
+    """
+    Changes after ?since=<seq>, oldest first: the current state of each water
+    source and alert added or changed since then, and the ids of those deleted.
+    'seq' is the value to pass next time; while 'more' is true there are further
+    changes to fetch. Without since, only the current seq is returned.
+    """
+    try:
+        try:
+            since = int(request.args['since']) if 'since' in request.args else None
+            limit = int(request.args.get('limit', SYNC_PAGE_SIZE))
+            if not 1 <= limit <= SYNC_PAGE_SIZE:
+                raise ValueError(f'limit must be between 1 and {SYNC_PAGE_SIZE}')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        if since is None:
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+            return jsonify({'seq': cursor.fetchone()[0]})
+        
+        # One read transaction, so the rows match the changes listed
+        cursor.execute('BEGIN')
+        try:
+            cursor.execute(CHANGES_SINCE_SQL, (since, limit + 1))
+            changes = cursor.fetchall()
+            more = len(changes) > limit
+            changes = changes[:limit]
+            
+            upserted = {entity: [] for entity in SYNC_ENTITIES}
+            deleted = {entity: [] for entity in SYNC_ENTITIES}
+            for change in changes:
+                ids = upserted if change['operation'] == 'upsert' else deleted
+                ids[change['entity']].append(change['entity_id'])
+            
+            water_sources = []
+            if upserted['water_source']:
+                placeholders = ','.join('?' * len(upserted['water_source']))
+                cursor.execute(f'''
+                    SELECT {WATER_SOURCE_COLUMNS}, upvotes, downvotes, version
+                    FROM water_sources WHERE id IN ({placeholders})
+                ''', upserted['water_source'])
+                for row in cursor.fetchall():
+                    source = water_source_to_dict(row)
+                    source['upvotes'] = row['upvotes']
+                    source['downvotes'] = row['downvotes']
+                    source['version'] = row['version']
+                    water_sources.append(source)
+            
+            alerts = []
+            if upserted['alert']:
+                placeholders = ','.join('?' * len(upserted['alert']))
+                cursor.execute(f'''
+                    SELECT id, title, message, latitude, longitude, alert_type, added_by, timestamp
+                    FROM alerts WHERE id IN ({placeholders})
+                ''', upserted['alert'])
+                alerts = [alert_to_dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.rollback()
+        
+        return jsonify({
+            'seq': changes[-1]['seq'] if changes else since,
+            'more': more,
+            'water_sources': water_sources,
+            'alerts': alerts,
+            'deleted': {
+                'water_sources': deleted['water_source'],
+                'alerts': deleted['alert']
+            }
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export/region')
+def export_region():
+    """Gzipped SQLite snapshot of ?bbox= for offline use, optionally only changes after ?since=<seq>"""
+    try:
+        try:
+            bbox = parse_bbox(request.args.get('bbox', ''))
+            since = int(request.args['since']) if 'since' in request.args else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        output = tempfile.TemporaryFile()
+        totals = build_region_snapshot(get_db(), bbox, output, since)
+        output.seek(0)
+        response = send_file(output, mimetype='application/gzip', as_attachment=True,
+                             download_name=f"region-{totals['seq']}.sqlite.gz")
+        response.headers['X-Snapshot-Seq'] = str(totals['seq'])
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/photo/<photo_hash>')
+def get_photo(photo_hash):
+    # ?size=thumb|preview serves a downscaled copy instead of the original
+    size = request.args.get('size', 'original')
+    if size != 'original' and size not in PHOTO_SIZES:
+        return jsonify({'error': f'Unknown photo size: {size}'}), 400
+    if not is_photo_hash(photo_hash):
+        return jsonify({'error': 'Photo not found'}), 404
+    if size == 'original':
+        filename = photo_filename(photo_hash)
+    else:
+        filename = photo_derivative(photo_hash, size)
+    served_size = size
+    if not filename:
+        # Photos merged from a region snapshot only have their thumbnail here,
+        # so fall back to the largest smaller copy there is
+        sizes = list(PHOTO_SIZES)
+        for smaller in sizes[0 if size == 'original' else sizes.index(size) + 1:]:
+            if os.path.exists(os.path.join(app.config['PHOTO_DIR'], derivative_filename(photo_hash, smaller))):
+                filename, served_size = derivative_filename(photo_hash, smaller), smaller
+                break
+    if not filename:
+        return jsonify({'error': 'Photo not found'}), 404
+    # Content never changes for a given hash and size, so they make a strong ETag
+    etag = photo_hash if served_size == 'original' else f'{photo_hash}-{served_size}'
+    response = send_from_directory(app.config['PHOTO_DIR'], filename,
+                                   etag=etag, max_age=PHOTO_CACHE_SECONDS)
+    if served_size == size:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # The requested size may arrive later, so the stand-in is revalidated
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    return response
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({'analysis': analysis_cache.stats(), 'responses': response_cache.stats()})
+
 @app.route('/get_votes/<int:source_id>')
+@conditional_get('water_sources', 'vote_totals', 'votes')
 def get_votes(source_id):
+    # Vote totals, plus the vote of ?username= if given
     try:
-        conn = sqlite3.connect('water_sources.db')
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM votes WHERE water_source_id = ?', (source_id,))
-        
-        votes = []
-        for row in cursor.fetchall():
-            votes.append({
-                'id': row[0],
-                'water_source_id': row[1],
-                'username': row[2],
-                'vote_type': row[3],
-                'timestamp': row[4]
-            })
+        cursor.execute(VOTE_COUNTS_SQL, (source_id,))
+        counts = cursor.fetchone()
+        if not counts:
+            return jsonify({'error': 'Water source not found'}), 404
         
-        conn.close()
-        return jsonify(votes)
+        user_vote = None
+        username = request.args.get('username')
+        if username:
+            cursor.execute(USER_VOTE_SQL, (source_id, username))
+            row = cursor.fetchone()
+            user_vote = row['vote_type'] if row else None
+        
+        return jsonify({
+            'water_source_id': source_id,
+            'upvotes': counts['upvotes'],
+            'downvotes': counts['downvotes'],
+            'user_vote': user_vote
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_comments/<int:source_id>')
+@conditional_get('comments')
 def get_comments(source_id):
     try:
-        conn = sqlite3.connect('water_sources.db')
-        conn.row_factory = sqlite3.Row
+        try:
+            limit, after = parse_page_args(3)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM comments WHERE water_source_id = ? ORDER BY is_admin DESC, timestamp DESC', (source_id,))
-        
-        comments = []
-        for row in cursor.fetchall():
-            comments.append({
-                'id': row['id'],
-                'water_source_id': row['water_source_id'],
-                'username': row['username'],
-                'comment': row['comment'],
-                'is_admin': bool(row['is_admin']) if 'is_admin' in row.keys() else False,
-                'timestamp': row['timestamp']
-            })
+        if limit is not None:
+            comments = query_comments_page(cursor, source_id, limit, after)
+            return page_response(comments, limit, comment_cursor_key)
+        
+        cursor.execute(COMMENTS_BY_SOURCE_SQL, (source_id,))
+        comments = [comment_to_dict(row) for row in cursor.fetchall()]
         
-        conn.close()
         return jsonify(comments)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1814,16 +3111,16 @@ def delete_comment():
         if admin_username.lower() != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
         
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM comments WHERE id = ?', (comment_id,))
+        def delete(conn):
+            row = conn.execute('SELECT water_source_id FROM comments WHERE id = ?', (comment_id,)).fetchone()
+            if row is None:
+                return 0
+            bump_source_version(conn, row[0])
+            return conn.execute('DELETE FROM comments WHERE id = ?', (comment_id,)).rowcount
         
-        if cursor.rowcount == 0:
+        if db_writer.submit(delete) == 0:
             return jsonify({'success': False, 'error': 'Comment not found'}), 404
         
-        conn.commit()
-        conn.close()
-        
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1839,23 +3136,12 @@ def delete_water_source():
         if admin_username.lower() != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
         
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        
-        # Delete associated comments first
-        cursor.execute('DELETE FROM comments WHERE water_source_id = ?', (water_source_id,))
-        
-        # Delete associated votes
-        cursor.execute('DELETE FROM votes WHERE water_source_id = ?', (water_source_id,))
-        
-        # Delete the water source
-        cursor.execute('DELETE FROM water_sources WHERE id = ?', (water_source_id,))
-        
-        if cursor.rowcount == 0:
+        found, photo_hash = db_writer.submit(lambda conn: delete_water_source_rows(conn, water_source_id))
+        if not found:
             return jsonify({'success': False, 'error': 'Water source not found'}), 404
         
-        conn.commit()
-        conn.close()
+        if photo_hash:
+            remove_unreferenced_photo(get_db().cursor(), photo_hash)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1868,18 +3154,10 @@ def vote():
         water_source_id = data['water_source_id']
         username = data['username']
         vote_type = data['vote_type']
+        if vote_type not in VOTE_COUNTER_COLUMNS:
+            return jsonify({'success': False, 'error': 'vote_type must be upvote or downvote'}), 400
         
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        
-        # Replace existing vote or insert new one
-        cursor.execute('''
-            INSERT OR REPLACE INTO votes (water_source_id, username, vote_type)
-            VALUES (?, ?, ?)
-        ''', (water_source_id, username, vote_type))
-        
-        conn.commit()
-        conn.close()
+        db_writer.submit(lambda conn: record_vote(conn, water_source_id, username, vote_type))
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1894,15 +3172,14 @@ def add_comment():
         comment = data['comment']
         is_admin = data.get('is_admin', False)
         
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO comments (water_source_id, username, comment, is_admin)
-            VALUES (?, ?, ?, ?)
-        ''', (water_source_id, username, comment, is_admin))
+        def insert(conn):
+            conn.execute('''
+                INSERT INTO comments (water_source_id, username, comment, is_admin)
+                VALUES (?, ?, ?, ?)
+            ''', (water_source_id, username, comment, is_admin))
+            bump_source_version(conn, water_source_id)
         
-        conn.commit()
-        conn.close()
+        db_writer.submit(insert)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -1920,43 +3197,42 @@ def admin_override():
         if admin_username.lower() != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
         
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE water_sources 
-            SET admin_override = ?
-            WHERE id = ?
-        ''', (quality, water_source_id))
+        def update(conn):
+            conn.execute('''
+                UPDATE water_sources 
+                SET admin_override = ?, version = version + 1
+                WHERE id = ?
+            ''', (quality, water_source_id))
+            log_change(conn, 'water_source', water_source_id)
         
-        conn.commit()
-        conn.close()
+        db_writer.submit(update)
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/get_alerts')
+@conditional_get('alerts', cache=response_cache)
 def get_alerts():
     try:
-        conn = sqlite3.connect('water_sources.db')
+        try:
+            limit, after = parse_page_args(2)
+            ndjson = parse_stream_format()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM alerts ORDER BY timestamp DESC')
-        
-        alerts = []
-        for row in cursor.fetchall():
-            alerts.append({
-                'id': row[0],
-                'title': row[1],
-                'message': row[2],
-                'latitude': row[3],
-                'longitude': row[4],
-                'alert_type': row[5],
-                'added_by': row[6],
-                'timestamp': row[7]
-            })
+        if limit is None:
+            cursor.execute(LIST_ALERTS_SQL)
+            return stream_json_response((alert_to_dict(row) for row in iter_rows(cursor)), ndjson)
         
-        conn.close()
-        return jsonify(alerts)
+        if after is None:
+            cursor.execute(LIST_ALERTS_SQL + ' LIMIT ?', (limit + 1,))
+        else:
+            cursor.execute(ALERTS_AFTER_SQL + ' LIMIT ?', (*after, limit + 1))
+        alerts = [alert_to_dict(row) for row in cursor.fetchall()]
+        return page_response(alerts, limit, timestamp_cursor_key, ndjson)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1969,30 +3245,113 @@ def add_alert():
         if data.get('added_by', '').lower() != 'admin':
             return jsonify({'success': False, 'error': 'Admin access required'}), 403
         
-        conn = sqlite3.connect('water_sources.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO alerts (title, message, latitude, longitude, added_by)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            data['title'],
-            data['message'],
-            data['latitude'],
-            data['longitude'],
-            data['added_by']
-        ))
+        def insert(conn):
+            cursor = conn.execute('''
+                INSERT INTO alerts (title, message, latitude, longitude, added_by)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                data['title'],
+                data['message'],
+                data['latitude'],
+                data['longitude'],
+                data['added_by']
+            ))
+            log_change(conn, 'alert', cursor.lastrowid)
         
-        conn.commit()
-        conn.close()
+        db_writer.submit(insert)
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Where's the Well? - Water Source Locator")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='run the web application (default)')
+    reclassify_parser = subparsers.add_parser('reclassify', help='re-run water quality analysis on every stored photo')
+    reclassify_parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                                   help='analysis processes (default: one per CPU)')
+    reclassify_parser.add_argument('--chunk-size', type=int, default=RECLASSIFY_CHUNK_SIZE,
+                                   help='photos analyzed and committed per batch')
+    subparsers.add_parser('repair-vote-counts', help='recount votes and fix any water source counters that disagree')
+    subparsers.add_parser('sweep-photos', help='delete uploaded photos that no water source links to')
+    export_parser = subparsers.add_parser('export-region', help='write an offline snapshot of a region')
+    export_parser.add_argument('--bbox', required=True, help='min_lat,min_lng,max_lat,max_lng')
+    export_parser.add_argument('--since', type=int, help='only include changes after this snapshot seq')
+    export_parser.add_argument('--output', required=True, help='snapshot file to write (.sqlite.gz)')
+    import_parser = subparsers.add_parser('import-region', help='merge a region snapshot into the database')
+    import_parser.add_argument('snapshot', help='snapshot file from export-region or /export/region')
+    migrate_parser = subparsers.add_parser('migrate', help='bring the database schema up to date')
+    migrate_parser.add_argument('--dry-run', action='store_true',
+                                help='list pending migrations and the rows they would touch')
+    args = parser.parse_args()
+    
+    if args.command == 'migrate' and args.dry_run:
+        conn = connect_db()
+        pending = estimate_migrations(conn)
+        print(f"Schema version {schema_version(conn)}, latest {MIGRATIONS[-1].version}")
+        for migration, rows in pending:
+            print(f"  {migration.version}: {migration.description} (~{rows} rows)")
+        if not pending:
+            print("Nothing to migrate")
+        conn.close()
+        sys.exit(0)
+    
     # Initialize database
     init_db()
     
+    if args.command == 'migrate':
+        sys.exit(0)
+    
+    if args.command == 'export-region':
+        conn = connect_db()
+        with open(args.output, 'wb') as output:
+            totals = build_region_snapshot(conn, parse_bbox(args.bbox), output, args.since)
+        conn.close()
+        print(f"Wrote {args.output}: {totals['water_sources']} water sources, {totals['votes']} votes, "
+              f"{totals['comments']} comments, {totals['alerts']} alerts, {totals['thumbnails']} thumbnails, "
+              f"{totals['deleted']} deletions (seq {totals['seq']})")
+        sys.exit(0)
+    
+    if args.command == 'import-region':
+        totals = merge_region_snapshot(args.snapshot)
+        print(f"Water sources: {totals['added']} added, {totals['updated']} updated, "
+              f"{totals['unchanged']} already up to date or deleted, {totals['deleted']} deleted; "
+              f"votes changed on {totals['votes']}; {totals['comments']} comments and {totals['alerts']} alerts added")
+        if totals['comments_renumbered']:
+            print(f"{totals['comments_renumbered']} merged comments had an id already used by a different "
+                  f"comment here and were added under a new id")
+        if totals['comments_skipped']:
+            print(f"{totals['comments_skipped']} comments skipped because their water source is not here")
+        print(f"Snapshot seq {totals['seq']}: export with --since {totals['seq']} for the next update")
+        sys.exit(0)
+    
+    if args.command == 'repair-vote-counts':
+        conn = connect_db()
+        print(f"Repaired vote counts of {repair_vote_counts(conn)} water sources")
+        conn.close()
+        sys.exit(0)
+    
+    if args.command == 'sweep-photos':
+        conn = connect_db()
+        print(f"Removed {sweep_unreferenced_photos(conn)} unreferenced photos from the photo store")
+        conn.close()
+        sys.exit(0)
+    
+    if args.command == 'reclassify':
+        def report(totals):
+            print(f"{totals['processed']} photos, {totals['changed']} changed, "
+                  f"{totals['photos_per_second']:.1f} photos/s")
+        
+        conn = connect_db()
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            totals = reclassify_sources(conn, executor, chunk_size=args.chunk_size, progress=report)
+        conn.close()
+        print(f"Reclassified {totals['processed']} photos in {totals['seconds']:.1f}s "
+              f"({totals['photos_per_second']:.1f} photos/s), {totals['changed']} changed, "
+              f"{totals['missing']} missing from the photo store")
+        sys.exit(0)
+    
     print("Where's the Well? - Water Source Locator")
     print("=" * 50)
     print("Starting application...")
@@ -2000,4 +3359,5 @@ if __name__ == '__main__':
 
     
     # Run the Flask app
+    start_background_tasks()
     app.run(debug=True, host='0.0.0.0', port=5000)